@@ -0,0 +1,43 @@
+# %% Compare building the track dataframe row by row with df.loc against the ColumnAccumulator
+import timeit
+import numpy as np
+import pandas as pd
+from rainbow_util import ColumnAccumulator, TRACK_COLUMNS
+
+
+def append_row(df:pd.DataFrame, row:list)->None:
+    '''The old way: append a row to a dataframe, copying it every time
+    :param df: dataframe to append to
+    :param row: row to append'''
+    df.loc[len(df.index)] = row
+
+def make_rows(n:int)->list:
+    '''Generate n fake track rows'''
+    rng = np.random.default_rng(0)
+    return [[f'track{i}', int(rng.integers(6)), float(rng.random()), int(rng.integers(1, 20)), f'https://covers/{i}']
+        for i in range(n)]
+
+def build_with_append_row(rows:list)->pd.DataFrame:
+    df = pd.DataFrame(columns=list(TRACK_COLUMNS))
+    for row in rows:
+        append_row(df, row)
+    return df
+
+def build_with_accumulator(rows:list)->pd.DataFrame:
+    # no capacity hint, to include the cost of growing the columns
+    accumulator = ColumnAccumulator(TRACK_COLUMNS)
+    for row in rows:
+        accumulator.append(row)
+    return accumulator.to_dataframe()
+
+# %%
+print(f'{"rows":>6} {"append_row":>12} {"accumulator":>12} {"speedup":>8}')
+for n in [100, 1_000, 10_000]:
+    rows = make_rows(n)
+    # the row by row version takes long enough at 10k that one run is plenty
+    append_s = timeit.timeit(lambda: build_with_append_row(rows), number=1)
+    accumulator_s = min(timeit.repeat(lambda: build_with_accumulator(rows), number=1, repeat=5))
+    print(f'{n:>6} {append_s:>11.3f}s {accumulator_s:>11.4f}s {append_s/accumulator_s:>7.0f}x')
+#end for
+
+# %%
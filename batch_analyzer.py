@@ -0,0 +1,232 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, Optional
+from PIL import Image
+from rainbow_util import PixelBuffer, get_image_color_features
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+
+def list_images(directory:str)->Iterator[str]:
+    '''List the image files in a directory and its subdirectories, in a stable order
+    :param directory: the directory to search
+    :return: an iterator of image file paths'''
+    for (root, dirs, files) in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, file)
+    #end for
+
+def result_columns(band_deg:int)->list:
+    '''The columns of the results: the file, its primary band and perceived brightness, the weight of every band,
+    and the error if the file couldn't be analyzed'''
+    return ['path', 'band', 'pb'] + [f'band_{k}' for k in range(360 // band_deg)] + ['error']
+
+def analyze_files(paths:list, band_deg:int, max_pixels:Optional[int])->list:
+    '''Analyze a chunk of image files, runs in a worker process.
+    A file that can't be read gets a row with just the error, so one bad file doesn't stop the batch
+    :param paths: the image files
+    :param band_deg: size of the rainbow band partition in degrees
+    :param max_pixels: optional pixel budget, see rainbow_util.sample_pixels
+    :return: a list of result rows, one per file'''
+    rows = []
+    # one pixel buffer for all the files
+    buffer = PixelBuffer()
+    for path in paths:
+        try:
+            with Image.open(path) as image:
+                features = get_image_color_features(image, band_deg, max_pixels, out=buffer)
+            rows.append([path, features.primary_band, features.pb] + features.bands.tolist() + [''])
+        except Exception as e:
+            rows.append([path, '', ''] + [''] * (360 // band_deg) + [f'{type(e).__name__}: {e}'])
+    #end for
+    return rows
+
+def _check_columns(path:str, existing:list, columns:list)->None:
+    # the rows of a run with other settings (e.g. another band_deg) can't go in with the ones already there
+    if existing != columns:
+        raise ValueError(f'{path} has the columns {existing}, not {columns}; '
+            + 'use a new output or the same settings as the run that wrote it')
+
+class CsvResultWriter:
+    '''Append results to a CSV file, picking up where an interrupted run left off.
+    The files that failed before get another go: their error rows are taken out of the file and they're
+    analyzed again. The file has to have the same columns, so the same band_deg, as the results'''
+    def __init__(self, path:str, columns:list):
+        self.done = set()
+        self.retried = 0
+        if os.path.exists(path):
+            # drop a half written last line, if the previous run got killed in the middle of writing it
+            with open(path, 'rb+') as f:
+                data = f.read()
+                f.truncate(data.rfind(b'\n') + 1)
+            with open(path, newline='') as f:
+                reader = csv.DictReader(f)
+                if reader.fieldnames is not None:
+                    _check_columns(path, reader.fieldnames, columns)
+                rows = list(reader)
+            results = [row for row in rows if not row['error']]
+            self.done = {row['path'] for row in results}
+            self.retried = len(rows) - len(results)
+            if self.retried:
+                temp_path = path + '.tmp'
+                with open(temp_path, 'w', newline='') as f:
+                    writer = csv.DictWriter(f, columns)
+                    writer.writeheader()
+                    writer.writerows(results)
+                os.replace(temp_path, path)
+            #end if
+        #end if
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+        if new_file:
+            self._writer.writerow(columns)
+
+    def write(self, rows:list)->None:
+        self._writer.writerows(rows)
+        # make sure a finished chunk survives an interruption
+        self._file.flush()
+
+    def close(self)->None:
+        self._file.close()
+
+class ParquetResultWriter:
+    '''Write results as a directory of Parquet files, one per chunk, picking up where an interrupted run left off.
+    The files that failed before get another go: the Parquet files with their error rows are written again
+    without them. The files already there have to have the same columns, so the same band_deg, as the results.
+    Needs pyarrow'''
+    def __init__(self, path:str, columns:list):
+        import pyarrow.parquet as pq
+        self._pq = pq
+        self._path = path
+        self._columns = columns
+        os.makedirs(path, exist_ok=True)
+        # only complete files count, a partly written one has its temporary name and gets written again
+        parts = sorted(f for f in os.listdir(path) if f.startswith('part-') and f.endswith('.parquet'))
+        self.done = set()
+        self.retried = 0
+        for part in parts:
+            part_path = os.path.join(path, part)
+            _check_columns(path, pq.read_schema(part_path).names, columns)
+            table = pq.read_table(part_path, columns=['path', 'error'])
+            ok = [error is None for error in table.column('error').to_pylist()]
+            self.done.update(p for (p, analyzed) in zip(table.column('path').to_pylist(), ok) if analyzed)
+            if not all(ok):
+                self.retried += ok.count(False)
+                results = pq.read_table(part_path).filter(ok)
+                if len(results) == 0:
+                    os.remove(part_path)
+                else:
+                    temp_path = os.path.join(path, f'_{part}.tmp')
+                    pq.write_table(results, temp_path)
+                    os.replace(temp_path, part_path)
+            #end if
+        #end for
+        # number the new files after the existing ones
+        self._part = int(parts[-1][len('part-'):-len('.parquet')]) + 1 if parts else 0
+
+    def write(self, rows:list)->None:
+        import pyarrow as pa
+        # the same types in every file, also for a chunk with no errors (or nothing but errors)
+        schema = pa.schema([(column, pa.string() if column in ('path', 'error') else
+            pa.int64() if column == 'band' else pa.float64()) for column in self._columns])
+        table = pa.Table.from_pydict({
+            column: [row[i] if row[i] != '' else None for row in rows] for (i, column) in enumerate(self._columns)},
+            schema=schema)
+        name = f'part-{self._part:06d}.parquet'
+        # written under a name starting with _ first, which readers of the directory skip, then renamed
+        temp_path = os.path.join(self._path, f'_{name}.tmp')
+        self._pq.write_table(table, temp_path)
+        os.replace(temp_path, os.path.join(self._path, name))
+        self._part += 1
+
+    def close(self)->None:
+        pass
+
+def analyze_directory(directory:str, output:str, band_deg:int=30, workers:Optional[int]=None, chunk_size:int=64,
+        max_pixels:Optional[int]=None, output_format:str='csv')->int:
+    '''Analyze all the images in a directory (and its subdirectories) on a pool of worker processes,
+    writing the results as each chunk of files finishes. Files already in the output are skipped and the ones
+    that failed are tried again, so an interrupted run can simply be started again
+    :param directory: the directory with the images
+    :param output: the CSV file, or directory of Parquet files, to write the results to
+    :param band_deg: size of the rainbow band partition in degrees
+    :param workers: number of worker processes, None for one per CPU
+    :param chunk_size: number of files per unit of work handed to a worker
+    :param max_pixels: optional pixel budget per image, see rainbow_util.sample_pixels
+    :param output_format: 'csv' or 'parquet'
+    :return: the number of images analyzed'''
+    columns = result_columns(band_deg)
+    writer = ParquetResultWriter(output, columns) if output_format == 'parquet' else CsvResultWriter(output, columns)
+    paths = [path for path in list_images(directory) if path not in writer.done]
+    chunks = (paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size))
+    workers = workers or os.cpu_count()
+    analyzed = 0
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for chunk in chunks:
+                pending.add(pool.submit(analyze_files, chunk, band_deg, max_pixels))
+                # keep every worker busy, but don't queue up the whole directory
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        rows = future.result()
+                        writer.write(rows)
+                        analyzed += len(rows)
+                #end if
+            #end for
+            for future in wait(pending).done:
+                rows = future.result()
+                writer.write(rows)
+                analyzed += len(rows)
+        #end with
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    print(f'{analyzed} images analyzed in {elapsed:.1f}s ({analyzed/max(elapsed, 1e-9):.0f} images/s), ' \
+        + f'{len(writer.done)} skipped from a previous run, {writer.retried} tried again after failing',
+        file=sys.stderr)
+    return analyzed
+
+def main(argv:Optional[list]=None)->None:
+    '''Command line entry point, e.g. python -m rainbow_util analyze test_covers/ -o covers.csv
+    or python -m rainbow_util serve --port 8765'''
+    parser = argparse.ArgumentParser(prog='rainbow_util', description='Rainbow band analysis of album covers')
+    commands = parser.add_subparsers(dest='command', required=True)
+    analyze = commands.add_parser('analyze', help='analyze a directory of cover images')
+    analyze.add_argument('directory')
+    analyze.add_argument('-o', '--output', default='covers.csv',
+        help='CSV file, or directory for --format parquet (default: covers.csv)')
+    analyze.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    analyze.add_argument('--band-deg', type=int, default=30)
+    analyze.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    analyze.add_argument('--chunk-size', type=int, default=64, help='files per unit of work')
+    analyze.add_argument('--max-pixels', type=int, default=None, help='pixel budget per image')
+    serve = commands.add_parser('serve', help='run the cover analysis HTTP service, see cover_service')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--cache', default='cover_cache.sqlite', help='the cover cache database, "" for none')
+    serve.add_argument('--band-deg', type=int, default=60)
+    serve.add_argument('--workers', type=int, default=None, help='analysis processes (default: one per CPU)')
+    serve.add_argument('--batch-size', type=int, default=16, help='the most covers per batch of analysis')
+    serve.add_argument('--max-pixels', type=int, default=None, help='pixel budget per image')
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        from cover_service import run
+        run(args.host, args.port, args.cache, band_deg=args.band_deg, analysis_workers=args.workers,
+            batch_size=args.batch_size, max_pixels=args.max_pixels)
+    else:
+        analyze_directory(args.directory, args.output, args.band_deg, args.workers, args.chunk_size,
+            args.max_pixels, args.format)
+#end def
+
+if __name__ == '__main__':
+    main()
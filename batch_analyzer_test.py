@@ -0,0 +1,96 @@
+# %% Analyze a directory of covers, pick up an interrupted run where it left off, to CSV and to Parquet
+import csv
+import os
+import shutil
+import tempfile
+import pyarrow.parquet as pq
+from batch_analyzer import analyze_directory, result_columns
+
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))[:20]
+work_dir = tempfile.mkdtemp()
+cover_dir = os.path.join(work_dir, 'covers')
+os.makedirs(os.path.join(cover_dir, 'more'))
+for (i, image) in enumerate(image_list):
+    shutil.copy(image_path + image, os.path.join(cover_dir, 'more' if i % 2 else '', image))
+# a file that isn't an image gets a row with the error
+with open(os.path.join(cover_dir, 'broken.jpg'), 'wb') as f:
+    f.write(b'not a jpeg')
+
+def read_csv(path:str)->list:
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+#end def
+
+# %% All the covers, one row each; the broken one with its error
+output = os.path.join(work_dir, 'covers.csv')
+assert analyze_directory(cover_dir, output, band_deg=30, workers=2, chunk_size=4) == 21
+rows = read_csv(output)
+assert list(rows[0]) == result_columns(30) and len(rows) == 21
+assert len({row['path'] for row in rows}) == 21
+errors = [row for row in rows if row['error']]
+assert len(errors) == 1 and errors[0]['path'].endswith('broken.jpg') and errors[0]['band'] == ''
+assert all(0 <= int(row['band']) < 12 and 0 <= float(row['pb']) <= 1 for row in rows if not row['error'])
+
+# %% Interrupted after 8 rows and in the middle of the 9th: the run again only does the rest,
+# and the broken file again if it was among the 8
+with open(output, 'rb') as f:
+    lines = f.read().split(b'\n')
+with open(output, 'wb') as f:
+    f.write(b'\n'.join(lines[:9]) + b'\n' + lines[9][:10])
+broken_kept = any(b'broken.jpg' in line for line in lines[1:9])
+assert analyze_directory(cover_dir, output, band_deg=30, workers=2, chunk_size=4) == 13 + broken_kept
+resumed = read_csv(output)
+assert sorted(resumed, key=lambda row: row['path']) == sorted(rows, key=lambda row: row['path'])
+# and again, with nothing left to do but the file that failed, which still does
+assert analyze_directory(cover_dir, output, band_deg=30, workers=2) == 1
+by_path = lambda row: row['path']
+assert sorted(read_csv(output), key=by_path) == sorted(resumed, key=by_path)
+
+# %% A file that failed gets tried again, e.g. after a read error that went away
+shutil.copy(image_path + image_list[0], os.path.join(cover_dir, 'broken.jpg'))
+assert analyze_directory(cover_dir, output, band_deg=30, workers=2) == 1
+fixed = read_csv(output)
+assert len(fixed) == 21 and not any(row['error'] for row in fixed)
+assert analyze_directory(cover_dir, output, band_deg=30, workers=2) == 0
+with open(os.path.join(cover_dir, 'broken.jpg'), 'wb') as f:
+    f.write(b'not a jpeg')
+
+# %% Another band_deg doesn't go in the same file
+try:
+    analyze_directory(cover_dir, output, band_deg=60, workers=2)
+    assert False
+except ValueError as e:
+    print(e)
+assert read_csv(output) == fixed
+
+# %% Parquet: a file per chunk, a partly written one gets written again
+output = os.path.join(work_dir, 'covers.parquet')
+assert analyze_directory(cover_dir, output, band_deg=30, workers=2, chunk_size=4, output_format='parquet') == 21
+parts = sorted(os.listdir(output))
+assert len(parts) == 6
+table = pq.read_table(output).to_pandas()
+assert list(table.columns) == result_columns(30) and len(table) == 21
+# the last two chunks didn't get written, the second to last only partly
+os.remove(os.path.join(output, parts[-1]))
+os.remove(os.path.join(output, parts[-2]))
+with open(os.path.join(output, f'_{parts[-2]}.tmp'), 'wb') as f:
+    f.write(b'PAR1')
+# which doesn't get in the way of reading the directory; what's left, and the broken file, get done
+left = 21 - pq.read_table(output).to_pandas()['error'].isna().sum()
+assert left > 4
+assert analyze_directory(cover_dir, output, band_deg=30, workers=2, output_format='parquet') == left
+resumed = pq.read_table(output).to_pandas()
+assert sorted(resumed['path']) == sorted(table['path'])
+# the broken file failed again, and took the place of its old row rather than being added to it
+assert analyze_directory(cover_dir, output, band_deg=30, workers=2, output_format='parquet') == 1
+resumed = pq.read_table(output).to_pandas()
+assert sorted(resumed['path']) == sorted(table['path']) and resumed['error'].notna().sum() == 1
+try:
+    analyze_directory(cover_dir, output, band_deg=60, workers=2, output_format='parquet')
+    assert False
+except ValueError as e:
+    print(e)
+
+shutil.rmtree(work_dir)
+# %%
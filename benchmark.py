@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+from typing import Callable, Optional
+import numpy as np
+from PIL import Image
+from rainbow_util import *
+import color_utility
+from color_lut import get_pixels_rainbow_bands_and_perceived_brightness_lut, load_color_lut
+from palette import get_palettes
+from gradient_order import gradient_order
+
+# synthetic image sizes (width = height) and random color set sizes
+IMAGE_SIZES = [64, 300, 640, 1000]
+COLOR_COUNTS = [1_000, 10_000, 100_000, 1_000_000]
+# the pure Python versions take minutes on the biggest inputs, so they stop here
+PER_PIXEL_MAX = 100_000
+# playlist sizes for ordering the covers
+ORDER_COUNTS = [1_000, 10_000, 100_000]
+
+image_path = 'test_covers/'
+
+
+class Case:
+    '''A benchmark case: a function to run and how much work (pixels, images, colors) one run of it does'''
+    def __init__(self, name:str, unit:str, work:int, run:Callable[[], object]):
+        self.name = name
+        self.unit = unit
+        self.work = work
+        self.run = run
+
+
+def synthetic_image(size:int)->Image:
+    '''A size x size image of smooth color gradients plus noise, so every band and brightness gets some pixels'''
+    rng = np.random.default_rng(size)
+    x, y = np.meshgrid(np.linspace(0, 1, size), np.linspace(0, 1, size))
+    rgb = np.stack([x, y, 1 - (x + y) / 2], axis=-1) * 255 + rng.normal(0, 20, (size, size, 3))
+    return Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8), 'RGB')
+
+def random_colors(n:int)->np.ndarray:
+    '''n random [0, 1] colors as an (n, 3) array'''
+    return np.random.default_rng(n).random((n, 3))
+
+def random_covers(n:int, band_cnt:int=6)->tuple:
+    '''n covers' band weights, peaking in a band or two and adding up to a random saturation, and brightness'''
+    rng = np.random.default_rng(n)
+    bands = rng.random((n, band_cnt)) ** 4
+    return bands / bands.sum(axis=1, keepdims=True) * rng.random((n, 1)), rng.random(n)
+
+def build_cases(quick:bool=False)->list:
+    '''Collect the benchmark cases
+    :param quick: only use the smaller inputs
+    :return: a list of Cases'''
+    cases = []
+    image_sizes = IMAGE_SIZES[:2] if quick else IMAGE_SIZES
+    color_counts = COLOR_COUNTS[:2] if quick else COLOR_COUNTS
+
+    for n in color_counts:
+        colors = random_colors(n)
+        if n <= PER_PIXEL_MAX:
+            color_tuples = [tuple(c) for c in colors.tolist()]
+            cases.append(Case(f'rgb_to_hsp/{n}', 'colors/s', n, lambda c=color_tuples: [rgb_to_hsp(x) for x in c]))
+            cases.append(Case(f'enrich_color/{n}', 'colors/s', n,
+                lambda c=color_tuples: [color_utility.enrich_color(x) for x in c]))
+        cases.append(Case(f'rgb_to_hsp_array/{n}', 'colors/s', n, lambda c=colors: rgb_to_hsp_array(c)))
+        cases.append(Case(f'enrich_colors/{n}', 'colors/s', n, lambda c=colors: color_utility.enrich_colors(c)))
+    #end for
+
+    # ordering a playlist's covers: sorting by band and brightness against the smooth gradient
+    for n in (ORDER_COUNTS[:2] if quick else ORDER_COUNTS):
+        (bands, pb) = random_covers(n)
+        cases.append(Case(f'order_band_sort/{n}', 'covers/s', n,
+            lambda b=bands, p=pb: np.lexsort((p, np.argmax(b, axis=1)))))
+        cases.append(Case(f'order_gradient/{n}', 'covers/s', n, lambda b=bands, p=pb: gradient_order(b, p)))
+    #end for
+
+    # build (or load) the color table up front rather than in the first timed run
+    load_color_lut(30, bits=6)
+    for size in image_sizes:
+        image = synthetic_image(size)
+        pixels = image_to_pixels(image)
+        if size * size <= PER_PIXEL_MAX:
+            cases.append(Case(f'bands_per_pixel/{size}px', 'pixels/s', size * size,
+                lambda i=image: get_image_rainbow_bands_and_perceived_brightness_per_pixel(i, 30)))
+        cases.append(Case(f'bands/{size}px', 'pixels/s', size * size,
+            lambda p=pixels: get_pixels_rainbow_bands_and_perceived_brightness(p, 30)))
+        cases.append(Case(f'bands_lut6/{size}px', 'pixels/s', size * size,
+            lambda p=pixels: get_pixels_rainbow_bands_and_perceived_brightness_lut(p, 30, bits=6)))
+    #end for
+
+    # the covers, from file to bands, decoding included
+    covers = [os.path.join(image_path, f) for f in sorted(os.listdir(image_path))]
+    # decoding alone: the generic convert to RGB against reading the decoded pixels into a reused buffer
+    cover_files = []
+    for c in covers:
+        with open(c, 'rb') as f:
+            cover_files.append(f.read())
+    buffer = PixelBuffer()
+    cases.append(Case('covers/decode_convert', 'images/s', len(covers),
+        lambda: [np.asarray(Image.open(BytesIO(d)).convert('RGB')).reshape(-1, 3) for d in cover_files]))
+    cases.append(Case('covers/decode', 'images/s', len(covers),
+        lambda: [image_to_pixels(Image.open(BytesIO(d)), buffer) for d in cover_files]))
+    cases.append(Case('covers/decode+bands', 'images/s', len(covers),
+        lambda: [get_image_rainbow_bands_and_perceived_brightness(Image.open(c), 30) for c in covers]))
+    # the palettes of all the covers in one batch, decoding included
+    cases.append(Case('covers/palette', 'images/s', len(covers),
+        lambda: get_palettes([image_to_pixels(Image.open(BytesIO(d))) for d in cover_files], 5, 5)))
+    try:
+        from colorthief import ColorThief
+        # the same settings as sorted_albums_test uses
+        cases.append(Case('covers/colorthief_palette', 'images/s', len(covers),
+            lambda: [ColorThief(c).get_palette(quality=5, color_count=5) for c in covers]))
+    except ImportError:
+        print('colorthief is not installed, skipping the palette benchmark', file=sys.stderr)
+    return cases
+
+def time_case(case:Case, min_time:float=0.2)->float:
+    '''Time a case: run it until at least min_time seconds have passed (and at least 3 times), keep the best run
+    :return: the best run time in seconds'''
+    best = float('inf')
+    runs = 0
+    start = time.perf_counter()
+    while runs < 3 or time.perf_counter() - start < min_time:
+        run_start = time.perf_counter()
+        case.run()
+        best = min(best, time.perf_counter() - run_start)
+        runs += 1
+    #end while
+    return best
+
+def peak_memory(case:Case)->float:
+    '''Measure the peak memory allocated during one run of a case, separately from the timing since
+    tracing the allocations slows the run down
+    :return: the peak in MB'''
+    tracemalloc.start()
+    try:
+        case.run()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+def run_benchmarks(cases:list, name_filter:Optional[str]=None)->dict:
+    '''Run the cases and print their results as they go
+    :param cases: the cases to run
+    :param name_filter: only run the cases with this in their name
+    :return: the results by case name'''
+    results = {}
+    print(f'{"case":<32} {"throughput":>20} {"time":>10} {"peak mem":>9}')
+    for case in cases:
+        if name_filter and name_filter not in case.name:
+            continue
+        seconds = time_case(case)
+        results[case.name] = {'throughput': case.work / seconds, 'unit': case.unit, 'seconds': seconds,
+            'peak_mb': peak_memory(case)}
+        print(f'{case.name:<32} {case.work/seconds:>11.4g} {case.unit:<8} {seconds*1000:>8.2f}ms ' \
+            + f'{results[case.name]["peak_mb"]:>7.1f}MB')
+    #end for
+    return results
+
+def compare(results:dict, baseline:dict, tolerance:float)->list:
+    '''Compare results to a baseline
+    :param results: the results of this run
+    :param baseline: the results of an earlier run
+    :param tolerance: how much slower than the baseline a case can get before it counts as a regression, 0.2 = 20%
+    :return: the names of the regressed cases'''
+    regressions = []
+    print(f'\n{"case":<32} {"baseline":>12} {"now":>12} {"change":>8}')
+    for (name, result) in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['throughput']
+        change = result['throughput'] / before - 1
+        regressed = change < -tolerance
+        if regressed:
+            regressions.append(name)
+        print(f'{name:<32} {before:>12.4g} {result["throughput"]:>12.4g} {change:>+7.0%}' \
+            + (' REGRESSION' if regressed else ''))
+    #end for
+    return regressions
+
+def main(argv:Optional[list]=None)->None:
+    '''Command line entry point, e.g.
+    python benchmark.py --save baseline.json   and later   python benchmark.py --compare baseline.json'''
+    parser = argparse.ArgumentParser(description='Benchmark the color analysis hot paths')
+    parser.add_argument('--quick', action='store_true', help='only the smaller inputs')
+    parser.add_argument('--filter', help='only run the cases with this in their name')
+    parser.add_argument('--save', help='save the results as a JSON baseline')
+    parser.add_argument('--compare', help='compare the results to a JSON baseline, exit with 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown vs the baseline (default 0.2)')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(build_cases(args.quick), args.filter)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s): {", ".join(regressions)}')
+            sys.exit(1)
+    #end if
+#end def
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import os
+from typing import Tuple
+import numpy as np
+from rainbow_util import ALGORITHM_VERSION, rgb_to_hsp_array
+
+# where the tables get stored once built
+LUT_DIR = '.color_lut'
+
+# what the table holds for every color
+LUT_DTYPE = np.dtype([('band', np.uint8), ('vivid', np.bool_), ('s', np.float32), ('p', np.float32)])
+
+# tables already loaded by this process
+_luts = {}
+
+
+def lut_index(pixels:np.ndarray, bits:int)->np.ndarray:
+    '''Get the table index of each pixel: its r, g and b values, each cut down to bits bits, packed together
+    :param pixels: (N, 3) uint8 array of [0, 255] RGB values
+    :param bits: bits per channel of the table, 8 for the full 24-bit table
+    :return: an array with the index of each pixel'''
+    q = pixels.astype(np.uint32) >> (8 - bits)
+    return (q[:, 0] << (2*bits)) | (q[:, 1] << bits) | q[:, 2]
+
+def build_color_lut(band_deg:int, bits:int=6)->np.ndarray:
+    '''Classify every color of a bits-per-channel RGB cube the same way
+    rainbow_util.get_pixels_rainbow_bands_and_perceived_brightness does for each pixel.
+    With fewer than 8 bits each entry stands for a small cube of colors and is classified by the color in its center.
+    rgb_to_hsp gives gray colors a perceived brightness of 0, but the cells with a gray center also hold slightly
+    off-gray colors that don't get that treatment, so those cells store the actual brightness instead and the
+    lookup zeroes it for the pixels that really are gray
+    :param band_deg: size of the rainbow band partition in degrees
+    :param bits: bits per channel, 5 to 8
+    :return: a LUT_DTYPE array of 2**(3*bits) entries, in lut_index order'''
+    levels = 1 << bits
+    shift = 8 - bits
+    # the color in the middle of each cell (which is the color itself for the full table)
+    values = (np.arange(levels) << shift) + ((1 << shift) >> 1)
+    lut = np.empty(levels ** 3, dtype=LUT_DTYPE)
+    # one red value at a time, to keep the memory use down for the full table
+    gb = np.stack(np.meshgrid(values, values, indexing='ij'), axis=-1).reshape(-1, 2)
+    for (i, r) in enumerate(values):
+        rgb = np.column_stack((np.full(len(gb), r), gb))
+        h, s, p = rgb_to_hsp_array(rgb / 255)
+        gray = (rgb[:, 0] == rgb[:, 1]) & (rgb[:, 1] == rgb[:, 2])
+        r_, g_, b_ = (rgb[gray] / 255).T
+        p[gray] = np.sqrt(0.299 * r_ * r_ + 0.587 * g_ * g_ + 0.114 * b_ * b_)
+        s[gray] = 0.0
+        chunk = lut[i * len(gb):(i + 1) * len(gb)]
+        chunk['band'] = (h + 30) % 360 // band_deg
+        chunk['vivid'] = (s > 0.15) & (p > 0.18) & (p < 0.95)
+        chunk['s'] = s
+        chunk['p'] = p
+    #end for
+    return lut
+
+def load_color_lut(band_deg:int, bits:int=6, directory:str=LUT_DIR)->np.ndarray:
+    '''Get the color table for a band_deg, building it and storing it on disk the first time it's needed.
+    The stored table is memory-mapped rather than read in, so only the parts actually used get loaded
+    :param band_deg: size of the rainbow band partition in degrees
+    :param bits: bits per channel, 5 to 8
+    :param directory: where to store the tables
+    :return: the (read only) table'''
+    key = (band_deg, bits, directory)
+    if key not in _luts:
+        path = os.path.join(directory, f'color_lut_v{ALGORITHM_VERSION}_{band_deg}deg_{bits}bit.npy')
+        if not os.path.exists(path):
+            os.makedirs(directory, exist_ok=True)
+            # write to a temporary file first so another process never sees a half written table
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, build_color_lut(band_deg, bits))
+            os.replace(tmp_path, path)
+        #end if
+        _luts[key] = np.load(path, mmap_mode='r')
+    #end if
+    return _luts[key]
+
+def get_pixels_rainbow_bands_and_perceived_brightness_lut(pixels:np.ndarray, band_deg:int,
+        bits:int=6)->Tuple[dict[int, float], float]:
+    '''Same as rainbow_util.get_pixels_rainbow_bands_and_perceived_brightness, but looking up the classification
+    of each pixel in a precomputed color table instead of working it out, so all that's left to do per pixel is
+    a lookup and a histogram. The full 8 bit table matches the exact results to float32 precision, smaller
+    tables group similar colors together, see color_lut_report.py for how much that changes the results
+    :param pixels: (N, 3) uint8 array of [0, 255] RGB values
+    :param band_deg: size of the rainbow band partition in degrees
+    :param bits: bits per channel of the table, 5 to 8
+    :return: a tuple with the hue partitions as a list of floats and perceived brightness as a float'''
+    pixel_cnt = len(pixels)
+    band_cnt = 360 // band_deg
+    colors = load_color_lut(band_deg, bits)[lut_index(pixels, bits)]
+    vivid = colors['vivid']
+    # the gray pixels get no perceived brightness, see build_color_lut
+    gray = (pixels[:, 0] == pixels[:, 1]) & (pixels[:, 1] == pixels[:, 2])
+    p = np.where(gray, np.float32(0), colors['p'])
+    vivid_pixels = int(np.count_nonzero(vivid))
+
+    if vivid_pixels > 0:
+        bands = np.bincount(colors['band'][vivid], weights=colors['s'][vivid], minlength=band_cnt)
+        band_pixels = vivid_pixels
+    else:
+        bands = np.bincount(colors['band'], weights=p, minlength=band_cnt)
+        band_pixels = pixel_cnt
+
+    bands = dict(zip(range(band_cnt), (bands[:band_cnt] / band_pixels).tolist()))
+    perceived_brightness = float(np.sum(p, dtype=np.float64)) / pixel_cnt
+    return bands, perceived_brightness
+#end def
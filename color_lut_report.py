@@ -0,0 +1,40 @@
+# %% How close do the color table lookups get to the exact results, and how much faster are they?
+import os
+import time
+import numpy as np
+from PIL import Image
+from rainbow_util import *
+from color_lut import get_pixels_rainbow_bands_and_perceived_brightness_lut, load_color_lut
+
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+band_deg = 30
+covers = [image_to_pixels(Image.open(image_path + image_file)) for image_file in image_list]
+
+start = time.perf_counter()
+exact_results = [get_pixels_rainbow_bands_and_perceived_brightness(pixels, band_deg) for pixels in covers]
+exact_s = time.perf_counter() - start
+print(f'exact: {exact_s*1000:.0f}ms for {len(covers)} covers')
+
+# %%
+print(f'{"bits":>4} {"table":>8} {"build":>7} {"band changed":>13} {"max Δband":>10} {"max Δpb":>9} {"time":>7}')
+for bits in [5, 6, 7, 8]:
+    start = time.perf_counter()
+    lut = load_color_lut(band_deg, bits)
+    load_s = time.perf_counter() - start
+    band_changes = 0
+    band_deltas = []
+    pb_deltas = []
+    start = time.perf_counter()
+    lut_results = [get_pixels_rainbow_bands_and_perceived_brightness_lut(pixels, band_deg, bits) for pixels in covers]
+    lut_s = time.perf_counter() - start
+    for ((bands, pb), (exact_bands, exact_pb)) in zip(lut_results, exact_results):
+        band_changes += get_primary_band(bands) != get_primary_band(exact_bands)
+        band_deltas.append(max(abs(bands[k] - exact_bands[k]) for k in bands))
+        pb_deltas.append(abs(pb - exact_pb))
+    #end for
+    print(f'{bits:>4} {lut.nbytes/2**20:>6.1f}MB {load_s:>6.1f}s {band_changes/len(covers):>12.0%} ' \
+        + f'{max(band_deltas):>10.2e} {max(pb_deltas):>9.2e} {lut_s*1000:>5.0f}ms')
+#end for
+
+# %%
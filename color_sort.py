@@ -0,0 +1,133 @@
+from typing import Optional
+import numpy as np
+from color_utility import cielab_array, enrich_colors, linear_rgb_array, oklab_array
+
+# the layout of a packed sort key, most significant first: 9 bits of band (enough for 1 degree bands),
+# 39 bits of lightness, 16 bits of track number, so a single argsort of the keys sorts by all three
+BAND_SHIFT = 55
+LIGHTNESS_SHIFT = 16
+LIGHTNESS_LEVELS = (1 << 39) - 1
+MAX_BAND = (1 << 9) - 1
+MAX_TRACK_NUMBER = (1 << 16) - 1
+# shift the hue so the reds near 360 degrees end up in the first band with the ones near 0
+HUE_SHIFT = 30
+
+
+def quantize(values:np.ndarray, lo:float, hi:float)->np.ndarray:
+    '''Map values in [lo, hi] to 39 bit integers in the same order, values closer together than
+    (hi - lo) / 2**39 end up tied
+    :return: a uint64 array'''
+    if hi <= lo:
+        return np.zeros(len(values), dtype=np.uint64)
+    scaled = np.floor((np.asarray(values, dtype=np.float64) - lo) * (LIGHTNESS_LEVELS / (hi - lo)))
+    return np.clip(scaled, 0, LIGHTNESS_LEVELS).astype(np.uint64)
+
+def pack_sort_keys(band:np.ndarray, lightness:np.ndarray, track_number:Optional[np.ndarray]=None)->np.ndarray:
+    '''Pack a band, a quantized lightness and a track number per item into one uint64 that sorts the same
+    as the three of them would one after the other
+    :param band: the hue band of each item, 0 to 511
+    :param lightness: the quantize()d lightness of each item
+    :param track_number: the track number of each item, 0 to 65535; None for all the same
+    :return: a uint64 array of keys'''
+    band = np.asarray(band)
+    if len(band) and band.max() > MAX_BAND:
+        raise ValueError(f'bands must be between 0 and {MAX_BAND}')
+    keys = (band.astype(np.uint64) << np.uint64(BAND_SHIFT)) \
+        | (lightness.astype(np.uint64) << np.uint64(LIGHTNESS_SHIFT))
+    if track_number is not None:
+        track_number = np.asarray(track_number)
+        if len(track_number) and (track_number.min() < 0 or track_number.max() > MAX_TRACK_NUMBER):
+            raise ValueError(f'track numbers must be between 0 and {MAX_TRACK_NUMBER}')
+        keys |= track_number.astype(np.uint64)
+    return keys
+
+def _ties_lost(keys:np.ndarray, order:np.ndarray, values:np.ndarray)->bool:
+    # did the quantization tie any neighbors in the order that aren't actually equal? Then the track number
+    # (or the original order) may have put them the wrong way around
+    coarse = keys[order] >> np.uint64(LIGHTNESS_SHIFT)
+    values = values[order]
+    return bool(np.any((coarse[1:] == coarse[:-1]) & (values[1:] != values[:-1])))
+
+def rainbow_sort_order(band:np.ndarray, pb:np.ndarray, track_number:np.ndarray)->np.ndarray:
+    '''The rainbow order of a playlist's tracks, by band, perceived brightness and track number, as a single
+    argsort of packed keys rather than a three column sort. Always the same order as
+    df.sort_values(by=SORT_KEY, kind='stable'): if the quantized pb ties values that differ, it falls back
+    to sorting the columns themselves
+    :return: the row positions in sorted order'''
+    (band, pb, track_number) = (np.asarray(band), np.asarray(pb, dtype=np.float64), np.asarray(track_number))
+    keys = pack_sort_keys(band, quantize(pb, 0.0, 1.0), track_number)
+    order = np.argsort(keys, kind='stable')
+    if _ties_lost(keys, order, pb):
+        return np.lexsort((track_number, pb, band))
+    return order
+
+
+class ColorSorter:
+    '''Sort a set of colors (or the colors of covers) like a rainbow, by any of the lightness measures.
+    Everything about the colors is worked out once, in one vectorized pass, when the sorter gets made:
+    - h, s, l: HSL, with the hue in [0, 1) as colorsys has it
+    - y, lum, p: YIQ luma (I), relative luminance and HSP perceived brightness, see color_utility
+    - ok_l, ok_a, ok_b, ok_h: OKLab and its hue in [0, 1)
+    - lab_l, lab_a, lab_b: CIELAB
+    Sorting then comes down to packing a band, the lightness and the track number into one uint64 per color and
+    a single argsort. The bands, the quantized lightness and the keys are kept, so switching between the
+    lightness measures or going back to one reuses what's been worked out already'''
+    def __init__(self, rgb:np.ndarray, track_number:Optional[np.ndarray]=None):
+        '''
+        :param rgb: an (N, 3) array of [0, 1] rgb colors
+        :param track_number: optionally the track number that goes with each color, to break ties
+        '''
+        rgb = np.asarray(rgb, dtype=np.float64)
+        linear = linear_rgb_array(rgb)
+        self.columns = dict(zip(['r', 'g', 'b', 'h', 's', 'l', 'y', 'lum', 'p'], enrich_colors(rgb).T))
+        (ok_l, ok_a, ok_b) = oklab_array(rgb, linear)
+        self.columns.update(ok_l=ok_l, ok_a=ok_a, ok_b=ok_b, ok_h=np.arctan2(ok_b, ok_a) / (2 * np.pi) % 1.0)
+        self.columns.update(zip(['lab_l', 'lab_a', 'lab_b'], cielab_array(rgb, linear)))
+        self.track_number = track_number
+        self._bands = {}
+        self._lightness = {}
+        self._keys = {}
+
+    def __len__(self)->int:
+        return len(self.columns['r'])
+
+    def bands(self, partition_degrees:int, hue:str='h')->np.ndarray:
+        '''The hue band of each color, shifted so the reds come first
+        :param partition_degrees: the size of the bands in degrees
+        :param hue: the hue to partition, 'h' (HSL) or 'ok_h' (OKLab)'''
+        if (partition_degrees, hue) not in self._bands:
+            self._bands[partition_degrees, hue] = \
+                ((self.columns[hue] * 360 + HUE_SHIFT) % 360 // partition_degrees).astype(np.uint64)
+        return self._bands[partition_degrees, hue]
+
+    def lightness(self, column:str)->np.ndarray:
+        '''The lightness measure quantized to 39 bits over its range in these colors'''
+        if column not in self._lightness:
+            values = self.columns[column]
+            self._lightness[column] = quantize(values, values.min(), values.max()) if len(values) \
+                else np.zeros(0, dtype=np.uint64)
+        return self._lightness[column]
+
+    def sort_keys(self, lightness:str='p', partition_degrees:int=30, hue:str='h')->np.ndarray:
+        '''The packed sort key of each color, see pack_sort_keys
+        :param lightness: the column to sort by within a band, e.g. 'y', 'l', 'lum', 'p', 'ok_l' or 'lab_l'
+        :param partition_degrees: the size of the hue bands in degrees
+        :param hue: the hue to partition, 'h' (HSL) or 'ok_h' (OKLab)'''
+        key = (lightness, partition_degrees, hue)
+        if key not in self._keys:
+            self._keys[key] = pack_sort_keys(self.bands(partition_degrees, hue), self.lightness(lightness),
+                self.track_number)
+        return self._keys[key]
+
+    def order(self, lightness:str='p', partition_degrees:int=30, hue:str='h')->np.ndarray:
+        '''The colors' positions in rainbow order, see sort_keys; the same as sorting by band, the lightness
+        column and the track number one after the other, which it falls back to if the quantized lightness
+        ties values that differ'''
+        keys = self.sort_keys(lightness, partition_degrees, hue)
+        order = np.argsort(keys, kind='stable')
+        values = self.columns[lightness]
+        if _ties_lost(keys, order, values):
+            columns = (values, self.bands(partition_degrees, hue))
+            return np.lexsort(columns if self.track_number is None else (self.track_number,) + columns)
+        return order
+#end class
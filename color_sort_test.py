@@ -0,0 +1,83 @@
+# %% The packed sort keys against sorting the columns one after the other
+import time
+import numpy as np
+import pandas as pd
+from color_utility import cielab_array, oklab_array
+from color_sort import ColorSorter, pack_sort_keys, quantize, rainbow_sort_order
+
+rng = np.random.default_rng(0)
+colors = rng.random((10_000, 3))
+sorter = ColorSorter(colors)
+
+# %% OKLab and CIELAB of a few known colors
+(L, a, b) = oklab_array(np.array([[1.0, 0, 0], [1, 1, 1], [0, 0, 0]]))
+assert np.allclose(L, [0.627955, 1, 0], atol=1e-6) and np.allclose(a, [0.224863, 0, 0], atol=1e-6) \
+    and np.allclose(b, [0.125846, 0, 0], atol=1e-6)
+(L, a, b) = cielab_array(np.array([[1.0, 0, 0], [0, 0, 1], [1, 1, 1]]))
+assert np.allclose(L, [53.2408, 32.2970, 100], atol=1e-3) and np.allclose(a, [80.0925, 79.1875, 0], atol=1e-3) \
+    and np.allclose(b, [67.2032, -107.8602, 0], atol=1e-3)
+
+# %% Each lightness measure sorts the same as band then lightness with lexsort
+for (lightness, partition_degrees, hue) in [('y', 40, 'h'), ('l', 30, 'h'), ('lum', 60, 'h'), ('p', 40, 'h'),
+        ('ok_l', 30, 'ok_h'), ('lab_l', 30, 'h')]:
+    band = ((sorter.columns[hue] * 360 + 30) % 360 // partition_degrees)
+    expected = np.lexsort((sorter.columns[lightness], band))
+    assert np.array_equal(sorter.order(lightness, partition_degrees, hue), expected), lightness
+#end for
+
+# %% Switching back and forth between the measures reuses the keys and the arrays under them
+keys = sorter.sort_keys('p', 40)
+lightness = sorter.lightness('p')
+sorter.order('y', 40)
+assert sorter.sort_keys('p', 40) is keys and sorter.lightness('p') is lightness
+assert sorter.bands(40) is sorter.bands(40)
+
+# %% Track numbers break the ties
+sorter = ColorSorter(np.repeat(rng.random((100, 3)), 5, axis=0), track_number=np.tile([5, 3, 1, 4, 2], 100))
+order = sorter.order('lum', 30)
+assert [sorter.track_number[i] for i in order[:5]] == [1, 2, 3, 4, 5]
+try:
+    pack_sort_keys(np.zeros(1), np.zeros(1, dtype=np.uint64), [70000])
+    assert False
+except ValueError as e:
+    print(e)
+assert quantize(np.array([0, 0.5, 1]), 0, 1).tolist() == [0, (1 << 38) - 1, (1 << 39) - 1]
+
+# %% A playlist's rainbow order, same as sorting the dataframe; pb values that differ by less than 2**-39
+# would tie, the rounding keeps them apart here and gives the track numbers some ties to break
+n = 1_000_000
+df = pd.DataFrame({'band': rng.integers(0, 6, n), 'pb': rng.random(n).round(6),
+    'track_number': rng.integers(1, 20, n)})
+start = time.perf_counter()
+expected = df.sort_values(by=['band', 'pb', 'track_number'], kind='stable').index.to_numpy()
+sort_time = time.perf_counter() - start
+start = time.perf_counter()
+order = rainbow_sort_order(df['band'].to_numpy(), df['pb'].to_numpy(), df['track_number'].to_numpy())
+packed_time = time.perf_counter() - start
+assert np.array_equal(order, expected)
+print(f'1M tracks: sort_values {sort_time:.3f}s, packed keys {packed_time:.3f}s')
+
+# %% pb values too close together for the packed keys still come out in the right order
+pb = np.array([0.5 + 3e-13, 0.5, 0.5 + 1e-13, 0.25, 0.5 + 2e-13])
+order = rainbow_sort_order(np.zeros(5, dtype=int), pb, np.array([1, 5, 2, 4, 3]))
+assert order.tolist() == [3, 1, 2, 4, 0]
+sorter = ColorSorter(np.array([[0.5, 0.3, 0.2 + 1e-13], [0.5, 0.3, 0.2], [0.5, 0.3, 0.2 + 2e-13], [0, 0, 0], [1, 1, 1]]))
+band = ((sorter.columns['ok_h'] * 360 + 30) % 360 // 30)
+assert np.array_equal(sorter.order('ok_l', 30, 'ok_h'), np.lexsort((sorter.columns['ok_l'], band)))
+assert sorter.order('ok_l', 30, 'ok_h')[1:4].tolist() == [1, 0, 2]
+df = pd.DataFrame({'band': rng.integers(0, 6, 10_000), 'pb': 0.5 + rng.integers(0, 50, 10_000) * 1e-14,
+    'track_number': rng.integers(1, 20, 10_000)})
+assert np.array_equal(rainbow_sort_order(df['band'], df['pb'], df['track_number']),
+    df.sort_values(by=['band', 'pb', 'track_number'], kind='stable').index.to_numpy())
+
+# %% A million colors, then every lightness measure off the same arrays
+colors = rng.random((1_000_000, 3))
+start = time.perf_counter()
+sorter = ColorSorter(colors)
+setup_time = time.perf_counter() - start
+start = time.perf_counter()
+for lightness in ['y', 'l', 'lum', 'p', 'ok_l', 'lab_l']:
+    sorter.order(lightness, 40)
+print(f'1M colors: {setup_time:.2f}s to set up, {(time.perf_counter() - start) / 6:.3f}s per lightness measure')
+
+# %%
@@ -1,6 +1,7 @@
 
 import math
 import colorsys 
+import numpy as np
 
 
 def normalize_color(rgb:tuple) -> tuple:
@@ -71,4 +72,104 @@ def enrich_color(rgb:tuple) -> tuple:
     (r, g, b, h, s, l, y, lum, p)
     Each of these could probably be vectorized and done individually in generate_color_df 🤷🏻‍♂️
     """
-    return rgb + hsl(rgb) + (y_luma(rgb),) + (luminance(rgb),) + (hsp(rgb),)
+    return rgb + hsl(rgb) + (y_luma(rgb),) + (luminance(rgb),) + (perceived_brightness(rgb),)
+
+
+# The same formulae for a whole (N, 3) array of [0, 1] rgb colors at once, one column per value.
+# They do the same arithmetic in the same order as the ones above, so the results are identical, not just close
+
+def hsl_array(rgb:np.ndarray) -> tuple:
+    """
+    Same as hsl, for an (N, 3) array of colors
+    :return: a tuple with the h, s and l arrays
+    """
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    sumc = maxc + minc
+    rangec = maxc - minc
+    l = sumc / 2.0
+    gray = minc == maxc
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.where(l <= 0.5, rangec / sumc, rangec / (2.0 - maxc - minc))
+        rc = (maxc - r) / rangec
+        gc = (maxc - g) / rangec
+        bc = (maxc - b) / rangec
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = (h / 6.0) % 1.0
+    # colorsys gives grays no hue or saturation
+    h[gray] = 0.0
+    s[gray] = 0.0
+    return (h, s, l)
+
+def y_luma_array(rgb:np.ndarray) -> np.ndarray:
+    """
+    Same as y_luma, for an (N, 3) array of colors
+    """
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    y = 0.30*r + 0.59*g + 0.11*b
+    # like y_luma, this is the I component of YIQ
+    return 0.74*(r - y) - 0.27*(b - y)
+
+def luminance_array(rgb:np.ndarray) -> np.ndarray:
+    """
+    Same as luminance, for an (N, 3) array of colors
+    """
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    return 0.2126*r + 0.7152*g + 0.0722*b
+
+def perceived_brightness_array(rgb:np.ndarray) -> np.ndarray:
+    """
+    Same as perceived_brightness, for an (N, 3) array of colors
+    """
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    return np.sqrt(0.299 * r * r + 0.587 * g * g + 0.114 * b * b)
+
+def enrich_colors(rgb:np.ndarray) -> np.ndarray:
+    """
+    Same as enrich_color for an (N, 3) array of [0, 1] colors, a million colors take well under a second
+    :return: an (N, 9) array with a (r, g, b, h, s, l, y, lum, p) layout, ready for generate_color_df
+    """
+    rgb = np.asarray(rgb, dtype=np.float64)
+    return np.column_stack((rgb, *hsl_array(rgb), y_luma_array(rgb), luminance_array(rgb),
+        perceived_brightness_array(rgb)))
+
+def linear_rgb_array(rgb:np.ndarray) -> np.ndarray:
+    """
+    Undo the sRGB gamma of an (N, 3) array of [0, 1] colors, the linear light that OKLab and CIELAB start from
+    See https://en.wikipedia.org/wiki/SRGB#From_sRGB_to_CIE_XYZ
+    """
+    rgb = np.asarray(rgb, dtype=np.float64)
+    return np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+
+def oklab_array(rgb:np.ndarray, linear:np.ndarray=None) -> tuple:
+    """
+    The OKLab lightness and a, b opponent axes of an (N, 3) array of [0, 1] colors
+    See https://bottosson.github.io/posts/oklab/
+    :param linear: the linear_rgb_array of the colors, if already at hand
+    :return: a tuple with the L (in [0, 1]), a and b arrays
+    """
+    linear = linear_rgb_array(rgb) if linear is None else linear
+    lms = np.cbrt(linear @ np.array([[0.4122214708, 0.2119034982, 0.0883024619],
+                                     [0.5363325363, 0.6806995451, 0.2817188376],
+                                     [0.0514459929, 0.1073969566, 0.6299787005]]))
+    lab = lms @ np.array([[0.2104542553, 1.9779984951, 0.0259040371],
+                          [0.7936177850, -2.4285922050, 0.7827717662],
+                          [-0.0040720468, 0.4505937099, -0.8086757660]])
+    return (lab[:, 0], lab[:, 1], lab[:, 2])
+
+def cielab_array(rgb:np.ndarray, linear:np.ndarray=None) -> tuple:
+    """
+    The CIELAB L*, a* and b* of an (N, 3) array of [0, 1] sRGB colors, with the D65 white point
+    See https://en.wikipedia.org/wiki/CIELAB_color_space#From_CIEXYZ_to_CIELAB
+    :param linear: the linear_rgb_array of the colors, if already at hand
+    :return: a tuple with the L* (in [0, 100]), a* and b* arrays
+    """
+    linear = linear_rgb_array(rgb) if linear is None else linear
+    xyz = linear @ np.array([[0.4124564, 0.2126729, 0.0193339],
+                             [0.3575761, 0.7151522, 0.1191920],
+                             [0.1804375, 0.0721750, 0.9503041]])
+    t = xyz / np.array([0.95047, 1.0, 1.08883])
+    delta = 6 / 29
+    f = np.where(t > delta ** 3, np.cbrt(t), t / (3 * delta ** 2) + 4 / 29)
+    return (116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2]))
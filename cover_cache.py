@@ -0,0 +1,184 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from io import BytesIO
+from typing import NamedTuple, Optional
+from PIL import Image
+from rainbow_util import ALGORITHM_VERSION, get_image_color_features
+
+# bump this when the layout of the tables changes, older databases get wiped
+SCHEMA_VERSION = 3
+# the LRU order is an ever increasing counter kept in the database itself rather than the clock or a counter
+# per process: each use gets the next one, worked out in the same statement that stores it, so processes
+# sharing the cache file can't hand out the same number or go back in time
+_NEXT_USE = '(SELECT COALESCE(MAX(last_used), 0) + 1 FROM features)'
+
+
+class CachedFeatures(NamedTuple):
+    '''The color analysis results stored for a cover'''
+    bands: dict
+    pb: float
+    primary_band: int
+    vividity: float
+
+
+def sampling_key(max_pixels:Optional[int]=None, sampling:str='thumbnail', seed:int=0)->str:
+    '''Describe the pixel sampling results were computed with, to store them by
+    :param max_pixels: the pixel budget, None for every pixel
+    :param sampling: the sampling method, see rainbow_util.sample_pixels
+    :param seed: seed for the 'random' sampling method
+    :return: '' for every pixel, otherwise a string with the sampling settings'''
+    if max_pixels is None:
+        return ''
+    return f'{sampling}:{max_pixels}:{seed}' if sampling == 'random' else f'{sampling}:{max_pixels}'
+
+def content_hash(data:bytes)->str:
+    '''Hash the raw bytes of a cover image, so the same image is recognized under a different url or file name
+    :param data: the image file contents
+    :return: the hex digest'''
+    return hashlib.sha1(data).hexdigest()
+
+class CoverCache:
+    '''Persistent SQLite cache of cover analysis results.
+    Results are stored by the image's content hash, along with the band_deg, pixel sampling and
+    ALGORITHM_VERSION they were computed with, so changing any of them simply stops matching the old entries.
+    A second table maps cover urls to content hashes, so a cover seen before doesn't even need to be
+    downloaded again.
+    The least recently used results are evicted once there are more than max_entries of them.
+    Safe to share between threads, and between processes using the same file.'''
+    def __init__(self, path:str='cover_cache.sqlite', max_entries:int=100_000):
+        '''
+        :param path: the SQLite database file, created if it doesn't exist; ':memory:' for a throwaway cache
+        :param max_entries: the maximum number of analysis results to keep
+        '''
+        self.max_entries = max_entries
+        self.url_hits = 0
+        self.url_misses = 0
+        self.content_hits = 0
+        self.content_misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            # the cache is disposable, so rather than migrating a database with an older layout start over
+            if self._db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                self._db.execute('DROP TABLE IF EXISTS features')
+                self._db.execute('DROP TABLE IF EXISTS urls')
+                self._db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self._db.execute('''CREATE TABLE IF NOT EXISTS features (
+                content_hash TEXT, band_deg INTEGER, sampling TEXT, version INTEGER,
+                bands TEXT, pb REAL, primary_band INTEGER, vividity REAL, last_used INTEGER,
+                PRIMARY KEY (content_hash, band_deg, sampling, version))''')
+            self._db.execute('CREATE INDEX IF NOT EXISTS features_last_used ON features (last_used)')
+            self._db.execute('''CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY, content_hash TEXT)''')
+            # to drop the urls of evicted covers without going through all of them
+            self._db.execute('CREATE INDEX IF NOT EXISTS urls_content_hash ON urls (content_hash)')
+            # results from older versions of the algorithm will never be used again
+            self._db.execute('DELETE FROM features WHERE version != ?', (ALGORITHM_VERSION,))
+        #end with
+
+    def _get(self, digest:str, band_deg:int, sampling:str)->Optional[CachedFeatures]:
+        # expects the lock to be held
+        row = self._db.execute('''SELECT bands, pb, primary_band, vividity FROM features
+            WHERE content_hash = ? AND band_deg = ? AND sampling = ? AND version = ?''',
+            (digest, band_deg, sampling, ALGORITHM_VERSION)).fetchone()
+        if row is None:
+            return None
+        with self._db:
+            self._db.execute(f'''UPDATE features SET last_used = {_NEXT_USE}
+                WHERE content_hash = ? AND band_deg = ? AND sampling = ? AND version = ?''',
+                (digest, band_deg, sampling, ALGORITHM_VERSION))
+        bands, pb, primary_band, vividity = row
+        # json turns the int keys into strings, turn them back
+        return CachedFeatures({int(k): v for (k, v) in json.loads(bands).items()}, pb, primary_band, vividity)
+
+    def get_by_url(self, url:str, band_deg:int, sampling:str='')->Optional[CachedFeatures]:
+        '''Get the cached results for a cover url
+        :param url: the cover's url
+        :param band_deg: size of the rainbow band partition in degrees
+        :param sampling: the pixel sampling the results were computed with, see sampling_key
+        :return: the cached results, or None if the url or its results aren't in the cache'''
+        with self._lock:
+            row = self._db.execute('SELECT content_hash FROM urls WHERE url = ?', (url,)).fetchone()
+            features = self._get(row[0], band_deg, sampling) if row is not None else None
+            if features is None:
+                self.url_misses += 1
+            else:
+                self.url_hits += 1
+            return features
+
+    def get_by_hash(self, digest:str, band_deg:int, url:Optional[str]=None, sampling:str='')->Optional[CachedFeatures]:
+        '''Get the cached results for a cover's contents
+        :param digest: the content_hash of the cover image
+        :param band_deg: size of the rainbow band partition in degrees
+        :param url: optional url the cover was downloaded from, remembered on a hit so get_by_url finds it next time
+        :param sampling: the pixel sampling the results were computed with, see sampling_key
+        :return: the cached results, or None if they aren't in the cache'''
+        with self._lock:
+            features = self._get(digest, band_deg, sampling)
+            if features is None:
+                self.content_misses += 1
+            else:
+                self.content_hits += 1
+                if url is not None:
+                    with self._db:
+                        self._db.execute('INSERT OR REPLACE INTO urls VALUES (?, ?)', (url, digest))
+            return features
+
+    def put(self, digest:str, band_deg:int, features:CachedFeatures, url:Optional[str]=None, sampling:str='')->None:
+        '''Store the results for a cover, evicting the least recently used results if the cache is full
+        :param digest: the content_hash of the cover image
+        :param band_deg: size of the rainbow band partition in degrees
+        :param features: the results to store
+        :param url: optional url the cover was downloaded from
+        :param sampling: the pixel sampling the results were computed with, see sampling_key'''
+        bands, pb, primary_band, vividity = features
+        with self._lock, self._db:
+            self._db.execute(f'INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?, ?, ?, {_NEXT_USE})',
+                (digest, band_deg, sampling, ALGORITHM_VERSION, json.dumps(bands), pb, int(primary_band), 
+                float(vividity)))
+            if url is not None:
+                self._db.execute('INSERT OR REPLACE INTO urls VALUES (?, ?)', (url, digest))
+            excess = self._db.execute('SELECT COUNT(*) FROM features').fetchone()[0] - self.max_entries
+            if excess > 0:
+                evicted = self._db.execute('SELECT rowid, content_hash FROM features ORDER BY last_used LIMIT ?',
+                    (excess,)).fetchall()
+                self._db.executemany('DELETE FROM features WHERE rowid = ?', [(rowid,) for (rowid, _) in evicted])
+                # only the urls of the evicted covers, and only if there are no results left for them at all,
+                # e.g. with another band_deg
+                self._db.executemany('''DELETE FROM urls WHERE content_hash = ? AND NOT EXISTS
+                    (SELECT 1 FROM features WHERE content_hash = urls.content_hash)''',
+                    {(digest,) for (_, digest) in evicted})
+        #end with
+
+    def get_or_analyze(self, data:bytes, band_deg:int, url:Optional[str]=None, max_pixels:Optional[int]=None,
+            sampling:str='thumbnail', seed:int=0)->CachedFeatures:
+        '''Get the results for a cover image from the cache, analyzing and storing them if they aren't there yet
+        :param data: the image file contents
+        :param band_deg: size of the rainbow band partition in degrees
+        :param url: optional url (or path) of the image
+        :param max_pixels: optional pixel budget, see rainbow_util.sample_pixels
+        :param sampling: the sampling method to stay within max_pixels
+        :param seed: seed for the 'random' sampling method
+        :return: the cover's results'''
+        digest = content_hash(data)
+        key = sampling_key(max_pixels, sampling, seed)
+        features = self.get_by_hash(digest, band_deg, url, key)
+        if features is None:
+            analysis = get_image_color_features(Image.open(BytesIO(data)), band_deg, max_pixels, sampling, seed)
+            features = CachedFeatures(analysis.bands_dict(), analysis.pb, analysis.primary_band, analysis.vividity)
+            self.put(digest, band_deg, features, url, key)
+        return features
+
+    def __len__(self)->int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM features').fetchone()[0]
+
+    def __repr__(self)->str:
+        return f'{len(self)} cached covers, url hits/misses: {self.url_hits}/{self.url_misses}, ' \
+            + f'content hits/misses: {self.content_hits}/{self.content_misses}'
+
+    def close(self)->None:
+        self._db.close()
@@ -0,0 +1,124 @@
+from typing import Optional, Tuple
+import numpy as np
+from scipy.cluster.vq import kmeans2, vq
+
+# signatures are stored as uint8, 0 to SIGNATURE_SCALE
+SIGNATURE_SCALE = 255
+# the most signatures to train the coarse quantizer on, per list
+TRAIN_PER_LIST = 64
+
+
+def cover_signatures(bands:np.ndarray, pb:np.ndarray)->np.ndarray:
+    '''The compact signature of each cover: its band weights normalized to add up to 1, so a cover that's half
+    red and half blue keeps both, plus its perceived brightness, all as uint8.
+    7 bytes a cover with 60 degree bands, 13 with 30 degree bands
+    :param bands: an (N, 360 // band_deg) array of band weights, e.g. the bands of ColorFeatures or a FeatureStore
+    :param pb: the perceived brightness of each cover, in [0, 1]
+    :return: an (N, bands + 1) uint8 array'''
+    bands = np.asarray(bands, dtype=np.float64)
+    totals = bands.sum(axis=1, keepdims=True)
+    shares = np.divide(bands, totals, out=np.zeros_like(bands), where=totals > 0)
+    signatures = np.column_stack((shares, np.asarray(pb, dtype=np.float64)))
+    return np.rint(np.clip(signatures, 0, 1) * SIGNATURE_SCALE).astype(np.uint8)
+
+
+class CoverIndex:
+    '''Find the covers that look like a given one among a whole catalogue, approximately and in well under a
+    millisecond: an inverted file index. The signatures get clustered by k-means into about sqrt(N) lists and a
+    query only compares against the signatures in the nprobe lists with the centroids nearest to it, rather
+    than against all of them. The signatures are kept sorted by list, so each list is a contiguous slice, and
+    as uint8, so the whole index is a few bytes a cover plus the centroids.
+    Results are positions in the signatures the index was built from, nearest first. Needs scipy'''
+    def __init__(self, signatures:np.ndarray, lists:Optional[int]=None, nprobe:int=8, seed:int=0):
+        '''
+        :param signatures: an (N, D) uint8 array, see cover_signatures
+        :param lists: number of lists, sqrt(N) by default
+        :param nprobe: number of lists a query looks in, more for better recall and slower queries
+        :param seed: seed for the k-means
+        '''
+        signatures = np.asarray(signatures, dtype=np.uint8)
+        n = len(signatures)
+        lists = max(1, min(lists or int(np.sqrt(n)), n))
+        data = signatures.astype(np.float32)
+        rng = np.random.default_rng(seed)
+        sample = data[rng.choice(n, min(n, lists * TRAIN_PER_LIST), replace=False)] if n else data
+        if n:
+            (centroids, _) = kmeans2(sample, lists, minit='++', seed=seed)
+            (assignment, _) = vq(data, centroids)
+        else:
+            (centroids, assignment) = (np.zeros((0, signatures.shape[1]), dtype=np.float32), np.zeros(0, np.intp))
+        self.centroids = centroids.astype(np.float32)
+        self.nprobe = nprobe
+        order = np.argsort(assignment, kind='stable')
+        self.positions = order.astype(np.uint32)
+        self.signatures = signatures[order]
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))))
+        self._rows = np.argsort(order)
+
+    def __len__(self)->int:
+        return len(self.positions)
+
+    def signature(self, position:int)->np.ndarray:
+        '''The signature of the cover at position'''
+        return self.signatures[self._rows[position]]
+
+    def search(self, signature:np.ndarray, k:int=10, exclude:Optional[int]=None,
+            nprobe:Optional[int]=None)->Tuple[np.ndarray, np.ndarray]:
+        '''The covers with the signatures nearest to a signature
+        :param signature: a signature, see cover_signatures; it can be a point between signatures too
+        :param k: number of covers to find
+        :param exclude: a position to leave out, e.g. the cover the signature is of
+        :param nprobe: number of lists to look in, the index's nprobe by default
+        :return: a tuple with the positions and the euclidean distances of the covers, nearest first'''
+        query = np.asarray(signature, dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        if nprobe == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0)
+        to_centroids = ((self.centroids - query) ** 2).sum(axis=1)
+        probed = np.argpartition(to_centroids, nprobe - 1)[:nprobe] if nprobe < len(to_centroids) \
+            else range(len(to_centroids))
+        slices = [slice(self.offsets[l], self.offsets[l + 1]) for l in probed]
+        positions = np.concatenate([self.positions[s] for s in slices])
+        distances = ((np.concatenate([self.signatures[s] for s in slices]).astype(np.float32) - query) ** 2).sum(axis=1)
+        if exclude is not None:
+            excluded = positions == exclude
+            distances[excluded] = np.inf
+            k = min(k, len(positions) - int(np.count_nonzero(excluded)))
+        k = min(k, len(positions))
+        nearest = np.argpartition(distances, k - 1)[:k] if 0 < k < len(distances) else np.arange(max(k, 0))
+        nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+        return positions[nearest], np.sqrt(distances[nearest])
+
+    def similar(self, position:int, k:int=10)->np.ndarray:
+        '''The covers that look most like the cover at position, itself left out'''
+        return self.search(self.signature(position), k, exclude=position)[0]
+
+    def transitions(self, position:int, k:int=10, step:float=0.25)->np.ndarray:
+        '''The covers to go on to from the cover at position for a smooth rainbow: the ones nearest to its signature
+        with step of each band's weight moved on to the next band, so a bit further along the rainbow at the
+        same brightness
+        :param step: how far along, from 0 (the most similar covers) to 1 (a whole band on)'''
+        signature = self.signature(position).astype(np.float32)
+        (shares, brightness) = (signature[:-1], signature[-1:])
+        target = np.concatenate(((1 - step) * shares + step * np.roll(shares, 1), brightness))
+        return self.search(target, k, exclude=position)[0]
+
+    def save(self, path:str)->None:
+        '''Save the index to an .npz file, to load it again without the k-means'''
+        np.savez(path, centroids=self.centroids, positions=self.positions, signatures=self.signatures,
+            offsets=self.offsets, nprobe=self.nprobe)
+
+    @classmethod
+    def load(cls, path:str)->'CoverIndex':
+        '''Load an index saved with save()'''
+        index = cls.__new__(cls)
+        with np.load(path) as data:
+            index.centroids = data['centroids']
+            index.positions = data['positions']
+            index.signatures = data['signatures']
+            index.offsets = data['offsets']
+            index.nprobe = int(data['nprobe'])
+        #end with
+        index._rows = np.argsort(index.positions)
+        return index
+#end class
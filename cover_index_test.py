@@ -0,0 +1,74 @@
+# %% Cover signatures and the similarity index, on made up covers and on the test covers
+import os
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+from rainbow_util import get_image_color_features
+from benchmark import random_covers
+from cover_index import CoverIndex, cover_signatures
+
+# %% A half red, half blue cover keeps both colors, in 7 bytes
+signatures = cover_signatures(np.array([[0.3, 0, 0, 0, 0.3, 0], [0, 0, 0, 0, 0, 0]]), np.array([0.5, 1.0]))
+assert signatures.dtype == np.uint8 and signatures.shape == (2, 7)
+assert signatures.tolist() == [[128, 0, 0, 0, 128, 0, 128], [0, 0, 0, 0, 0, 0, 255]]
+
+# %% 100k albums: sub-millisecond queries, nearly all of the true nearest covers found
+n = 100_000
+(bands, pb) = random_covers(n)
+signatures = cover_signatures(bands, pb)
+start = time.perf_counter()
+index = CoverIndex(signatures)
+print(f'index of {n} covers built in {time.perf_counter() - start:.2f}s, {signatures.nbytes / n:.0f} bytes a cover')
+
+rng = np.random.default_rng(1)
+queries = rng.choice(n, 200, replace=False)
+start = time.perf_counter()
+results = [index.similar(q, 10) for q in queries]
+query_time = (time.perf_counter() - start) / len(queries)
+exact = signatures.astype(np.int32)
+found = 0
+for (q, result) in zip(queries, results):
+    assert len(result) == 10 and q not in result
+    distances = ((exact - exact[q]) ** 2).sum(axis=1)
+    distances[q] = np.iinfo(np.int32).max
+    # the 10th nearest distance, ties included
+    kth = np.partition(distances, 9)[9]
+    found += np.count_nonzero(distances[result] <= kth)
+#end for
+recall = found / (10 * len(queries))
+print(f'similar: {query_time * 1000:.3f}ms a query, recall@10 {recall:.3f}')
+assert query_time < 0.001 and recall > 0.9
+
+start = time.perf_counter()
+for q in queries:
+    index.transitions(q, 10)
+transition_time = (time.perf_counter() - start) / len(queries)
+print(f'transitions: {transition_time * 1000:.3f}ms a query')
+assert transition_time < 0.001
+
+# %% The results come nearest first, and a transition moves on along the rainbow
+(positions, distances) = index.search(signatures[queries[0]], 20)
+assert np.all(np.diff(distances) >= 0) and distances[0] == 0
+red = index.search(cover_signatures([[1, 0, 0, 0, 0, 0]], [0.5])[0], 1)[0][0]
+assert np.argmax(signatures[red][:6]) == 0
+onward = index.transitions(red, 10, step=0.5)
+assert np.mean(signatures[onward][:, 1]) > signatures[red][1]
+
+# %% Saved and loaded, same answers
+path = os.path.join(tempfile.mkdtemp(), 'covers.npz')
+index.save(path)
+loaded = CoverIndex.load(path)
+assert all(np.array_equal(loaded.similar(q), index.similar(q)) for q in queries[:20])
+
+# %% The test covers that look alike
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+features = [get_image_color_features(Image.open(image_path + f), 60) for f in image_list]
+small = CoverIndex(cover_signatures([f.bands for f in features], [f.pb for f in features]), nprobe=len(image_list))
+assert len(small) == len(image_list)
+for i in range(3):
+    print(image_list[i], '->', [image_list[j] for j in small.similar(i, 3)])
+assert len(CoverIndex(np.zeros((0, 7), dtype=np.uint8)).search(np.zeros(7))[0]) == 0
+
+# %%
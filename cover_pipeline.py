@@ -0,0 +1,229 @@
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from typing import Iterable, Iterator, NamedTuple, Optional
+import numpy as np
+import requests
+from PIL import Image
+from rainbow_util import PixelBuffer, get_pixels_color_features, image_to_pixels, sample_pixels
+from cover_cache import CachedFeatures, CoverCache, content_hash, sampling_key
+import instrumentation
+
+
+class CoverResult(NamedTuple):
+    '''The color analysis of one album cover'''
+    url: str
+    bands: dict
+    pb: float
+    primary_band: int
+    # the share of vivid pixels
+    vividity: float
+
+
+class DedupStats:
+    '''Counts of the tracks seen and the unique covers actually downloaded and analyzed for them'''
+    def __init__(self):
+        self.tracks = 0
+        self.covers = 0
+
+    @property
+    def saved(self)->int:
+        '''Number of downloads and analyses skipped because the cover was already seen'''
+        return self.tracks - self.covers
+
+    def __repr__(self)->str:
+        return f'{self.tracks} tracks, {self.covers} unique covers, {self.saved} fetches and analyses saved'
+
+
+def create_session(pool_size:int)->requests.Session:
+    '''Create a requests session that keeps up to pool_size connections per host alive,
+    so the cover downloads don't each pay for a new TCP/TLS handshake
+    :param pool_size: number of connections to keep open per host, normally the number of fetch workers
+    :return: the session'''
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def download_cover(session:requests.Session, url:str, timeout:float)->bytes:
+    '''Download a cover image
+    :param session: the (shared) requests session to download with
+    :param url: url of the cover image
+    :param timeout: seconds to wait for the server to connect and to send data
+    :return: the image file contents'''
+    with instrumentation.timer('cover_download'):
+        response = session.get(url, timeout=timeout)
+        response.raise_for_status()
+        data = response.content
+    instrumentation.count('bytes_downloaded', len(data))
+    return data
+
+def decode_cover(data:bytes, max_pixels:Optional[int]=None, sampling:str='thumbnail',
+        out:Optional[PixelBuffer]=None)->np.ndarray:
+    '''Decode a cover image. With a thumbnail pixel budget JPEGs get decoded at a reduced size to start with
+    :param data: the image file contents
+    :param max_pixels: optional pixel budget, see rainbow_util.sample_pixels; None to use every pixel
+    :param sampling: the sampling method to stay within max_pixels
+    :param out: optional buffer to decode into, see rainbow_util.image_to_pixels
+    :return: the cover's pixels as an (N, 3) uint8 array'''
+    with instrumentation.timer('decode'):
+        image = Image.open(BytesIO(data))
+        if max_pixels is None:
+            return image_to_pixels(image, out)
+        return sample_pixels(image, max_pixels, sampling, out=out)
+
+def analyze_pixels(url:str, pixels:np.ndarray, band_deg:int)->CoverResult:
+    '''Get the bands, perceived brightness, primary band and vividity for a cover's pixels.
+    Module-level so it can be run in a worker process
+    :param url: url of the cover image, passed through to the result
+    :param pixels: the cover's pixels as an (N, 3) uint8 array
+    :param band_deg: size of the rainbow band partition in degrees
+    :return: the analysis result'''
+    with instrumentation.timer('analyze'):
+        features = get_pixels_color_features(pixels, band_deg)
+    return CoverResult(url, features.bands_dict(), features.pb, features.primary_band, features.vividity)
+
+def analyze_covers(urls:Iterable[str], band_deg:int, fetch_workers:int=8, analysis_workers:Optional[int]=None,
+        max_pending:int=64, timeout:float=10.0, session:Optional[requests.Session]=None,
+        cache:Optional[CoverCache]=None, max_pixels:Optional[int]=None, sampling:str='thumbnail')->Iterator[CoverResult]:
+    '''Download and analyze album covers concurrently, yielding the results in the same order as the urls.
+    The downloads run on a pool of threads sharing one keep-alive session, the decoded pixels are handed
+    to a pool of worker processes for the band extraction, so the network and CPU work overlap.
+    The urls are consumed lazily and at most max_pending covers are in flight at any time, so a slow
+    consumer (or a huge playlist) doesn't pile up downloaded images in memory.
+    A failed or timed out download raises its exception when its turn to be yielded comes.
+    With a cache, covers whose url was seen before are neither downloaded nor analyzed, and covers with
+    already seen contents (under another url) are downloaded but not analyzed.
+    :param urls: cover image urls, can be a generator
+    :param band_deg: size of the rainbow band partition in degrees
+    :param fetch_workers: number of concurrent downloads
+    :param analysis_workers: number of analysis processes, None for one per CPU, 0 to analyze in the download threads
+    :param max_pending: maximum number of covers downloaded or being analyzed ahead of the consumer
+    :param timeout: per-request timeout in seconds
+    :param session: requests session to use, by default one is created with a pool of fetch_workers connections
+    :param cache: optional CoverCache to get results from and store new results in
+    :param max_pixels: optional pixel budget per cover, lets bigger covers be used without paying for every pixel
+    :param sampling: the sampling method to stay within max_pixels, see rainbow_util.sample_pixels
+    :return: an iterator of CoverResults in url order'''
+    session = session or create_session(fetch_workers)
+    fetch_pool = ThreadPoolExecutor(max_workers=fetch_workers)
+    analysis_pool = ProcessPoolExecutor(max_workers=analysis_workers) if analysis_workers != 0 else None
+    key = sampling_key(max_pixels, sampling)
+    # a pixel buffer per download thread
+    buffers = threading.local()
+
+    def done(result:CoverResult)->Future:
+        future = Future()
+        future.set_result(result)
+        return future
+    #end def
+
+    def stored(analysis:Future, digest:str)->Future:
+        # keep the results of a finished analysis in the cache, and only hand them out once they're in there:
+        # a plain done callback can run after whoever waits for the analysis has its result
+        future = Future()
+
+        def store(analysis:Future)->None:
+            try:
+                result = analysis.result()
+                cache.put(digest, band_deg, CachedFeatures(*result[1:]), result.url, key)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        #end def
+
+        analysis.add_done_callback(store)
+        return future
+    #end def
+
+    def fetch_and_submit(url:str)->Future:
+        # runs in a download thread: fetch the cover, then queue it up for analysis and return right away
+        # so the thread can move on to the next download
+        with instrumentation.timer('cover'):
+            return fetch_and_analyze(url)
+    #end def
+
+    def fetch_and_analyze(url:str)->Future:
+        cached = cache.get_by_url(url, band_deg, key) if cache is not None else None
+        if cached is not None:
+            instrumentation.count('cache_url_hits')
+            return done(CoverResult(url, *cached))
+        data = download_cover(session, url, timeout)
+        if cache is not None:
+            digest = content_hash(data)
+            cached = cache.get_by_hash(digest, band_deg, url, key)
+            if cached is not None:
+                instrumentation.count('cache_content_hits')
+                return done(CoverResult(url, *cached))
+            instrumentation.count('cache_misses')
+        #end if
+        if analysis_pool is None:
+            # analyzed right here, so each download thread can decode into the same buffer every time
+            if not hasattr(buffers, 'pixels'):
+                buffers.pixels = PixelBuffer()
+            future = done(analyze_pixels(url, decode_cover(data, max_pixels, sampling, buffers.pixels), band_deg))
+        else:
+            # the pixels get sent to the worker process later on, so they need an array of their own
+            future = analysis_pool.submit(analyze_pixels, url, decode_cover(data, max_pixels, sampling), band_deg)
+        return stored(future, digest) if cache is not None else future
+    #end def
+
+    pending = deque()
+    try:
+        for url in urls:
+            pending.append(fetch_pool.submit(fetch_and_submit, url))
+            # backpressure: don't get further ahead of the consumer than max_pending covers
+            if len(pending) >= max_pending:
+                yield pending.popleft().result().result()
+        #end for
+        while pending:
+            yield pending.popleft().result().result()
+    finally:
+        # on an error (or the consumer stopping early) drop whatever hasn't started yet
+        for future in pending:
+            future.cancel()
+        fetch_pool.shutdown(wait=True, cancel_futures=True)
+        if analysis_pool is not None:
+            analysis_pool.shutdown(wait=True, cancel_futures=True)
+#end def
+
+def analyze_unique_covers(urls:Iterable[str], band_deg:int, stats:Optional[DedupStats]=None,
+        **pipeline_args)->Iterator[CoverResult]:
+    '''Same as analyze_covers, yielding one result per url in order, but every distinct url is only downloaded
+    and analyzed once and its result is fanned out to all the tracks sharing it. Tracks from the same album
+    share the cover url, so on album-heavy playlists this skips most of the work.
+    :param urls: cover image urls, one per track, can be a generator
+    :param band_deg: size of the rainbow band partition in degrees
+    :param stats: optional DedupStats to count the tracks and unique covers in
+    :param pipeline_args: passed on to analyze_covers
+    :return: an iterator of CoverResults in url order'''
+    stats = stats if stats is not None else DedupStats()
+    results = {}
+    # urls that have been read from the input but not yielded yet
+    waiting = deque()
+
+    def new_urls()->Iterator[str]:
+        seen = set()
+        for url in urls:
+            stats.tracks += 1
+            waiting.append(url)
+            if url not in seen:
+                seen.add(url)
+                stats.covers += 1
+                yield url
+        #end for
+    #end def
+
+    for result in analyze_covers(new_urls(), band_deg, **pipeline_args):
+        results[result.url] = result
+        # every track up to the next not-yet-analyzed cover is now ready to go
+        while waiting and waiting[0] in results:
+            yield results[waiting.popleft()]
+    #end for
+    # the input ran out, anything still waiting is a repeat of a cover we already have
+    while waiting:
+        yield results[waiting.popleft()]
+#end def
@@ -0,0 +1,127 @@
+# %% Run the cover pipeline against a local HTTP server serving test_covers/, no Spotify or internet needed
+import os
+import tempfile
+import time
+from urllib.parse import quote
+import requests
+from PIL import Image
+from rainbow_util import *
+from cover_pipeline import DedupStats, analyze_covers, analyze_unique_covers
+from cover_cache import CachedFeatures, CoverCache
+from test_server import QuietHandler, serve_directory
+
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+
+
+class CoverHandler(QuietHandler):
+    '''Serve the test covers, with a /slow/ prefix that stalls to test the timeouts'''
+    requests_served = 0
+
+    def do_GET(self):
+        CoverHandler.requests_served += 1
+        if self.path.startswith('/slow/'):
+            time.sleep(2)
+            self.path = self.path[len('/slow'):]
+        super().do_GET()
+
+
+(server, base_url) = serve_directory(image_path, CoverHandler)
+
+# %% The results come back in url order and match analyzing the files directly
+# repeat the list so there's more work in flight than the pending window allows
+urls = [base_url + quote(f) for f in image_list] * 3
+results = list(analyze_covers(urls, band_deg=60, fetch_workers=4, analysis_workers=2, max_pending=8))
+
+assert [r.url for r in results] == urls
+for image_file, result in zip(image_list * 3, results):
+    bands, pb = get_image_rainbow_bands_and_perceived_brightness(Image.open(image_path + image_file), 60)
+    assert (result.bands, result.pb, result.primary_band) == (bands, pb, get_primary_band(bands)), image_file
+    assert result.vividity == get_image_color_features(Image.open(image_path + image_file), 60).vividity
+#end for
+
+# same again analyzing in the download threads
+assert list(analyze_covers(urls, band_deg=60, fetch_workers=4, analysis_workers=0)) == results
+print(f'{len(results)} covers analyzed in order')
+
+# %% The urls are consumed lazily: with a window of 4 only a handful get requested before the first result
+requested = []
+def tracked_urls():
+    for url in urls:
+        requested.append(url)
+        yield url
+covers = analyze_covers(tracked_urls(), band_deg=60, fetch_workers=2, analysis_workers=0, max_pending=4)
+next(covers)
+assert len(requested) == 4, requested
+covers.close()
+
+# %% Repeated covers are only downloaded once but still come back for every track
+stats = DedupStats()
+CoverHandler.requests_served = 0
+assert list(analyze_unique_covers(iter(urls), band_deg=60, stats=stats, analysis_workers=0, max_pending=8)) == results
+assert (stats.tracks, stats.covers, stats.saved) == (len(urls), len(image_list), 2 * len(image_list))
+assert CoverHandler.requests_served == len(image_list)
+print(stats)
+
+# %% With a cache the second run doesn't download or analyze anything
+cache = CoverCache(':memory:')
+unique_urls = urls[:len(image_list)]
+assert list(analyze_covers(unique_urls, band_deg=60, analysis_workers=2, cache=cache)) == results[:len(image_list)]
+assert (len(cache), cache.url_misses, cache.content_misses) == (len(image_list), len(image_list), len(image_list))
+CoverHandler.requests_served = 0
+assert list(analyze_covers(unique_urls, band_deg=60, analysis_workers=2, cache=cache)) == results[:len(image_list)]
+assert (CoverHandler.requests_served, cache.url_hits) == (0, len(image_list))
+# a different band_deg is a different result
+assert next(analyze_covers(unique_urls[:1], band_deg=30, analysis_workers=0, cache=cache)).url == unique_urls[0]
+assert cache.content_misses == len(image_list) + 1
+print(cache)
+
+# the same image under another url is found by its contents
+assert next(analyze_covers([base_url + 'slow/' + quote(image_list[0])], band_deg=60, cache=cache)) == \
+    results[0]._replace(url=base_url + 'slow/' + quote(image_list[0]))
+assert cache.content_hits == 1
+
+# the least recently used covers get evicted
+small_cache = CoverCache(':memory:', max_entries=10)
+list(analyze_covers(unique_urls, band_deg=60, analysis_workers=0, cache=small_cache))
+assert len(small_cache) == 10
+assert small_cache.get_by_url(unique_urls[-1], 60) is not None and small_cache.get_by_url(unique_urls[0], 60) is None
+
+# a url stays as long as there are results for its cover, whatever the band_deg
+tiny_cache = CoverCache(':memory:', max_entries=2)
+tiny_cache.put('a', 60, CachedFeatures({0: 1.0}, 0.5, 0, 1.0), 'a.jpg')
+tiny_cache.put('a', 30, CachedFeatures({0: 1.0}, 0.5, 0, 1.0), 'a.jpg')
+tiny_cache.put('b', 60, CachedFeatures({0: 1.0}, 0.5, 0, 1.0), 'b.jpg')
+assert tiny_cache.get_by_url('a.jpg', 60) is None and tiny_cache.get_by_url('a.jpg', 30) is not None
+# which was just used, so b makes way for c and then a for d
+tiny_cache.put('c', 60, CachedFeatures({0: 1.0}, 0.5, 0, 1.0), 'c.jpg')
+assert tiny_cache._db.execute('SELECT url FROM urls ORDER BY url').fetchall() == [('a.jpg',), ('c.jpg',)]
+tiny_cache.put('d', 60, CachedFeatures({0: 1.0}, 0.5, 0, 1.0), 'd.jpg')
+assert tiny_cache._db.execute('SELECT url FROM urls ORDER BY url').fetchall() == [('c.jpg',), ('d.jpg',)]
+
+# two caches on the same file, like two processes, keep one LRU order between them
+with tempfile.TemporaryDirectory() as cache_dir:
+    (first, second) = (CoverCache(os.path.join(cache_dir, 'covers.sqlite'), max_entries=2) for i in range(2))
+    features = CachedFeatures({0: 1.0}, 0.5, 0, 1.0)
+    first.put('a', 60, features)
+    first.put('b', 60, features)
+    # second uses a after first stored b, so b is the least recently used...
+    assert second.get_by_hash('a', 60) == features
+    # ...and makes way for c
+    second.put('c', 60, features)
+    assert first.get_by_hash('b', 60) is None and first.get_by_hash('a', 60) == features
+    first.close()
+    second.close()
+#end with
+
+# %% A request slower than the timeout raises when its turn comes
+try:
+    list(analyze_covers([urls[0], base_url + 'slow/' + quote(image_list[0])], band_deg=60,
+        analysis_workers=0, timeout=0.5))
+    assert False, 'expected a timeout'
+except requests.exceptions.Timeout:
+    pass
+
+server.shutdown()
+
+# %%
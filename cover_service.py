@@ -0,0 +1,451 @@
+import asyncio
+import base64
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import urlsplit
+from cover_cache import CachedFeatures, CoverCache, content_hash, sampling_key
+from cover_pipeline import analyze_pixels, create_session, decode_cover, download_cover
+from rainbow_util import PixelBuffer
+
+# the biggest request body accepted, a batch of images as base64 in JSON included
+MAX_BODY = 64 * 2**20
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    413: 'Payload Too Large', 500: 'Internal Server Error', 501: 'Not Implemented'}
+
+# the pixel buffer of the worker process (or thread) running analyze_batch
+_buffers = threading.local()
+
+
+def analyze_batch(images:list, band_deg:int, max_pixels:Optional[int], sampling:str)->list:
+    '''Decode and analyze a batch of cover images. Module-level so it can be run in a worker process,
+    each image gets decoded into the same buffer
+    :param images: the image file contents
+    :param band_deg: size of the rainbow band partition in degrees
+    :param max_pixels: optional pixel budget per cover, see rainbow_util.sample_pixels
+    :param sampling: the sampling method to stay within max_pixels
+    :return: a CachedFeatures per image, or the exception if it couldn't be analyzed'''
+    if not hasattr(_buffers, 'pixels'):
+        _buffers.pixels = PixelBuffer()
+    results = []
+    for data in images:
+        try:
+            result = analyze_pixels('', decode_cover(data, max_pixels, sampling, _buffers.pixels), band_deg)
+            results.append(CachedFeatures(*result[1:]))
+        except Exception as e:
+            results.append(e)
+    #end for
+    return results
+
+
+class ServiceStats:
+    '''What the service did since it started'''
+    def __init__(self):
+        self.requests = 0
+        self.covers = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self.downloads = 0
+        self.analyzed = 0
+        # covers that went to the workers but couldn't be analyzed, e.g. not an image
+        self.failed = 0
+        self.batches = 0
+        self.errors = 0
+
+    def to_dict(self)->dict:
+        return dict(vars(self))
+
+    def __repr__(self)->str:
+        return f'{self.requests} requests for {self.covers} covers: {self.coalesced} coalesced, ' \
+            + f'{self.cache_hits} from the cache, {self.downloads} downloaded, {self.analyzed} analyzed ' \
+            + f'and {self.failed} failed in {self.batches} batches, {self.errors} errors'
+
+
+class CoverService:
+    '''Cover analysis for other jobs to call, by url or with the image itself, on an asyncio event loop.
+    - concurrent requests for the same cover (same url, or same image contents) share a single download and
+      analysis
+    - covers already in the cache are neither downloaded nor analyzed
+    - the covers to analyze are gathered into batches of up to batch_size, waiting at most batch_wait seconds
+      for a batch to fill up, and each batch is decoded and analyzed in one go on the worker pool. While all the
+      workers are busy the covers pile up in the queue, so the busier the service the fuller the batches
+    Create it and call start() from within the event loop, see serve() for the HTTP front end'''
+    def __init__(self, band_deg:int=60, cache:Optional[CoverCache]=None, fetch_workers:int=16,
+            analysis_workers:Optional[int]=None, batch_size:int=16, batch_wait:float=0.002,
+            max_pixels:Optional[int]=None, sampling:str='thumbnail', timeout:float=10.0):
+        '''
+        :param band_deg: size of the rainbow band partition in degrees
+        :param cache: optional CoverCache to get results from and store new results in
+        :param fetch_workers: number of concurrent downloads (and cache lookups)
+        :param analysis_workers: number of analysis processes, None for one per CPU, 0 to analyze in the download threads
+        :param batch_size: the most covers per batch of analysis
+        :param batch_wait: seconds to wait for more covers to join a batch that isn't full
+        :param max_pixels: optional pixel budget per cover, see rainbow_util.sample_pixels
+        :param sampling: the sampling method to stay within max_pixels
+        :param timeout: per download timeout in seconds
+        '''
+        self.band_deg = band_deg
+        self.cache = cache
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_pixels = max_pixels
+        self.sampling = sampling
+        self.timeout = timeout
+        self.stats = ServiceStats()
+        self._key = sampling_key(max_pixels, sampling)
+        self._session = create_session(fetch_workers)
+        self._io_pool = ThreadPoolExecutor(max_workers=fetch_workers)
+        if analysis_workers == 0:
+            self._analysis_pool = self._io_pool
+            analysis_workers = fetch_workers
+        else:
+            analysis_workers = analysis_workers or os.cpu_count() or 1
+            self._analysis_pool = ProcessPoolExecutor(max_workers=analysis_workers)
+        # batches being analyzed at once, enough to keep every worker busy
+        self._max_batches = analysis_workers + 1
+        # the downloads and analyses under way, by ('url', url) or ('content', digest)
+        self._in_flight = {}
+        self._queue = None
+        self._batcher = None
+        # the batches being analyzed, kept so they can't get garbage collected halfway and can be cancelled
+        self._batch_tasks = set()
+        # the open HTTP connections, by the task serving them
+        self.connections = {}
+
+    def start(self)->None:
+        '''Start handing out the batches of analysis, call from the event loop'''
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.create_task(self._run_batcher())
+
+    async def close(self)->None:
+        '''Close the open connections and stop the workers'''
+        for writer in self.connections.values():
+            writer.close()
+        # the connections see the end of their streams and finish up
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        tasks = [task for task in [self._batcher, *self._batch_tasks] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._io_pool.shutdown(wait=False, cancel_futures=True)
+        self._analysis_pool.shutdown(wait=False, cancel_futures=True)
+        self._session.close()
+
+    def _run_io(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self._io_pool, function, *args)
+
+    async def _run_batcher(self)->None:
+        batches = asyncio.Semaphore(self._max_batches)
+        while True:
+            batch = [await self._queue.get()]
+            if self.batch_wait > 0 and self._queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.batch_wait)
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # wait for a worker to be free, meanwhile the next batch fills up
+            await batches.acquire()
+            task = asyncio.create_task(self._analyze_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(lambda task: self._batch_done(task, batches))
+        #end while
+
+    def _batch_done(self, task:asyncio.Task, batches:asyncio.Semaphore)->None:
+        self._batch_tasks.discard(task)
+        batches.release()
+        if not task.cancelled() and task.exception() is not None:
+            # a bug rather than a cover that couldn't be analyzed, those are results; don't let it go unnoticed
+            asyncio.get_running_loop().call_exception_handler({'message': 'analyzing a batch of covers failed',
+                'exception': task.exception(), 'task': task})
+
+    async def _analyze_batch(self, batch:list)->None:
+        self.stats.batches += 1
+        try:
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(self._analysis_pool, analyze_batch,
+                    [data for (data, future) in batch], self.band_deg, self.max_pixels, self.sampling)
+            except Exception as e:
+                results = [e] * len(batch)
+            for ((data, future), result) in zip(batch, results):
+                if isinstance(result, Exception):
+                    self.stats.failed += 1
+                else:
+                    self.stats.analyzed += 1
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            #end for
+        finally:
+            # whatever happened, nobody waits forever for a cover of this batch
+            for (data, future) in batch:
+                future.cancel()
+
+    async def _coalesce(self, key:tuple, coroutine)->CachedFeatures:
+        # one task per cover, whoever asks for it while it's under way waits for the same task
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coroutine)
+            self._in_flight[key] = task
+            task.add_done_callback(lambda task: self._in_flight.pop(key, None))
+        else:
+            coroutine.close()
+            self.stats.coalesced += 1
+        # a client going away doesn't cancel the work the other clients are waiting for
+        return await asyncio.shield(task)
+
+    async def _analyze_new_data(self, data:bytes, digest:str, url:Optional[str])->CachedFeatures:
+        if self.cache is not None:
+            cached = await self._run_io(self.cache.get_by_hash, digest, self.band_deg, url, self._key)
+            if cached is not None:
+                self.stats.cache_hits += 1
+                return cached
+        #end if
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((data, future))
+        features = await future
+        if self.cache is not None:
+            await self._run_io(self.cache.put, digest, self.band_deg, features, url, self._key)
+        return features
+
+    async def _analyze_new_url(self, url:str)->CachedFeatures:
+        if self.cache is not None:
+            cached = await self._run_io(self.cache.get_by_url, url, self.band_deg, self._key)
+            if cached is not None:
+                self.stats.cache_hits += 1
+                return cached
+        #end if
+        self.stats.downloads += 1
+        data = await self._run_io(download_cover, self._session, url, self.timeout)
+        return await self.analyze_data(data, url)
+
+    async def analyze_data(self, data:bytes, url:Optional[str]=None)->CachedFeatures:
+        '''Analyze a cover image
+        :param data: the image file contents
+        :param url: optional url the image came from, for the cache
+        :return: the cover's results'''
+        digest = content_hash(data)
+        return await self._coalesce(('content', digest), self._analyze_new_data(data, digest, url))
+
+    async def analyze_url(self, url:str)->CachedFeatures:
+        '''Download and analyze a cover image
+        :param url: url of the cover image
+        :return: the cover's results'''
+        return await self._coalesce(('url', url), self._analyze_new_url(url))
+
+    async def analyze(self, urls:list=(), images:list=())->list:
+        '''Analyze a batch of covers, a cover that can't be downloaded or analyzed doesn't fail the rest
+        :param urls: cover image urls
+        :param images: cover image file contents
+        :return: a dict per cover, urls first then images, with the bands, pb, primary_band and vividity,
+            or the error if it failed'''
+        self.stats.requests += 1
+        self.stats.covers += len(urls) + len(images)
+        results = await asyncio.gather(*[self.analyze_url(url) for url in urls],
+            *[self.analyze_data(data) for data in images], return_exceptions=True)
+        response = []
+        for (i, result) in enumerate(results):
+            item = {'url': urls[i]} if i < len(urls) else {}
+            if isinstance(result, Exception):
+                self.stats.errors += 1
+                item['error'] = f'{type(result).__name__}: {result}'
+            else:
+                item.update(bands=result.bands, pb=result.pb, primary_band=int(result.primary_band),
+                    vividity=result.vividity)
+            response.append(item)
+        #end for
+        return response
+
+    async def handle(self, method:str, path:str, headers:dict, body:bytes)->tuple:
+        '''Handle an HTTP request:
+        - POST /analyze with a JSON body {"urls": [...], "images": [base64 encoded images...]} (either can be
+          left out), or with the image itself as the body, gives {"results": [...]}, see analyze
+        - GET /stats gives the ServiceStats
+        :return: a tuple with the status code and the response to send as JSON'''
+        path = urlsplit(path).path
+        if path == '/stats':
+            if method != 'GET':
+                return 405, {'error': 'use GET'}
+            return 200, self.stats.to_dict()
+        if path != '/analyze':
+            return 404, {'error': f'no such endpoint {path}'}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+        if headers.get('content-type', '').split(';')[0].strip() == 'application/json':
+            try:
+                request = json.loads(body)
+                urls = [str(url) for url in request.get('urls', [])]
+                images = [base64.b64decode(image, validate=True) for image in request.get('images', [])]
+            except (ValueError, TypeError, AttributeError) as e:
+                return 400, {'error': f'{type(e).__name__}: {e}'}
+        else:
+            (urls, images) = ([], [body])
+        return 200, {'results': await self.analyze(urls, images)}
+
+
+async def _read_request(reader:asyncio.StreamReader)->Optional[tuple]:
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    (method, path, version) = request_line.decode('latin-1').split()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        (name, _, value) = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    #end while
+    return method, path, version, headers
+
+class _BodyTooLarge(ValueError):
+    pass
+
+async def _read_body(reader:asyncio.StreamReader, headers:dict)->bytes:
+    # a body with a Content-Length, or chunked; raises _BodyTooLarge past MAX_BODY and ValueError if malformed
+    encoding = headers.get('transfer-encoding', '').lower()
+    if not encoding:
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY:
+            raise _BodyTooLarge()
+        return await reader.readexactly(length)
+    if encoding != 'chunked':
+        raise NotImplementedError(encoding)
+    chunks = []
+    size = 0
+    while True:
+        chunk_size = int((await reader.readline()).split(b';')[0], 16)
+        if chunk_size == 0:
+            # skip the trailers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            return b''.join(chunks)
+        size += chunk_size
+        if size > MAX_BODY:
+            raise _BodyTooLarge()
+        chunks.append(await reader.readexactly(chunk_size))
+        if (await reader.readexactly(2)) != b'\r\n':
+            raise ValueError('malformed chunk')
+    #end while
+
+def _response(status:int, payload:dict, keep_alive:bool)->bytes:
+    body = json.dumps(payload).encode()
+    return (f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: application/json\r\n'
+        + f'Content-Length: {len(body)}\r\nConnection: {"keep-alive" if keep_alive else "close"}\r\n\r\n').encode() \
+        + body
+
+async def serve(service:CoverService, host:str='127.0.0.1', port:int=8765)->asyncio.AbstractServer:
+    '''Start the HTTP front end of the service, a minimal HTTP/1.1 server with keep-alive connections; request
+    bodies can come with a Content-Length or chunked
+    :param service: the service, started here
+    :param host: the address to listen on
+    :param port: the port to listen on, 0 for any free port
+    :return: the asyncio server, its sockets give the port'''
+    service.start()
+
+    async def handle_connection(reader:asyncio.StreamReader, writer:asyncio.StreamWriter)->None:
+        service.connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                    if request is None:
+                        break
+                    (method, path, version, headers) = request
+                    body = await _read_body(reader, headers)
+                except _BodyTooLarge:
+                    writer.write(_response(413, {'error': f'the most a request can send is {MAX_BODY} bytes'}, False))
+                    break
+                except ValueError:
+                    writer.write(_response(400, {'error': 'malformed request'}, False))
+                    break
+                except NotImplementedError as e:
+                    writer.write(_response(501, {'error': f'unsupported transfer encoding {e}'}, False))
+                    break
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                try:
+                    (status, payload) = await service.handle(method, path, headers, body)
+                except Exception as e:
+                    (status, payload) = (500, {'error': f'{type(e).__name__}: {e}'})
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+            #end while
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del service.connections[asyncio.current_task()]
+            writer.close()
+    #end def
+
+    return await asyncio.start_server(handle_connection, host, port)
+
+def run(host:str='127.0.0.1', port:int=8765, cache_path:Optional[str]='cover_cache.sqlite', **service_args)->None:
+    '''Run the service until interrupted
+    :param host: the address to listen on
+    :param port: the port to listen on
+    :param cache_path: the CoverCache database, None to not cache
+    :param service_args: passed on to CoverService'''
+    async def main()->None:
+        cache = CoverCache(cache_path) if cache_path else None
+        service = CoverService(cache=cache, **service_args)
+        server = await serve(service, host, port)
+        print(f'serving cover analysis on http://{host}:{server.sockets[0].getsockname()[1]}/analyze')
+        try:
+            await server.serve_forever()
+        finally:
+            await service.close()
+            if cache is not None:
+                cache.close()
+    #end def
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+class ServiceThread(threading.Thread):
+    '''Run the service on an event loop of its own in a background thread, for tests and the load generator'''
+    def __init__(self, host:str='127.0.0.1', port:int=0, **service_args):
+        '''
+        :param host: the address to listen on
+        :param port: the port to listen on, by default any free port
+        :param service_args: passed on to CoverService
+        '''
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.service = CoverService(**service_args)
+        self._ready = threading.Event()
+        self._loop = None
+        self._stopping = None
+
+    def run(self)->None:
+        asyncio.run(self._serve())
+
+    async def _serve(self)->None:
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        server = await serve(self.service, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        await self._stopping.wait()
+        server.close()
+        await self.service.close()
+
+    def start(self)->'ServiceThread':
+        super().start()
+        self._ready.wait()
+        return self
+
+    @property
+    def url(self)->str:
+        return f'http://{self.host}:{self.port}'
+
+    def stop(self)->None:
+        self._loop.call_soon_threadsafe(self._stopping.set)
+        self.join()
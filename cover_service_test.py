@@ -0,0 +1,109 @@
+# %% Run the cover analysis service against a local HTTP server serving test_covers/, no internet needed
+import base64
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import requests
+from PIL import Image
+from rainbow_util import *
+from cover_cache import CoverCache
+from cover_service import ServiceThread
+from service_load import run_load
+from test_server import QuietHandler, serve_directory
+
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+
+
+class CoverHandler(QuietHandler):
+    '''Serve the test covers, with a /slow/ prefix that takes its time'''
+    requests_served = 0
+
+    def do_GET(self):
+        CoverHandler.requests_served += 1
+        if self.path.startswith('/slow/'):
+            time.sleep(0.5)
+            self.path = self.path[len('/slow'):]
+        super().do_GET()
+
+
+(server, base_url) = serve_directory(image_path, CoverHandler)
+urls = [base_url + quote(f) for f in image_list]
+
+service = ServiceThread(analysis_workers=2, cache=CoverCache(':memory:')).start()
+session = requests.Session()
+
+def analyze(**request)->list:
+    response = session.post(service.url + '/analyze', json=request)
+    assert response.status_code == 200, response.text
+    return response.json()['results']
+
+def expected(image_file:str)->dict:
+    bands, pb = get_image_rainbow_bands_and_perceived_brightness(Image.open(image_path + image_file), 60)
+    return {'bands': {str(k): v for (k, v) in bands.items()}, 'pb': pb, 'primary_band': get_primary_band(bands),
+        'vividity': get_image_color_features(Image.open(image_path + image_file), 60).vividity}
+
+# %% A batch of urls gives the same results as analyzing the files directly, in the same order
+results = analyze(urls=urls)
+assert [result['url'] for result in results] == urls
+for (image_file, result) in zip(image_list, results):
+    assert {k: result[k] for k in ('bands', 'pb', 'primary_band', 'vividity')} == expected(image_file), image_file
+# and the second time around they all come from the cache
+hits = service.service.stats.cache_hits
+assert analyze(urls=urls) == results
+assert service.service.stats.cache_hits - hits == len(urls)
+
+# %% The images themselves, base64 encoded in the JSON or as the body of the request
+with open(image_path + image_list[0], 'rb') as f:
+    data = f.read()
+assert analyze(images=[base64.b64encode(data).decode()]) == [expected(image_list[0])]
+response = session.post(service.url + '/analyze', data=data, headers={'Content-Type': 'image/jpeg'})
+assert response.json()['results'] == [expected(image_list[0])]
+# a body of unknown length comes chunked
+response = session.post(service.url + '/analyze', data=(data[i:i + 1000] for i in range(0, len(data), 1000)),
+    headers={'Content-Type': 'image/jpeg'})
+assert response.request.headers['Transfer-Encoding'] == 'chunked'
+assert response.json()['results'] == [expected(image_list[0])]
+response = session.post(service.url + '/analyze', data=data, headers={'Content-Type': 'image/jpeg',
+    'Transfer-Encoding': 'gzip'})
+assert response.status_code == 501
+
+# %% Concurrent requests for the same cover get one download and one analysis between them
+CoverHandler.requests_served = 0
+stats = service.service.stats
+(coalesced, analyzed) = (stats.coalesced, stats.analyzed)
+slow_url = base_url + 'slow/' + quote(image_list[1]) + '?fresh'
+with ThreadPoolExecutor(max_workers=10) as pool:
+    responses = list(pool.map(lambda i: requests.post(service.url + '/analyze', json={'urls': [slow_url]}).json(),
+        range(10)))
+assert all(response == responses[0] for response in responses)
+assert CoverHandler.requests_served == 1
+assert stats.coalesced - coalesced == 9 and stats.analyzed - analyzed == 0  # same contents as before, cached
+
+# %% One bad cover doesn't fail the rest of the batch, bad requests get an error status
+(analyzed, failed) = (stats.analyzed, stats.failed)
+results = analyze(urls=[urls[0], base_url + 'nope.jpg'], images=[base64.b64encode(b'not an image').decode()])
+assert 'pb' in results[0]
+assert results[1]['error'].startswith('HTTPError') and results[2]['error'].startswith('UnidentifiedImageError')
+# only the one that got to the workers counts as failed, and not as analyzed
+assert (stats.analyzed - analyzed, stats.failed - failed) == (0, 1)
+assert session.post(service.url + '/analyze', data='{"urls": ', headers={'Content-Type': 'application/json'}) \
+    .status_code == 400
+assert session.get(service.url + '/analyze').status_code == 405
+assert session.get(service.url + '/nope').status_code == 404
+print(session.get(service.url + '/stats').json())
+
+# the batches keep no tasks around once they're done, and stopping cancels the batcher
+assert not service.service._batch_tasks
+service.stop()
+assert service.service._batcher.cancelled()
+server.shutdown()
+
+# %% The load generator: concurrent clients asking for the popular covers at the same time get coalesced
+metrics = run_load(clients=8, requests=5, batch=8, albums=100, analysis_workers=1)
+print(metrics.report())
+assert metrics.counters['covers'] == 8 * 5 * 8 and metrics.counters['errors'] == 0
+assert len(metrics.timings['request']) == 8 * 5
+
+# %%
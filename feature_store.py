@@ -0,0 +1,182 @@
+import os
+import struct
+from typing import Iterable, Optional, Union
+import numpy as np
+import pandas as pd
+
+MAGIC = b'RBFS'
+VERSION = 2
+# magic, version, band_deg, record size, padded to HEADER_SIZE
+HEADER = struct.Struct('<4sHHI')
+HEADER_SIZE = 64
+# Spotify ids are 22 characters of base62
+TRACK_ID_SIZE = 22
+
+
+def record_dtype(band_deg:int)->np.dtype:
+    '''The fixed-width record of a track: 62 bytes with 60 degree bands, 86 with 30 degree bands
+    - track_id: the Spotify track id, empty for local files
+    - band: the primary band, 16 bits for bands as narrow as a degree
+    - track_number: the track's number on its album
+    - cover: the cover's row in the urls file
+    - pb: the cover's perceived brightness
+    - vividity: the share of vivid pixels in the cover, NaN if not known
+    - bands: the band weights'''
+    return np.dtype([('track_id', f'S{TRACK_ID_SIZE}'), ('band', np.uint16), ('track_number', np.uint16),
+        ('cover', np.uint32), ('pb', np.float32), ('vividity', np.float32),
+        ('bands', np.float32, (360 // band_deg,))])
+
+
+class FeatureStore:
+    '''The color features of a whole library as fixed-width records in a memory-mapped file, tens of bytes per track
+    instead of the dicts and object columns of a dataframe.
+    The records are append-only: new tracks get added at the end and nothing is ever changed in place, so any
+    number of processes can open the store and map it read-only at the same time, sharing the same pages
+    without copies. There should only be one process adding tracks at a time.
+    The cover urls are kept once per cover in a text file next to the store, path + '.urls'.
+    Tracks are added through a buffer of chunk_size records, which is written out when full, on flush()
+    or when the store is used as a context manager and closed'''
+    def __init__(self, path:str, band_deg:Optional[int]=None, chunk_size:int=4096):
+        '''
+        :param path: the store file, created if it doesn't exist
+        :param band_deg: size of the rainbow band partition in degrees, needed to create a store and
+            checked against an existing one
+        :param chunk_size: number of records to buffer before writing them out
+        '''
+        self.path = path
+        self.urls_path = path + '.urls'
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                (magic, version, stored_band_deg, record_size) = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'{path} is not a version {VERSION} feature store')
+            if band_deg is not None and band_deg != stored_band_deg:
+                raise ValueError(f'{path} has {stored_band_deg} degree bands, not {band_deg}')
+            band_deg = stored_band_deg
+        else:
+            if band_deg is None:
+                raise ValueError('band_deg is needed to create a feature store')
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, band_deg, record_dtype(band_deg).itemsize).ljust(HEADER_SIZE, b'\0'))
+            open(self.urls_path, 'w').close()
+        #end if
+        self.band_deg = band_deg
+        self.dtype = record_dtype(band_deg)
+        self._buffer = np.zeros(chunk_size, dtype=self.dtype)
+        self._buffered = 0
+        self._records = None
+        self._urls = None
+        self._cover_index = None
+
+    def refresh(self)->np.ndarray:
+        '''Map the records that are in the file now, including the ones other processes added since'''
+        count = (os.path.getsize(self.path) - HEADER_SIZE) // self.dtype.itemsize
+        if self._records is None or len(self._records) != count:
+            self._records = np.memmap(self.path, dtype=self.dtype, mode='r', offset=HEADER_SIZE, shape=(count,)) \
+                if count > 0 else np.zeros(0, dtype=self.dtype)
+            self._urls = None
+        return self._records
+
+    @property
+    def records(self)->np.ndarray:
+        '''The records written so far, a read-only memory-mapped structured array'''
+        return self._records if self._records is not None else self.refresh()
+
+    def __len__(self)->int:
+        return len(self.records)
+
+    def urls(self)->np.ndarray:
+        '''The cover urls, indexed by the records' cover field'''
+        if self._urls is None:
+            with open(self.urls_path) as f:
+                self._urls = np.array(f.read().splitlines(), dtype=object)
+        return self._urls
+
+    def _cover(self, url:str)->int:
+        if self._cover_index is None:
+            self._cover_index = {url: i for (i, url) in enumerate(self.urls())}
+        cover = self._cover_index.get(url)
+        if cover is None:
+            # the url goes in before any record pointing to it, so readers can always find it
+            cover = len(self._cover_index)
+            with open(self.urls_path, 'a') as f:
+                f.write(url + '\n')
+            self._cover_index[url] = cover
+        #end if
+        return cover
+
+    def add(self, track_id:Optional[str], track_number:int, url:str, bands:Union[dict, Iterable[float]], pb:float,
+            vividity:float=float('nan'))->None:
+        '''Add a track, buffered until flushed
+        :param track_id: the Spotify track id, None for a local file
+        :param track_number: the track's number on its album
+        :param url: the cover url
+        :param bands: the band weights, as a band to weight dict or in band order
+        :param pb: the cover's perceived brightness
+        :param vividity: the share of vivid pixels in the cover, if known'''
+        record = self._buffer[self._buffered]
+        record['track_id'] = (track_id or '').encode('ascii')
+        bands = np.fromiter(bands.values() if isinstance(bands, dict) else bands, dtype=np.float64,
+            count=len(record['bands']))
+        record['bands'] = bands
+        # the first band with the most weight, like get_primary_band, before rounding to float32
+        record['band'] = np.argmax(bands)
+        record['track_number'] = track_number
+        record['cover'] = self._cover(url)
+        record['pb'] = pb
+        record['vividity'] = vividity
+        self._buffered += 1
+        if self._buffered == len(self._buffer):
+            self.flush()
+
+    def flush(self)->None:
+        '''Write the buffered tracks to the end of the file'''
+        if self._buffered == 0:
+            return
+        with open(self.path, 'ab') as f:
+            # in a single write, so readers never see half a record
+            f.write(self._buffer[:self._buffered].tobytes())
+        self._buffered = 0
+        self.refresh()
+
+    def close(self)->None:
+        self.flush()
+        self._records = None
+
+    def __enter__(self)->'FeatureStore':
+        return self
+
+    def __exit__(self, *exc_info)->None:
+        self.close()
+
+    def sort_order(self, rows:Optional[np.ndarray]=None)->np.ndarray:
+        '''The rainbow order of the tracks: by band, then perceived brightness, then track number, same as
+        sorting the dataframe by SORT_KEY (with pb in float32 precision)
+        :param rows: the rows to sort, all of them by default
+        :return: the record numbers in sorted order'''
+        records = self.records if rows is None else self.records[rows]
+        order = np.lexsort((records['track_number'], records['pb'], records['band']))
+        return order if rows is None else np.asarray(rows)[order]
+
+    def track_ids(self, rows:Optional[np.ndarray]=None)->list:
+        '''The track ids of the records, e.g. in sort_order to write the sorted playlist'''
+        ids = self.records['track_id'] if rows is None else self.records['track_id'][rows]
+        return ids.astype(str).tolist()
+
+    def first_per_cover(self, rows:np.ndarray)->np.ndarray:
+        '''Keep the first of the rows with the same cover, e.g. to render each album once
+        :param rows: record numbers, e.g. in sort_order
+        :return: the record numbers of the first row of each cover, in the same order'''
+        (covers, first) = np.unique(self.records['cover'][rows], return_index=True)
+        return np.asarray(rows)[np.sort(first)]
+
+    def to_dataframe(self, rows:Optional[np.ndarray]=None)->pd.DataFrame:
+        '''Build a dataframe with the TRACK_COLUMNS (plus the vividity) of just the rows needed, e.g. those of
+        a page to render
+        :param rows: record numbers, all of them by default
+        :return: the dataframe, in the order of rows'''
+        records = self.records if rows is None else self.records[rows]
+        return pd.DataFrame({'track_id': records['track_id'].astype(str).astype(object),
+            'band': records['band'].astype(np.int64), 'pb': records['pb'].astype(np.float64),
+            'track_number': records['track_number'].astype(np.int64), 'img_url': self.urls()[records['cover']],
+            'vividity': records['vividity'].astype(np.float64)})
@@ -0,0 +1,95 @@
+# %% Fill a feature store from the test covers and check it against the dataframe way of doing things
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+from PIL import Image
+from rainbow_util import *
+from feature_store import FeatureStore, record_dtype
+
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+features = [get_image_color_features(Image.open(image_path + f), 60) for f in image_list]
+
+# a made up playlist: a few tracks per album, in no particular order
+rng = np.random.default_rng(0)
+albums = rng.integers(0, len(image_list), 500)
+track_numbers = rng.integers(1, 20, 500)
+track_ids = [f'{i:022d}' for i in range(500)]
+
+directory = tempfile.mkdtemp()
+path = os.path.join(directory, 'library.rbfs')
+rows = ColumnAccumulator(TRACK_COLUMNS)
+with FeatureStore(path, band_deg=60, chunk_size=64) as store:
+    for (track_id, album, track_number) in zip(track_ids, albums, track_numbers):
+        f = features[album]
+        store.add(track_id, track_number, image_list[album], f.bands_dict(), f.pb, f.vividity)
+        rows.append([track_id, f.primary_band, f.pb, track_number, image_list[album]])
+    #end for
+#end with
+df = rows.to_dataframe()
+
+# %% Tens of bytes per track, and the covers only once
+assert record_dtype(60).itemsize == 62 and record_dtype(30).itemsize == 86
+assert os.path.getsize(path) == 64 + 500 * 62
+store = FeatureStore(path)
+assert len(store) == 500 and store.band_deg == 60
+assert len(store.urls()) == len(set(albums))
+print(f'{os.path.getsize(path) / len(store):.0f} bytes per track, band weights included')
+
+# %% The records read back the same, in float32
+records = store.records
+assert isinstance(records, np.memmap)
+assert store.track_ids() == track_ids
+assert np.array_equal(records['band'], df['band']) and np.array_equal(records['track_number'], track_numbers)
+assert np.array_equal(records['pb'], df['pb'].astype(np.float32))
+assert np.array_equal(records['vividity'], np.float32([features[a].vividity for a in albums]))
+assert np.allclose(records['bands'], [features[a].bands for a in albums])
+assert store.to_dataframe(np.arange(3))['img_url'].tolist() == [image_list[a] for a in albums[:3]]
+
+# %% Sorting and rendering straight off the store give the same as the dataframe
+order = store.sort_order()
+assert store.track_ids(order) == df.sort_values(by=SORT_KEY, kind='stable')['track_id'].tolist()
+img_df = df.sort_values(by=SORT_KEY, kind='stable').drop_duplicates(subset=['img_url'])
+page = store.to_dataframe(store.first_per_cover(order))
+assert page['img_url'].tolist() == img_df['img_url'].tolist()
+assert page[['track_id', 'band', 'track_number']].equals(img_df[['track_id', 'band', 'track_number']]
+    .reset_index(drop=True))
+# a subset gets sorted the same as its part of the whole order
+subset = np.arange(100, 200)
+assert store.sort_order(subset).tolist() == [i for i in order if 100 <= i < 200]
+
+# %% Appending: another process adds tracks while this one reads, and sees them after a refresh
+script = f'''
+from feature_store import FeatureStore
+with FeatureStore({path!r}, band_deg=60) as store:
+    store.add('{'x' * 22}', 1, 'new.jpg', [1, 0, 0, 0, 0, 0], 0.5)
+    store.add(None, 2, {image_list[albums[0]]!r}, [0, 0, 0, 0, 0, 1], 0.25)
+'''
+subprocess.run([sys.executable, '-c', script], check=True)
+assert len(store) == 500
+store.refresh()
+assert len(store) == 502 and store.track_ids()[-2:] == ['x' * 22, '']
+assert store.to_dataframe([500, 501])['img_url'].tolist() == ['new.jpg', image_list[albums[0]]]
+assert store.records['band'][-2:].tolist() == [0, 5] and np.isnan(store.records['vividity'][-1])
+assert store.track_ids()[:500] == track_ids
+
+# %% Bands as narrow as a degree: more than 256 of them, the primary band still fits
+with FeatureStore(os.path.join(directory, 'narrow.rbfs'), band_deg=1) as narrow:
+    narrow.add('x' * 22, 1, 'narrow.jpg', np.eye(360)[300], 0.5)
+assert narrow.records['band'].tolist() == [300] and narrow.to_dataframe()['band'].tolist() == [300]
+
+# %% A store only opens with the band size it was made with
+try:
+    FeatureStore(path, band_deg=30)
+    assert False
+except ValueError as e:
+    print(e)
+try:
+    FeatureStore(os.path.join(directory, 'new.rbfs'))
+    assert False
+except ValueError as e:
+    print(e)
+
+# %%
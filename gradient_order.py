@@ -0,0 +1,164 @@
+import math
+from typing import Optional
+import numpy as np
+from scipy.spatial import cKDTree
+
+# neighbors looked at per cover, for the greedy path and for the 2-opt moves
+NEIGHBORS = 8
+# give up on the tree of the covers left to visit once this many of the nearest have been visited already,
+# and build a new one without them
+MAX_QUERY = 64
+
+
+def cover_points(bands:np.ndarray, pb:np.ndarray, band_deg:int=60, brightness_weight:float=1.0)->np.ndarray:
+    '''Turn each cover's color features into a point, so similar covers end up close together: the band weights
+    add up to a vector on the color wheel, pointing at the cover's hue and as long as it's saturated (grays sit
+    in the middle, whatever their hue), and the perceived brightness is the height
+    :param bands: an (N, 360 // band_deg) array of band weights, e.g. the bands of ColorFeatures or a FeatureStore
+    :param pb: the perceived brightness of each cover
+    :param band_deg: size of the rainbow band partition in degrees
+    :param brightness_weight: how much brightness counts against hue, 1 for the same
+    :return: an (N, 3) array of points'''
+    bands = np.asarray(bands, dtype=np.float64)
+    # the middle of each band, as get_rainbow_band has red in the middle of band 0
+    angles = np.radians(np.arange(bands.shape[1]) * band_deg - 30 + band_deg / 2)
+    return np.column_stack((bands @ np.cos(angles), bands @ np.sin(angles),
+        np.asarray(pb, dtype=np.float64) * brightness_weight))
+
+def reddest(points:np.ndarray)->int:
+    '''The cover furthest out towards red (hue 0), where the rainbow starts'''
+    return int(np.argmax(points[:, 0]))
+
+def path_length(points:np.ndarray, path:np.ndarray)->float:
+    '''The sum of the jumps from each cover to the next'''
+    return float(np.linalg.norm(np.diff(points[path], axis=0), axis=1).sum())
+
+def greedy_path(points:np.ndarray, start:int, k:int=NEIGHBORS)->np.ndarray:
+    '''Walk from cover to cover, always on to the nearest one not visited yet. The nearest ones come from a
+    KD-tree, so there's no distance matrix; when too many of them have been visited the tree gets rebuilt
+    with just the covers left, which keeps the whole walk at about O(n log n)
+    :param points: an (N, D) array, see cover_points
+    :param start: the cover to start from
+    :param k: number of neighbors to ask the tree for at first
+    :return: the order of the covers'''
+    n = len(points)
+    visited = np.zeros(n, dtype=bool)
+    # the tree holds the covers in left, visited or not
+    left = np.arange(n)
+    tree = cKDTree(points)
+    path = np.empty(n, dtype=np.intp)
+    current = start
+    for step in range(n):
+        path[step] = current
+        visited[current] = True
+        if step == n - 1:
+            break
+        query = k
+        while True:
+            query = min(query, len(left))
+            (_, nearest) = tree.query(points[current], k=query)
+            candidates = left[np.atleast_1d(nearest)]
+            unvisited = candidates[~visited[candidates]]
+            if len(unvisited):
+                current = unvisited[0]
+                break
+            if query >= MAX_QUERY or query == len(left):
+                left = np.flatnonzero(~visited)
+                tree = cKDTree(points[left])
+                query = k
+            else:
+                query *= 4
+        #end while
+    #end for
+    return path
+#end def
+
+def two_opt(points:np.ndarray, path:np.ndarray, k:int=NEIGHBORS, max_moves:Optional[int]=None)->np.ndarray:
+    '''Straighten out a path with 2-opt moves: reverse a stretch of it when that makes the two jumps at its ends
+    shorter. Only moves that bring a cover next to one of its k nearest neighbors are tried, and a cover only
+    gets looked at again once a move changes its neighbors on the path, so it's about linear per pass rather
+    than quadratic. The path is open and the first cover stays first
+    :param points: an (N, D) array, see cover_points
+    :param path: the order to improve, e.g. from greedy_path
+    :param k: number of nearest neighbors to try moves with
+    :param max_moves: stop after this many moves, None to go on until no move helps
+    :return: the improved order'''
+    n = len(path)
+    if n < 4:
+        return np.array(path)
+    path = np.array(path)
+    coords = [tuple(p) for p in points.tolist()]
+    (_, neighbors) = cKDTree(points).query(points, k=min(k + 1, n))
+    neighbors = neighbors[:, 1:].tolist()
+    position = np.empty(n, dtype=np.intp)
+    position[path] = np.arange(n)
+    dist = math.dist
+
+    def gain_after(i:int, j:int)->float:
+        # reversing path[i + 1:j + 1] swaps the jumps (path[i], path[i + 1]) and (path[j], path[j + 1]) for
+        # (path[i], path[j]) and (path[i + 1], path[j + 1]); past the end there's no jump
+        (a, b, c) = (coords[path[i]], coords[path[i + 1]], coords[path[j]])
+        if j == n - 1:
+            return dist(a, b) - dist(a, c)
+        d = coords[path[j + 1]]
+        return dist(a, b) + dist(c, d) - dist(a, c) - dist(b, d)
+    #end def
+
+    def gain_before(i:int, j:int)->float:
+        # reversing path[i:j] swaps the jumps (path[i - 1], path[i]) and (path[j - 1], path[j]) for
+        # (path[i - 1], path[j - 1]) and (path[i], path[j])
+        (a, b, c, d) = (coords[path[i - 1]], coords[path[i]], coords[path[j - 1]], coords[path[j]])
+        return dist(a, b) + dist(c, d) - dist(a, c) - dist(b, d)
+    #end def
+
+    queue = list(path[::-1])
+    queued = np.ones(n, dtype=bool)
+    moves = 0
+    while queue and (max_moves is None or moves < max_moves):
+        city = queue.pop()
+        queued[city] = False
+        for neighbor in neighbors[city]:
+            (p, q) = (position[city], position[neighbor])
+            # make the two next to each other on the path, by reversing the stretch after the first of them
+            # or the stretch up to the second
+            (i, j) = (p, q) if p < q else (q, p)
+            if j - i < 2:
+                continue
+            if gain_after(i, j) > 1e-12:
+                (start, stop) = (i + 1, j + 1)
+            elif i > 0 and gain_before(i, j) > 1e-12:
+                (start, stop) = (i, j)
+            else:
+                continue
+            path[start:stop] = path[start:stop][::-1].copy()
+            position[path[start:stop]] = np.arange(start, stop)
+            moves += 1
+            for touched in path[[start - 1, start, stop - 1, min(stop, n - 1)]]:
+                if not queued[touched]:
+                    queued[touched] = True
+                    queue.append(touched)
+            #end for
+            break
+        #end for
+    #end while
+    return path
+#end def
+
+def gradient_order(bands:np.ndarray, pb:np.ndarray, band_deg:int=60, brightness_weight:float=1.0,
+        improve:bool=True)->np.ndarray:
+    '''Order the covers as a smooth gradient rather than in bands: a nearest neighbor path through the covers'
+    colors (see cover_points), starting at the reddest one and straightened out with 2-opt.
+    Unlike sorting by band and then brightness there are no jumps at the band edges; 10,000 covers take well
+    under a second. Needs scipy
+    :param bands: an (N, 360 // band_deg) array of band weights
+    :param pb: the perceived brightness of each cover
+    :param band_deg: size of the rainbow band partition in degrees
+    :param brightness_weight: how much brightness counts against hue, 1 for the same
+    :param improve: straighten the path with 2-opt, False for just the greedy path
+    :return: the row positions in gradient order'''
+    points = cover_points(bands, pb, band_deg, brightness_weight)
+    if len(points) == 0:
+        return np.empty(0, dtype=np.intp)
+    path = greedy_path(points, reddest(points))
+    return two_opt(points, path) if improve else path
+#end def
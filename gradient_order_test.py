@@ -0,0 +1,43 @@
+# %% The gradient order against the band sort, on made up covers and on the test covers
+import os
+import time
+import numpy as np
+from PIL import Image
+from rainbow_util import get_image_color_features
+from benchmark import random_covers
+from gradient_order import cover_points, gradient_order, greedy_path, path_length, reddest, two_opt
+
+# %% Every cover once, starting from the reddest, and far shorter jumps than sorting by band and brightness
+for n in [1, 2, 3, 10, 1000, 10_000]:
+    (bands, pb) = random_covers(n)
+    points = cover_points(bands, pb)
+    start = time.perf_counter()
+    order = gradient_order(bands, pb)
+    elapsed = time.perf_counter() - start
+    assert sorted(order.tolist()) == list(range(n)) and order[0] == reddest(points)
+    band_sort = np.lexsort((pb, np.argmax(bands, axis=1)))
+    if n >= 1000:
+        greedy = greedy_path(points, reddest(points))
+        print(f'{n} covers in {elapsed:.2f}s: jumps add up to {path_length(points, order):.0f}, '
+            + f'{path_length(points, greedy):.0f} before 2-opt, {path_length(points, band_sort):.0f} sorted by band')
+        assert path_length(points, order) < path_length(points, greedy) < path_length(points, band_sort) / 2
+        assert elapsed < 10
+#end for
+assert len(gradient_order(np.zeros((0, 6)), np.zeros(0))) == 0
+
+# %% 2-opt on a path that doubles back: a line of points visited out of order gets put straight
+points = np.column_stack((np.arange(20.0), np.zeros(20), np.zeros(20)))
+path = np.array([0, 1, 2, 8, 7, 6, 5, 4, 3, 9] + list(range(10, 20)))
+assert two_opt(points, path).tolist() == list(range(20))
+# the path is open: the far end can flip over too, and the start never moves
+path = np.array(list(range(10)) + list(range(19, 9, -1)))
+assert two_opt(points, path).tolist() == list(range(20))
+
+# %% The test covers as a gradient, hues on the color wheel and grays in the middle
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+features = [get_image_color_features(Image.open(image_path + f), 60) for f in image_list]
+order = gradient_order(np.array([f.bands for f in features]), np.array([f.pb for f in features]))
+print([features[i].primary_band for i in order])
+
+# %%
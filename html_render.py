@@ -0,0 +1,101 @@
+import os
+from string import Formatter
+from typing import Iterator, Optional
+import pandas as pd
+
+# rows formatted and written per step, enough to make the column operations pay off
+CHUNK_SIZE = 2048
+
+PAGE_TEMPLATE = '''<html><head><title>{title}</title>
+{head}
+</head>
+<body>{header}
+'''
+NAV_TEMPLATE = '<p class="pages">{previous} page {page} of {pages} {next}</p>\n'
+
+
+def format_rows(df:pd.DataFrame, template:str)->pd.Series:
+    '''Same as df.apply(template.format_map, axis=1), but formatting whole columns at a time instead of row by row.
+    Fields without a format spec are turned into strings per column, the ones with a spec or conversion
+    value by value. Unlike the row-wise apply, integer columns don't turn into floats when all the
+    other columns are numbers
+    :param df: the rows to format
+    :param template: a str.format template with the column names as fields
+    :return: a series of strings, one per row'''
+    result = pd.Series('', index=df.index, dtype=object)
+    for (literal, field, spec, conversion) in Formatter().parse(template):
+        if literal:
+            result = result + literal
+        if field is None:
+            continue
+        column = df[field]
+        if conversion == 'r':
+            column = column.map(repr)
+        elif conversion == 'a':
+            column = column.map(ascii)
+        if spec:
+            column = column.map(lambda value: format(value, spec))
+        else:
+            column = column.astype(str)
+        result = result + column.astype(object)
+    #end for
+    # the same string dtype the row-wise apply would give
+    return result.astype(str)
+
+def iter_fragments(df:pd.DataFrame, template:str, chunk_size:int=CHUNK_SIZE)->Iterator[str]:
+    '''Format the rows a chunk at a time, so only a chunk's worth of html is in memory at once
+    :param df: the rows to format
+    :param template: a str.format template with the column names as fields
+    :param chunk_size: rows per chunk
+    :return: an iterator of newline separated html fragments, each ending in a newline'''
+    for start in range(0, len(df), chunk_size):
+        yield format_rows(df.iloc[start:start + chunk_size], template).str.cat(sep='\n') + '\n'
+
+def lazy_loading(template:str)->str:
+    '''Have the browser only load the images of a template once they're scrolled near'''
+    return template.replace('<img ', '<img loading="lazy" ')
+
+def page_paths(path:str, pages:int)->list:
+    '''The file names of the pages: the first page is path itself, the next ones get their number added,
+    e.g. rainbow.html, rainbow_2.html, rainbow_3.html...'''
+    (stem, ext) = os.path.splitext(path)
+    return [path] + [f'{stem}_{page}{ext}' for page in range(2, pages + 1)]
+
+def write_html(path:str, df:pd.DataFrame, template:str, title:str='', head:str='', header:str='',
+        footer:str='', lazy:bool=False, page_size:Optional[int]=None, chunk_size:int=CHUNK_SIZE)->list:
+    '''Render a row per df row into an html file, writing each chunk of rows to the file as it's formatted
+    rather than building the whole page in memory first
+    :param path: the html file to write
+    :param df: the rows, in the order to show them
+    :param template: a str.format template for a row with the column names as fields, e.g. '<img src="{img_url}" />'
+    :param title: the page title
+    :param head: extra html for the head, e.g. a <style> block
+    :param header: html to start the body with, before the rows
+    :param footer: html to end the body with, after the rows
+    :param lazy: add loading="lazy" to the <img> tags, so only the covers in view get loaded
+    :param page_size: split the rows over pages of this many rows, linked together; None for a single page
+    :param chunk_size: rows formatted and written per step
+    :return: the paths of the files written'''
+    if lazy:
+        template = lazy_loading(template)
+    page_size = page_size or max(len(df), 1)
+    pages = max(-(-len(df) // page_size), 1)
+    paths = page_paths(path, pages)
+    for page in range(pages):
+        if pages > 1:
+            previous = f'<a href="{os.path.basename(paths[page - 1])}">&laquo; previous</a>' if page > 0 else ''
+            next = f'<a href="{os.path.basename(paths[page + 1])}">next &raquo;</a>' if page < pages - 1 else ''
+            nav = NAV_TEMPLATE.format(previous=previous, page=page + 1, pages=pages, next=next)
+        else:
+            nav = ''
+        with open(paths[page], 'w') as f:
+            f.write(PAGE_TEMPLATE.format(title=title, head=head, header=header))
+            # (slicing a dataframe copies it, so a single page uses the dataframe as is)
+            rows = df.iloc[page * page_size:(page + 1) * page_size] if pages > 1 else df
+            for fragment in iter_fragments(rows, template, chunk_size):
+                f.write(fragment)
+            f.write(f'{footer}\n{nav}</body></html>\n')
+        #end with
+    #end for
+    return paths
+#end def
@@ -0,0 +1,60 @@
+# %% Check the column-wise row formatting and the streamed, paginated html output
+import os
+import re
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from html_render import format_rows, write_html
+
+n = 50_000
+df = pd.DataFrame({'track_id': [f'track{i}' for i in range(n)], 'band': np.arange(n) % 6,
+    'pb': np.random.default_rng(0).random(n), 'img_url': [f'https://i.scdn.co/image/{i % 7000}' for i in range(n)],
+    'color': [(i % 256, 0, 255 - i % 256) for i in range(n)]})
+template = '<img title="band: {band}, pb: {pb}, color: {color}" src="{img_url}" />'
+
+# exactly what the row-wise apply makes of it, as long as there's a non-number column
+expected = df.apply(template.format_map, axis=1, result_type='reduce')
+assert format_rows(df, template).equals(expected)
+# format specs and conversions are supported too
+assert format_rows(df.head(2), '{pb:.2f}|{track_id!r}').tolist() \
+    == [f'{pb:.2f}|{track_id!r}' for (pb, track_id) in zip(df['pb'][:2], df['track_id'][:2])]
+
+# %% A single page holds all the rows, the pages of a paginated one hold all the rows between them
+with tempfile.TemporaryDirectory() as out_dir:
+    path = os.path.join(out_dir, 'rainbow.html')
+    assert write_html(path, df, template, title='Rainbow', lazy=True) == [path]
+    with open(path) as f:
+        html = f.read()
+    assert html.count('<img loading="lazy" ') == n
+    assert '\n'.join(expected.str.replace('<img ', '<img loading="lazy" ')) in html
+
+    paths = write_html(path, df, template, page_size=20_000)
+    assert [os.path.basename(p) for p in paths] == ['rainbow.html', 'rainbow_2.html', 'rainbow_3.html']
+    pages = []
+    for p in paths:
+        with open(p) as f:
+            pages.append(f.read())
+    assert [page.count('<img ') for page in pages] == [20_000, 20_000, 10_000]
+    # each page links to its neighbours
+    assert re.findall(r'href="([^"]+)"', pages[1]) == ['rainbow.html', 'rainbow_3.html']
+
+    # an empty dataframe still makes a (single, empty) page
+    assert write_html(path, df.head(0), template) == [path]
+
+    # The output is written as it's formatted: the memory used doesn't grow with the size of the page
+    peaks = []
+    for rows in [df.head(n // 5), df]:
+        tracemalloc.start()
+        write_html(path, rows, template)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    #end for
+    page_size = os.path.getsize(path)
+    print(f'peak memory writing {n // 5} rows: {peaks[0] / 2**20:.1f}MB, {n} rows: {peaks[1] / 2**20:.1f}MB, ' \
+        + f'page size {page_size / 2**20:.1f}MB')
+    assert peaks[1] < 1.5 * peaks[0]
+    assert peaks[1] < page_size / 2
+#end with
+
+# %%
@@ -0,0 +1,239 @@
+import cProfile
+import pstats
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Iterator, Optional
+import numpy as np
+
+
+def _statistics(histograms:dict)->dict:
+    result = {}
+    for (name, values) in sorted(histograms.items()):
+        p50, p95 = np.percentile(values, [50, 95])
+        result[name] = {'count': len(values), 'total': float(values.sum()), 'p50': float(p50), 'p95': float(p95),
+            'max': float(values.max())}
+    #end for
+    return result
+
+
+class _Timer:
+    '''Times a stage into a Metrics, keeping track of the stages it's nested in, per thread'''
+    __slots__ = ('metrics', 'name', 'start', 'children')
+
+    def __init__(self, metrics:'Metrics', name:str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self)->'_Timer':
+        stack = self.metrics._stack()
+        stack.append(self)
+        self.children = 0.0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info)->None:
+        elapsed = time.perf_counter() - self.start
+        stack = self.metrics._stack()
+        path = ';'.join(timer.name for timer in stack)
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        self.metrics._record(self.name, elapsed, path, elapsed - self.children)
+
+
+class Metrics:
+    '''Timings, counters and histograms for one run of the pipeline, safe to share between threads.
+    - timer(name) is a context manager that times a stage; the durations go into the stage's histogram and the
+      time spent in nested stages is kept apart, for a flamegraph of the stages
+    - count(name, n) adds to a counter, e.g. bytes downloaded or cache hits
+    - observe(name, value) adds a value to a histogram, e.g. the size of a cover
+    Stages that run on several threads at once add up to more than the wall time of the run.
+    Work done in worker processes isn't seen, so analyze in the download threads (analysis_workers=0)
+    to get the analysis timings too'''
+    def __init__(self):
+        # the durations of each stage, in seconds
+        self.timings = defaultdict(list)
+        self.histograms = defaultdict(list)
+        self.counters = Counter()
+        # seconds spent in each stack of stages, not counting the nested stages
+        self.stacks = Counter()
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self)->list:
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _record(self, name:str, elapsed:float, path:str, self_time:float)->None:
+        with self._lock:
+            self.timings[name].append(elapsed)
+            self.stacks[path] += self_time
+
+    def timer(self, name:str)->_Timer:
+        '''Time a stage: with metrics.timer('decode'): ...
+        :param name: the stage name
+        :return: the context manager'''
+        return _Timer(self, name)
+
+    def record(self, name:str, seconds:float)->None:
+        '''Add the duration of a stage timed some other way, e.g. one that spans awaits in a coroutine,
+        where the timer's per thread stack of stages doesn't apply'''
+        self._record(name, seconds, name, seconds)
+
+    def count(self, name:str, n:int=1)->None:
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, name:str, value:float)->None:
+        with self._lock:
+            self.histograms[name].append(value)
+
+    def stop(self)->None:
+        '''Mark the end of the run, for the total elapsed time'''
+        self.elapsed = time.perf_counter() - self.start
+
+    def summary(self)->dict:
+        '''The per stage statistics of the run
+        :return: dict with the elapsed seconds, the counters, and the stages and histograms, dicts of
+            dicts with the count, total, p50, p95 and max of each'''
+        with self._lock:
+            timings = {name: np.array(values) for (name, values) in self.timings.items()}
+            histograms = {name: np.array(values) for (name, values) in self.histograms.items()}
+            counters = dict(self.counters)
+        return {'elapsed': self.elapsed, 'counters': counters, 'stages': _statistics(timings),
+            'histograms': _statistics(histograms)}
+
+    def report(self)->str:
+        '''The summary as a table, timings in milliseconds'''
+        summary = self.summary()
+        lines = [f'{"stage":<24}{"count":>8}{"total":>12}{"p50":>10}{"p95":>10}{"max":>10}']
+        for (name, stage) in summary['stages'].items():
+            lines.append(f'{name:<24}{stage["count"]:>8}{stage["total"] * 1000:>12.1f}{stage["p50"] * 1000:>10.2f}'
+                + f'{stage["p95"] * 1000:>10.2f}{stage["max"] * 1000:>10.2f}')
+        #end for
+        for (name, values) in summary['histograms'].items():
+            lines.append(f'{name:<24}{values["count"]:>8}{values["total"]:>12g}{values["p50"]:>10g}'
+                + f'{values["p95"]:>10g}{values["max"]:>10g}')
+        #end for
+        for (name, value) in sorted(summary['counters'].items()):
+            lines.append(f'{name:<24}{value:>8}')
+        lines.append(f'{"elapsed":<24}{summary["elapsed"]:>8.2f}s')
+        return '\n'.join(lines)
+
+    def write_folded(self, path:str)->None:
+        '''Write the time spent per stack of stages in the folded format flamegraph.pl, speedscope and
+        inferno read, one "stage;nested stage microseconds" line per stack'''
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        with open(path, 'w') as f:
+            for (stack, seconds) in stacks:
+                f.write(f'{stack} {round(seconds * 1e6)}\n')
+        #end with
+
+    def __repr__(self)->str:
+        return self.report()
+
+
+class NullMetrics(Metrics):
+    '''Metrics that record nothing, what the instrumented code talks to when no run is being recorded.
+    A timer is a shared do-nothing context manager, so the instrumentation costs next to nothing; every other
+    way in does nothing either, or the samples would pile up for as long as the process runs'''
+    _NULL_TIMER = nullcontext()
+
+    def timer(self, name:str)->nullcontext:
+        return self._NULL_TIMER
+
+    def record(self, name:str, seconds:float)->None:
+        pass
+
+    def count(self, name:str, n:int=1)->None:
+        pass
+
+    def observe(self, name:str, value:float)->None:
+        pass
+
+    def _record(self, name:str, elapsed:float, path:str, self_time:float)->None:
+        pass
+
+
+NULL_METRICS = NullMetrics()
+# what the instrumented code records into, shared by all threads so the pipeline's worker threads see it too
+_active = NULL_METRICS
+
+
+def get_metrics()->Metrics:
+    return _active
+
+def timer(name:str):
+    '''Time a stage of the run being recorded, if any: with timer('decode'): ...'''
+    return _active.timer(name)
+
+def count(name:str, n:int=1)->None:
+    '''Add to a counter of the run being recorded, if any'''
+    _active.count(name, n)
+
+def observe(name:str, value:float)->None:
+    '''Add a value to a histogram of the run being recorded, if any'''
+    _active.observe(name, value)
+
+@contextmanager
+def recording(metrics:Optional[Metrics]=None)->Iterator[Metrics]:
+    '''Record the timings and counts of everything run inside the with block, on any thread:
+        with recording() as metrics:
+            ...
+        print(metrics.report())
+    :param metrics: the Metrics to record into, a new one by default
+    :return: a context manager giving the Metrics'''
+    global _active
+    metrics = metrics if metrics is not None else Metrics()
+    previous = _active
+    _active = metrics
+    try:
+        yield metrics
+    finally:
+        _active = previous
+        metrics.stop()
+#end def
+
+@contextmanager
+def profiling(path:str)->Iterator[pstats.Stats]:
+    '''Profile everything run inside the with block with cProfile, including the threads started inside it
+    (the download and page fetching pools), and save the combined profile to path when done. Open it with
+    pstats, snakeviz, or turn it into a flamegraph with flameprof. Threads that are still running when the
+    block ends (pools that outlive it) don't make it into the profile.
+    :param path: the file to dump the profile stats to
+    :return: a context manager giving the pstats.Stats, filled in once the block is done'''
+    profiles = []
+    lock = threading.Lock()
+
+    def start_thread_profile(frame, event, arg):
+        # called on the first event of every new thread, from then on the thread's own profiler takes over
+        profile = cProfile.Profile()
+        with lock:
+            profiles.append(profile)
+        profile.enable()
+    #end def
+
+    main_profile = cProfile.Profile()
+    stats = pstats.Stats()
+    threading.setprofile(start_thread_profile)
+    main_profile.enable()
+    try:
+        yield stats
+    finally:
+        main_profile.disable()
+        threading.setprofile(None)
+        stats.add(main_profile)
+        with lock:
+            for profile in profiles:
+                stats.add(profile)
+        #end with
+        stats.dump_stats(path)
+#end def
@@ -0,0 +1,120 @@
+# %% Timers, counters and histograms, and what they make of a run of the cover pipeline
+import os
+import pstats
+import tempfile
+import threading
+import time
+import timeit
+from urllib.parse import quote
+import instrumentation
+from instrumentation import Metrics, count, observe, profiling, recording, timer
+from cover_pipeline import analyze_unique_covers
+from cover_cache import CoverCache
+from test_server import serve_directory
+
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+
+# %% Nested stages: the histograms get the full durations, the folded stacks the time outside the nested stages
+with recording() as metrics:
+    for i in range(3):
+        with timer('outer'):
+            time.sleep(0.01)
+            with timer('inner'):
+                time.sleep(0.02)
+        #end with
+    #end for
+    count('things', 2)
+    count('things')
+    observe('size', 10)
+    observe('size', 30)
+#end with
+summary = metrics.summary()
+assert summary['counters'] == {'things': 3}
+assert summary['stages']['outer']['count'] == 3 and summary['stages']['inner']['count'] == 3
+assert summary['stages']['outer']['p50'] >= 0.03 and summary['stages']['inner']['p50'] >= 0.02
+assert summary['histograms']['size'] == {'count': 2, 'total': 40.0, 'p50': 20.0, 'p95': 29.0, 'max': 30.0}
+assert summary['elapsed'] >= 0.09
+# nothing gets recorded once the block is done
+count('things')
+assert metrics.counters['things'] == 3 and instrumentation.get_metrics() is instrumentation.NULL_METRICS
+# and the sink it all goes to meanwhile keeps nothing, whichever way it's called
+null = instrumentation.get_metrics()
+null.record('awaited', 0.5)
+null.observe('size', 10)
+with null.timer('outer'):
+    count('things')
+assert not null.timings and not null.histograms and not null.counters and not null.stacks
+
+with tempfile.TemporaryDirectory() as out_dir:
+    path = os.path.join(out_dir, 'stages.folded')
+    metrics.write_folded(path)
+    with open(path) as f:
+        folded = dict(line.rsplit(' ', 1) for line in f.read().splitlines())
+#end with
+assert sorted(folded) == ['outer', 'outer;inner']
+assert 20_000 <= int(folded['outer;inner']) / 3 < 30_000
+assert 10_000 <= int(folded['outer']) / 3 < 20_000
+print(metrics.report())
+
+# %% The stacks are kept per thread, so stages timed in parallel don't get nested in each other
+metrics = Metrics()
+def work():
+    with metrics.timer('thread'):
+        time.sleep(0.01)
+with metrics.timer('main'):
+    threads = [threading.Thread(target=work) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+#end with
+assert set(metrics.stacks) == {'main', 'thread'} and len(metrics.timings['thread']) == 4
+
+# %% Nothing being recorded costs next to nothing
+def instrumented():
+    with timer('stage'):
+        pass
+    count('counter')
+#end def
+n = 100_000
+print(f'not recording: {timeit.timeit(instrumented, number=n) / n * 1e9:.0f}ns per stage')
+assert timeit.timeit(instrumented, number=n) / n < 5e-6
+
+# %% A run of the pipeline against a local server: the stages, bytes downloaded and cache hits
+(server, base_url) = serve_directory(image_path)
+urls = [base_url + quote(f) for f in image_list]
+cache = CoverCache(':memory:')
+
+with recording() as metrics:
+    # the second half of the covers again under other urls, so they come from the cache by their contents
+    list(analyze_unique_covers(urls + [url + '?again' for url in urls[len(urls) // 2:]], 60,
+        analysis_workers=0, cache=cache))
+    # and everything again, from the cache by url this time
+    list(analyze_unique_covers(urls, 60, analysis_workers=0, cache=cache))
+#end with
+print(metrics.report())
+summary = metrics.summary()
+half = len(urls) - len(urls) // 2
+assert summary['counters']['bytes_downloaded'] == sum(os.path.getsize(image_path + f) for f in image_list) \
+    + sum(os.path.getsize(image_path + f) for f in image_list[len(urls) // 2:])
+assert summary['counters']['cache_misses'] == len(urls)
+assert summary['counters']['cache_content_hits'] == half
+assert summary['counters']['cache_url_hits'] == len(urls)
+assert summary['stages']['cover_download']['count'] == len(urls) + half
+assert summary['stages']['decode']['count'] == summary['stages']['analyze']['count'] == len(urls)
+assert summary['stages']['cover']['count'] == 2 * len(urls) + half
+assert {'cover', 'cover;cover_download', 'cover;decode', 'cover;analyze'} <= set(metrics.stacks)
+
+# %% A cProfile of the run, with the work the download threads did in it
+with tempfile.TemporaryDirectory() as out_dir:
+    path = os.path.join(out_dir, 'run.prof')
+    with profiling(path):
+        list(analyze_unique_covers(urls, 60, analysis_workers=0))
+    functions = {function for (file, line, function) in pstats.Stats(path).stats}
+#end with
+assert {'analyze_unique_covers', 'download_cover', 'decode_cover', 'get_pixels_color_features'} <= functions
+
+server.shutdown()
+
+# %%
@@ -0,0 +1,177 @@
+from typing import Sequence, Tuple
+import numpy as np
+from color_utility import vividity
+
+# the MMCQ settings of ColorThief (and Leptonica): 5 bits per channel, a 32x32x32 color cube
+SIGBITS = 5
+RSHIFT = 8 - SIGBITS
+BINS = 1 << (3 * SIGBITS)
+MAX_ITERATION = 1000
+FRACT_BY_POPULATIONS = 0.75
+
+
+class _Box:
+    '''A box of the color cube, with the number of pixels in it'''
+    __slots__ = ('bounds', 'count', 'volume')
+
+    def __init__(self, histogram:np.ndarray, bounds:list):
+        # [r1, r2, g1, g2, b1, b2], inclusive
+        self.bounds = bounds
+        (r1, r2, g1, g2, b1, b2) = bounds
+        self.count = int(histogram[r1:r2 + 1, g1:g2 + 1, b1:b2 + 1].sum())
+        self.volume = max(r2 - r1 + 1, 0) * max(g2 - g1 + 1, 0) * max(b2 - b1 + 1, 0)
+
+    def color(self, histogram:np.ndarray)->Tuple[int, int, int]:
+        '''The average color of the pixels in the box, or its center if it's empty'''
+        (r1, r2, g1, g2, b1, b2) = self.bounds
+        mult = 1 << RSHIFT
+        if not self.count:
+            return (int(mult * (r1 + r2 + 1) / 2), int(mult * (g1 + g2 + 1) / 2), int(mult * (b1 + b2 + 1) / 2))
+        cells = histogram[r1:r2 + 1, g1:g2 + 1, b1:b2 + 1]
+        color = []
+        for (axis, (lo, hi)) in enumerate([(r1, r2), (g1, g2), (b1, b2)]):
+            # sum(count * (i + 0.5) * mult), in integers so it's exactly the sum ColorThief adds up in floats
+            centers = np.arange(lo, hi + 1, dtype=np.int64) * mult + mult // 2
+            total = int(cells.sum(axis=tuple(a for a in range(3) if a != axis)) @ centers)
+            color.append(int(total / self.count))
+        #end for
+        return tuple(color)
+
+
+def color_histograms(pixel_arrays:Sequence[np.ndarray], quality:int=10)->np.ndarray:
+    '''Count the pixels of each image in the cells of the 32x32x32 color cube, all the images in one go.
+    Like ColorThief only every quality-th pixel is counted and the near white ones (all channels above 250)
+    are left out. The pixels are taken to be opaque: images with an alpha channel come out as ColorThief makes of
+    them with their transparent pixels included
+    :param pixel_arrays: an (N, 3) uint8 array of RGB pixels per image, e.g. from rainbow_util.image_to_pixels
+    :param quality: count every quality-th pixel, 1 for all of them
+    :return: an (images, 32, 32, 32) array of pixel counts'''
+    indexes = []
+    for (i, pixels) in enumerate(pixel_arrays):
+        sampled = pixels[::quality]
+        sampled = sampled[~(sampled > 250).all(axis=1)]
+        q = sampled.astype(np.intp) >> RSHIFT
+        indexes.append((q[:, 0] << (2 * SIGBITS)) + (q[:, 1] << SIGBITS) + q[:, 2] + i * BINS)
+    #end for
+    counts = np.bincount(np.concatenate(indexes) if indexes else np.empty(0, dtype=np.intp),
+        minlength=len(pixel_arrays) * BINS)
+    return counts.reshape(len(pixel_arrays), 1 << SIGBITS, 1 << SIGBITS, 1 << SIGBITS)
+
+def _cut(histogram:np.ndarray, box:_Box)->tuple:
+    # ColorThief's median_cut_apply: split the box across its widest side, a bit past the median
+    if box.count == 1:
+        return _Box(histogram, list(box.bounds)), None
+    bounds = box.bounds
+    widths = [bounds[1] - bounds[0] + 1, bounds[3] - bounds[2] + 1, bounds[5] - bounds[4] + 1]
+    axis = widths.index(max(widths))
+    (lo, hi) = (bounds[2 * axis], bounds[2 * axis + 1])
+    cells = histogram[bounds[0]:bounds[1] + 1, bounds[2]:bounds[3] + 1, bounds[4]:bounds[5] + 1]
+    partial = np.cumsum(cells.sum(axis=tuple(a for a in range(3) if a != axis))).tolist()
+    total = partial[-1]
+
+    def partial_sum(i:int)->int:
+        return partial[i - lo] if lo <= i <= hi else 0
+    #end def
+
+    i = lo + next(k for (k, s) in enumerate(partial) if s > total / 2)
+    (left, right) = (i - lo, hi - i)
+    if left <= right:
+        d2 = min(hi - 1, int(i + right / 2))
+    else:
+        d2 = max(lo, int(i - 1 - left / 2))
+    # avoid empty boxes
+    while not partial_sum(d2):
+        d2 += 1
+    count2 = total - partial_sum(d2)
+    while not count2 and partial_sum(d2 - 1):
+        d2 -= 1
+        count2 = total - partial_sum(d2)
+    #end while
+    bounds1 = list(bounds)
+    bounds1[2 * axis + 1] = d2
+    bounds2 = list(bounds)
+    bounds2[2 * axis] = d2 + 1
+    return _Box(histogram, bounds1), _Box(histogram, bounds2)
+
+def _split(histogram:np.ndarray, queue:list, key, target:float)->None:
+    # keep splitting the box that's biggest by key until there are target boxes;
+    # a stable sort and taking the last box, exactly like ColorThief's PQueue
+    colors = 1
+    for iteration in range(MAX_ITERATION):
+        queue.sort(key=key)
+        box = queue.pop()
+        if not box.count:
+            queue.append(box)
+            continue
+        (box1, box2) = _cut(histogram, box)
+        queue.append(box1)
+        if box2 is not None:
+            queue.append(box2)
+            colors += 1
+        if colors >= target:
+            return
+    #end for
+
+def _by_count(box:_Box)->int:
+    return box.count
+
+def _by_count_and_volume(box:_Box)->int:
+    return box.count * box.volume
+
+def histogram_palette(histogram:np.ndarray, color_count:int=10)->list:
+    '''The MMCQ (modified median cut) palette of a color histogram, the same colors in the same order as
+    ColorThief.get_palette gives
+    :param histogram: a (32, 32, 32) array of pixel counts, see color_histograms
+    :param color_count: the number of colors to aim for, 2 to 256; like ColorThief's the palette can
+        end up with a color more or fewer
+    :return: a list of (r, g, b) tuples, the most important color first; empty if there are no pixels'''
+    if color_count < 2 or color_count > 256:
+        raise ValueError(f'color_count must be between 2 and 256, not {color_count}')
+    bounds = []
+    for axis in range(3):
+        used = np.flatnonzero(histogram.any(axis=tuple(a for a in range(3) if a != axis)))
+        if len(used) == 0:
+            return []
+        bounds += [int(used[0]), int(used[-1])]
+    #end for
+    queue = [_Box(histogram, bounds)]
+    # first split by the number of pixels, then by the number of pixels times the size of the box
+    _split(histogram, queue, _by_count, FRACT_BY_POPULATIONS * color_count)
+    queue.sort(key=_by_count)
+    queue.reverse()
+    _split(histogram, queue, _by_count_and_volume, color_count - len(queue))
+    queue.sort(key=_by_count_and_volume)
+    return [box.color(histogram) for box in reversed(queue)]
+
+def get_palettes(pixel_arrays:Sequence[np.ndarray], color_count:int=10, quality:int=10)->list:
+    '''The palettes of a batch of images, each the same as ColorThief(image).get_palette(color_count, quality),
+    from pixels that are already decoded
+    :param pixel_arrays: an (N, 3) uint8 array of RGB pixels per image, e.g. from rainbow_util.image_to_pixels
+    :param color_count: the number of colors to aim for
+    :param quality: use every quality-th pixel, 1 for all of them
+    :return: a palette per image, see histogram_palette'''
+    return [histogram_palette(histogram, color_count) for histogram in color_histograms(pixel_arrays, quality)]
+
+def get_palette(pixels:np.ndarray, color_count:int=10, quality:int=10)->list:
+    '''Same as get_palettes, for a single image'''
+    return get_palettes([pixels], color_count, quality)[0]
+
+def prime_and_vivid_colors(palette:list, default:Tuple[int, int, int]=(255, 255, 255))->tuple:
+    '''Pick the prime color of a palette, its first, and the first "vivid" one: with a product of saturation and
+    relative luminance between 0.1 and 0.9, see color_utility.vividity
+    :param palette: a list of (r, g, b) tuples
+    :param default: the color for an empty palette, that of an image with nothing but (near) white pixels
+    :return: a tuple of the prime and vivid colors, the vivid one is the prime one if there is no vivid one'''
+    if not palette:
+        return default, default
+    for color in palette:
+        (_, _, p) = vividity(color)
+        if 0.1 < p < 0.9:
+            return palette[0], color
+    #end for
+    return palette[0], palette[0]
+
+def get_prime_and_vivid_colors(pixel_arrays:Sequence[np.ndarray], color_count:int=5, quality:int=5)->list:
+    '''The prime and vivid colors of a batch of images, see get_palettes and prime_and_vivid_colors
+    :return: a (prime, vivid) tuple per image'''
+    return [prime_and_vivid_colors(palette) for palette in get_palettes(pixel_arrays, color_count, quality)]
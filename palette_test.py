@@ -0,0 +1,58 @@
+# %% Check the numpy MMCQ palettes against ColorThief's, cover by cover
+import os
+import time
+import numpy as np
+from PIL import Image
+from colorthief import ColorThief
+from rainbow_util import get_pixels_color_features, image_to_pixels
+from palette import get_palette, get_palettes, get_prime_and_vivid_colors, prime_and_vivid_colors
+
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+pixels = [image_to_pixels(Image.open(image_path + f)) for f in image_list]
+
+# the same colors in the same order, with the settings of sorted_albums_test and colorthief_test and then some
+for (color_count, quality) in [(5, 5), (10, 25), (10, 1), (2, 10), (17, 3)]:
+    start = time.perf_counter()
+    expected = [ColorThief(image_path + f).get_palette(color_count=color_count, quality=quality) for f in image_list]
+    colorthief_time = time.perf_counter() - start
+    start = time.perf_counter()
+    palettes = get_palettes(pixels, color_count, quality)
+    palette_time = time.perf_counter() - start
+    for (image_file, palette, expected_palette) in zip(image_list, palettes, expected):
+        assert palette == expected_palette, (image_file, color_count, quality)
+    print(f'{len(image_list)} palettes of {color_count} colors, quality {quality}: ' \
+        + f'ColorThief {colorthief_time:.2f}s, get_palettes {palette_time:.3f}s')
+#end for
+
+# %% A batch gives the same palettes as the images one at a time, and the pixels can be shared with the bands
+assert get_palettes(pixels[:5], 5, 5) == [get_palette(p, 5, 5) for p in pixels[:5]]
+before = pixels[0].copy()
+features = get_pixels_color_features(pixels[0], 60)
+assert np.array_equal(pixels[0], before) and features.pixels == len(before)
+assert get_palette(pixels[0], 5, 5) == ColorThief(image_path + image_list[0]).get_palette(color_count=5, quality=5)
+
+# %% The corner cases: one color, one pixel, a few pixels, and nothing but white
+def colorthief_palette(image:Image.Image, color_count:int, quality:int)->list:
+    color_thief = ColorThief.__new__(ColorThief)
+    color_thief.image = image
+    return color_thief.get_palette(color_count, quality)
+
+rng = np.random.default_rng(0)
+images = [np.full((10, 10, 3), (200, 30, 40), dtype=np.uint8), np.full((1, 1, 3), (9, 90, 200), dtype=np.uint8),
+    np.vstack([np.zeros((5, 10, 3), dtype=np.uint8), np.full((5, 10, 3), (0, 255, 0), dtype=np.uint8)]),
+    rng.integers(0, 256, (2, 3, 3), dtype=np.uint8), rng.integers(0, 20, (30, 30, 3), dtype=np.uint8)]
+for array in images:
+    for (color_count, quality) in [(5, 1), (2, 3), (256, 1)]:
+        assert get_palette(array.reshape(-1, 3), color_count, quality) \
+            == colorthief_palette(Image.fromarray(array), color_count, quality), (array.shape, color_count)
+#end for
+# ColorThief gives up on an image with no colors left, here the palette is empty and white is the prime color
+white = np.full((16, 3), 255, dtype=np.uint8)
+assert get_palette(white) == [] and get_prime_and_vivid_colors([white]) == [((255, 255, 255), (255, 255, 255))]
+
+# %% The vivid color is the first one with a saturation and luminance product between 0.1 and 0.9
+assert prime_and_vivid_colors([(10, 10, 10), (200, 30, 40), (30, 200, 40)]) == ((10, 10, 10), (200, 30, 40))
+assert prime_and_vivid_colors([(10, 10, 10), (250, 250, 250)]) == ((10, 10, 10), (10, 10, 10))
+
+# %%
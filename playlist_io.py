@@ -0,0 +1,216 @@
+import copy
+import hashlib
+import json
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
+import requests
+import spotipy
+import instrumentation
+
+# the track fields the rainbow sort needs
+TRACK_FIELDS = 'items(track(id,track_number,album(images)))'
+# the most tracks Spotify returns per request
+PAGE_SIZE = 100
+
+
+def iter_playlist_pages(sp:spotipy.Spotify, playlist_id:str, total:Optional[int]=None, fields:str=TRACK_FIELDS,
+        workers:int=4, page_size:int=PAGE_SIZE)->Iterator[list]:
+    '''Fetch the tracks of a playlist a page at a time, yielding each page in playlist order as soon as it's in,
+    so the next steps can get going on the first page while the rest are still being fetched.
+    Once the number of tracks is known the pages are requested concurrently
+    :param sp: the Spotify client
+    :param playlist_id: the playlist's id, uri or url
+    :param total: number of tracks in the playlist, if already known; otherwise the first page is fetched by itself
+    :param fields: the track fields to get
+    :param workers: number of pages to fetch at the same time
+    :param page_size: number of tracks per page
+    :return: an iterator of lists of playlist items'''
+    def fetch_page(offset:int, fields:str)->dict:
+        with instrumentation.timer('spotify_page'):
+            return sp.playlist_tracks(playlist_id, fields=fields, limit=page_size, offset=offset)
+    #end def
+
+    start = 0
+    if total is None:
+        first_page = fetch_page(0, f'{fields},total')
+        total = first_page['total']
+        start = len(first_page['items'])
+        yield first_page['items']
+    #end if
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for offset in range(start, total, page_size):
+                pending.append(pool.submit(fetch_page, offset, fields))
+                # only fetch a few pages ahead of the consumer
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()['items']
+            #end for
+            while pending:
+                yield pending.popleft().result()['items']
+        finally:
+            for future in pending:
+                future.cancel()
+    #end with
+
+def iter_playlist_items(sp:spotipy.Spotify, playlist_id:str, total:Optional[int]=None, **page_args)->Iterator[dict]:
+    '''Same as iter_playlist_pages, one playlist item at a time
+    :return: an iterator of playlist items'''
+    for page in iter_playlist_pages(sp, playlist_id, total, **page_args):
+        yield from page
+
+def get_playlist_length(sp:spotipy.Spotify, playlist_id:str)->int:
+    '''Get the number of tracks in a playlist
+    :param sp: the Spotify client
+    :param playlist_id: the playlist's id, uri or url
+    :return: the number of tracks'''
+    return sp.playlist(playlist_id, fields='tracks.total')['tracks']['total']
+
+def without_retries(sp:spotipy.Spotify)->spotipy.Spotify:
+    '''Get a copy of a Spotify client, with the same credentials, that sends each request only once rather than
+    having spotipy retry failed ones by itself; for the requests that mustn't be repeated blindly
+    :param sp: the Spotify client, which keeps retrying its own requests
+    :return: the copy, with a plain requests.Session of its own'''
+    client = copy.copy(sp)
+    client._session = requests.Session()
+    return client
+
+
+class PlaylistWriter:
+    '''Add tracks to a playlist, a batch of 100 at a time, surviving rate limits, errors and interruptions.
+    - a 429 response waits as long as its Retry-After header says and slows down the following requests, 
+      the pace picks back up again as requests go through
+    - server and connection errors are retried with exponential backoff; since such a request may have gone 
+      through anyway, the playlist length is checked first so the batch doesn't get added twice
+    - after each batch the number of tracks written is saved in a checkpoint file, so writing the same tracks 
+      to the same playlist again picks up where an interrupted write left off
+    The batches go out one after the other: Spotify doesn't guarantee the order of concurrent adds.
+    The adds go through a copy of the client without spotipy's own retries, which would resend a failed add without
+    the duplicate check and report every error it gives up on as a 429; the client itself, retries and all, is
+    left alone for everything else'''
+    def __init__(self, sp:spotipy.Spotify, playlist_id:str, checkpoint_path:Optional[str]=None,
+            batch_size:int=PAGE_SIZE, max_retries:int=5, backoff:float=1.0, max_backoff:float=60.0,
+            sleep:Callable[[float], None]=time.sleep):
+        '''
+        :param sp: the Spotify client, used as is for reading the playlist length
+        :param playlist_id: the playlist to add the tracks to
+        :param checkpoint_path: optional file to keep track of the progress in
+        :param batch_size: tracks per request, at most 100
+        :param max_retries: how many times to retry a batch after an error, rate limits don't count
+        :param backoff: seconds to wait after the first error, doubling for every retry
+        :param max_backoff: the most seconds to wait between retries
+        :param sleep: the function to wait with
+        '''
+        self.sp = sp
+        self._add_client = without_retries(sp)
+        self.playlist_id = playlist_id
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        # the minimum number of seconds between requests, goes up when we get rate limited
+        self.interval = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self._last_request = 0.0
+
+    def _load_checkpoint(self, tracks_hash:str)->Optional[dict]:
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        # only resume writing the same tracks to the same playlist
+        if checkpoint['playlist_id'] != self.playlist_id or checkpoint['tracks_hash'] != tracks_hash:
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint:dict)->None:
+        if self.checkpoint_path is None:
+            return
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _pace(self)->None:
+        wait = self._last_request + self.interval - time.monotonic()
+        if wait > 0:
+            self.sleep(wait)
+        self._last_request = time.monotonic()
+
+    def _landed(self, checkpoint:dict, batch:list)->bool:
+        # did the batch make it into the playlist after all?
+        return get_playlist_length(self.sp, self.playlist_id) == checkpoint['base'] + checkpoint['committed'] + len(batch)
+
+    def _add_batch(self, checkpoint:dict, batch:list)->None:
+        errors = 0
+        while True:
+            self._pace()
+            self.requests += 1
+            try:
+                with instrumentation.timer('playlist_add'):
+                    self._add_client.playlist_add_items(self.playlist_id, batch)
+                # things are going well, ease off the brakes
+                self.interval *= 0.8
+                return
+            except spotipy.SpotifyException as e:
+                # without headers the 429 is spotipy giving up on its own retries, which may have been 5xx's
+                if e.http_status == 429 and e.headers:
+                    self.throttled += 1
+                    retry_after = float(e.headers.get('Retry-After', 0) or 0)
+                    self.interval = min(max(2 * self.interval, 0.1), self.max_backoff)
+                    self.sleep(max(retry_after, self.interval))
+                    continue
+                if e.http_status < 500 and e.http_status != 429:
+                    raise
+                error = e
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            # a server or connection error, the batch may or may not have been added
+            if self._landed(checkpoint, batch):
+                return
+            errors += 1
+            if errors > self.max_retries:
+                raise error
+            self.retries += 1
+            delay = min(self.backoff * 2 ** (errors - 1), self.max_backoff)
+            self.sleep(delay * random.uniform(0.5, 1.0))
+        #end while
+
+    def write(self, track_ids:list)->None:
+        '''Add the tracks to the end of the playlist, or the rest of them if an earlier write got interrupted
+        :param track_ids: the track ids, uris or urls in playlist order'''
+        tracks_hash = hashlib.sha1('\n'.join(track_ids).encode()).hexdigest()
+        checkpoint = self._load_checkpoint(tracks_hash)
+        if checkpoint is None:
+            # the tracks already in the playlist before we started
+            base = get_playlist_length(self.sp, self.playlist_id)
+            checkpoint = {'playlist_id': self.playlist_id, 'tracks_hash': tracks_hash, 'base': base, 'committed': 0}
+        else:
+            # the last batch before the interruption may have made it without the checkpoint being saved
+            written = get_playlist_length(self.sp, self.playlist_id) - checkpoint['base']
+            next_batch = track_ids[checkpoint['committed']:checkpoint['committed'] + self.batch_size]
+            if written == checkpoint['committed'] + len(next_batch):
+                checkpoint['committed'] = written
+            elif written != checkpoint['committed']:
+                raise RuntimeError(f'Cannot resume: the playlist has {written} of our tracks, ' \
+                    + f'the checkpoint says {checkpoint["committed"]}')
+        #end if
+        self._save_checkpoint(checkpoint)
+        while checkpoint['committed'] < len(track_ids):
+            batch = track_ids[checkpoint['committed']:checkpoint['committed'] + self.batch_size]
+            self._add_batch(checkpoint, batch)
+            checkpoint['committed'] += len(batch)
+            self._save_checkpoint(checkpoint)
+        #end while
+    #end def
+
+    def __repr__(self)->str:
+        return f'{self.requests} requests, {self.throttled} rate limited, {self.retries} retried'
@@ -0,0 +1,178 @@
+# %% Stream a playlist from a stubbed Spotify client, no Spotify account or internet needed
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+import requests
+import spotipy
+from cover_pipeline import analyze_unique_covers
+from playlist_io import PlaylistWriter, iter_playlist_items, iter_playlist_pages
+from test_server import serve_directory
+
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+
+
+class StubSpotify:
+    '''Just enough of spotipy.Spotify for the playlist paging, with a delay on every request like the real thing'''
+    def __init__(self, items:list, delay:float=0.05):
+        self.items = items
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def playlist_tracks(self, playlist_id, fields=None, limit=100, offset=0, market=None):
+        with self._lock:
+            self.requests.append(offset)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        page = {'items': self.items[offset:offset + limit]}
+        if fields and 'total' in fields:
+            page['total'] = len(self.items)
+        return page
+
+
+(server, base_url) = serve_directory(image_path)
+
+# 1,050 tracks, spread over the test covers
+items = [{'track': {'id': f'track{i}', 'track_number': i % 12 + 1,
+    'album': {'images': [{'url': base_url + quote(image_list[i % len(image_list)])}]}}} for i in range(1050)]
+
+# %% The pages come back complete and in order, with or without knowing the total up front
+for total in [None, len(items)]:
+    sp = StubSpotify(items)
+    pages = list(iter_playlist_pages(sp, 'playlist', total=total, workers=4))
+    assert [len(p) for p in pages] == [100] * 10 + [50]
+    assert [item for page in pages for item in page] == items
+    # once the total is known the requests overlap
+    assert sp.max_in_flight > 1, sp.max_in_flight
+#end for
+
+# an empty playlist has a single (empty) page
+assert list(iter_playlist_pages(StubSpotify([]), 'playlist')) == [[]]
+
+# %% The first page is there long before the whole playlist is
+sp = StubSpotify(items, delay=0.2)
+start = time.perf_counter()
+pages = iter_playlist_pages(sp, 'playlist', total=len(items), workers=2)
+next(pages)
+first_page_s = time.perf_counter() - start
+list(pages)
+all_pages_s = time.perf_counter() - start
+print(f'first page after {first_page_s:.2f}s, all {len(sp.requests)} pages after {all_pages_s:.2f}s')
+assert first_page_s < all_pages_s / 3
+
+# %% Cover analysis gets going on the first page while the later ones are still being fetched
+sp = StubSpotify(items, delay=0.2)
+tracks = []
+def cover_urls():
+    for item in iter_playlist_items(sp, 'playlist', total=len(items), workers=2):
+        tracks.append(item['track'])
+        yield item['track']['album']['images'][-1]['url']
+covers = analyze_unique_covers(cover_urls(), band_deg=60, analysis_workers=0, max_pending=16)
+first_cover = next(covers)
+assert first_cover.url == items[0]['track']['album']['images'][-1]['url']
+assert len(sp.requests) < 11, sp.requests
+assert len(list(covers)) == len(items) - 1
+
+server.shutdown()
+
+# %% Write a playlist to a fake Spotify API that rate limits and fails now and then
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    '''The two endpoints the PlaylistWriter uses. server.failures is a list of what to do with the next adds:
+    429 to rate limit, 500 to fail, 'lost' to add the tracks but fail anyway, 400 to refuse'''
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status:int, body:dict, headers:dict={}):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.reply(200, {'tracks': {'total': len(self.server.playlist)}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        # spotipy sends the plain list of uris, the API docs wrap it in an object
+        uris = body['uris'] if isinstance(body, dict) else body
+        self.server.adds += 1
+        failure = self.server.failures.pop(0) if self.server.failures else None
+        if failure == 429:
+            self.reply(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}}, {'Retry-After': '1'})
+        elif failure in (400, 500):
+            self.reply(failure, {'error': {'status': failure, 'message': 'Nope'}})
+        else:
+            self.server.playlist.extend(uris)
+            if failure == 'lost':
+                self.reply(502, {'error': {'status': 502, 'message': 'Bad gateway'}})
+            else:
+                self.reply(201, {'snapshot_id': str(len(self.server.playlist))})
+    #end def
+
+fake_api = ThreadingHTTPServer(('127.0.0.1', 0), FakeSpotifyHandler)
+threading.Thread(target=fake_api.serve_forever, daemon=True).start()
+# a client that retries failed requests by itself, as spotipy's clients do by default
+fake_sp = spotipy.Spotify(auth='token')
+fake_sp.prefix = f'http://127.0.0.1:{fake_api.server_port}/v1/'
+track_uris = [f'spotify:track:{i:022d}' for i in range(1050)]
+waits = []
+
+# rate limits and failures along the way, the tracks still end up in the playlist once each, in order
+fake_api.playlist = ['spotify:track:already_there']
+fake_api.adds = 0
+fake_api.failures = [None, 429, 429, None, 500, None, 'lost', None, 429]
+writer = PlaylistWriter(fake_sp, 'playlist', sleep=waits.append)
+writer.write(track_uris)
+print(writer)
+assert fake_api.playlist == ['spotify:track:already_there'] + track_uris
+assert (writer.throttled, writer.retries) == (3, 1), writer
+# the adds went through a copy of the client that doesn't retry them, the client itself still does
+assert writer._add_client is not fake_sp and fake_sp._session.get_adapter(fake_sp.prefix).max_retries.total
+# the Retry-After header was respected
+assert waits.count(1.0) == 3, waits
+
+# an interrupted write picks up where it left off, also when the last batch made it in without being checkpointed
+with tempfile.TemporaryDirectory() as checkpoint_dir:
+    checkpoint_path = os.path.join(checkpoint_dir, 'checkpoint.json')
+    fake_api.playlist = []
+    fake_api.failures = [None, None, None, 400]
+    try:
+        PlaylistWriter(fake_sp, 'playlist', checkpoint_path, sleep=waits.append).write(track_uris)
+        assert False, 'the 400 should have stopped the write'
+    except spotipy.SpotifyException as e:
+        assert e.http_status == 400
+    assert len(fake_api.playlist) == 300
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    # the three batches that went in, on top of the empty playlist, for these tracks and this playlist only
+    assert (checkpoint['playlist_id'], checkpoint['base'], checkpoint['committed']) == ('playlist', 0, 300)
+    assert checkpoint['tracks_hash'] == hashlib.sha1('\n'.join(track_uris).encode()).hexdigest()
+    # pretend the process died right after the 4th batch went in, before it got to the checkpoint
+    fake_api.playlist.extend(track_uris[300:400])
+    fake_api.adds = 0
+    PlaylistWriter(fake_sp, 'playlist', checkpoint_path, sleep=waits.append).write(track_uris)
+    assert fake_api.playlist == track_uris
+    assert fake_api.adds == 7, fake_api.adds
+    # once done, writing again adds nothing
+    PlaylistWriter(fake_sp, 'playlist', checkpoint_path, sleep=waits.append).write(track_uris)
+    assert fake_api.playlist == track_uris
+#end with
+
+fake_api.shutdown()
+
+# %%
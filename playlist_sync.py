@@ -0,0 +1,195 @@
+import json
+import os
+from bisect import bisect_right
+from collections import Counter
+from typing import Optional
+import spotipy
+import instrumentation
+from cover_pipeline import DedupStats, analyze_unique_covers
+from playlist_io import PAGE_SIZE, PlaylistWriter, iter_playlist_items, without_retries
+from rainbow_util import SORT_KEY
+
+
+class SyncStats:
+    '''What an incremental re-sort did'''
+    def __init__(self):
+        self.kept = 0
+        self.added = 0
+        self.removed = 0
+        self.requests = 0
+        self.rewritten = False
+
+    def __repr__(self)->str:
+        if self.rewritten:
+            return f'target playlist rewritten with {self.kept + self.added} tracks'
+        return f'{self.kept} tracks kept, {self.added} added, {self.removed} removed in {self.requests} requests'
+
+
+def load_snapshot(path:str)->Optional[dict]:
+    '''Load the snapshot of the last sort
+    :param path: the snapshot file
+    :return: the snapshot, or None if there isn't one yet'''
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_snapshot(path:str, snapshot:dict)->None:
+    '''Save the snapshot of a sort, replacing the old one in one go so an interruption never leaves half a file
+    :param path: the snapshot file
+    :param snapshot: dict with the source_snapshot_id, target_id, target_snapshot_id, band_deg and
+        the sorted rows, each a dict with the track_id, band, pb, track_number and img_url'''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+def sort_key(row:dict)->tuple:
+    return tuple(row[column] for column in SORT_KEY)
+
+def diff_tracks(rows:list, track_ids:list)->tuple:
+    '''Compare the tracks of the last sort to the current ones, a track that's in the playlist twice counts twice
+    :param rows: the rows of the last sort, in sorted order
+    :param track_ids: the current track ids of the source playlist
+    :return: a tuple with the positions (in rows) of the tracks that are gone,
+        and the indexes (in track_ids) of the new tracks'''
+    remaining = Counter(track_ids)
+    removed = []
+    for (position, row) in enumerate(rows):
+        if remaining[row['track_id']] > 0:
+            remaining[row['track_id']] -= 1
+        else:
+            removed.append(position)
+    #end for
+    # the new tracks are the ones left over, the last occurrences if a track is in there more than once
+    added = []
+    for i in range(len(track_ids) - 1, -1, -1):
+        if remaining[track_ids[i]] > 0:
+            remaining[track_ids[i]] -= 1
+            added.append(i)
+    #end for
+    return removed, added[::-1]
+
+def merge_rows(rows:list, new_rows:list)->tuple:
+    '''Insert new rows into the sorted rows by binary search. A new row goes after the existing rows with the
+    same key, the rows already there keep their order, so the existing tracks never have to move
+    :param rows: the sorted rows, modified in place
+    :param new_rows: the rows to insert
+    :return: a tuple with the merged rows and the final positions of the new rows, in ascending order'''
+    keys = [sort_key(row) for row in rows]
+    inserted = []
+    for row in sorted(new_rows, key=sort_key):
+        position = bisect_right(keys, sort_key(row))
+        keys.insert(position, sort_key(row))
+        rows.insert(position, row)
+        inserted.append(position)
+    #end for
+    # a later insertion shifts the earlier ones that come after it; as the new rows go in in sorted order
+    # no later insertion lands before an earlier one, so the positions are final
+    return rows, inserted
+
+def runs(positions:list, max_length:int=PAGE_SIZE)->list:
+    '''Group ascending positions into runs of consecutive positions
+    :return: a list of (start, length) tuples'''
+    result = []
+    for position in positions:
+        if result and result[-1][0] + result[-1][1] == position and result[-1][1] < max_length:
+            result[-1] = (result[-1][0], result[-1][1] + 1)
+        else:
+            result.append((position, 1))
+    #end for
+    return result
+
+def remove_tracks(sp:spotipy.Spotify, playlist_id:str, rows:list, positions:list, snapshot_id:str,
+        stats:SyncStats)->str:
+    '''Remove the tracks at the given positions, the last ones first so the positions of the rest don't shift
+    :return: the playlist's new snapshot_id'''
+    positions = sorted(positions, reverse=True)
+    for start in range(0, len(positions), PAGE_SIZE):
+        items = [{'uri': rows[p]['track_id'], 'positions': [p]} for p in positions[start:start + PAGE_SIZE]]
+        snapshot_id = sp.playlist_remove_specific_occurrences_of_items(playlist_id, items,
+            snapshot_id=snapshot_id)['snapshot_id']
+        stats.requests += 1
+    #end for
+    return snapshot_id
+
+def add_tracks(sp:spotipy.Spotify, playlist_id:str, rows:list, positions:list, snapshot_id:str,
+        stats:SyncStats)->str:
+    '''Insert the tracks at their final positions, a run of consecutive ones per request, front to back
+    :return: the playlist's new snapshot_id'''
+    for (start, length) in runs(positions):
+        snapshot_id = sp.playlist_add_items(playlist_id, [row['track_id'] for row in rows[start:start + length]],
+            position=start)['snapshot_id']
+        stats.requests += 1
+    #end for
+    return snapshot_id
+
+def get_snapshot_id(sp:spotipy.Spotify, playlist_id:str)->str:
+    return sp.playlist(playlist_id, fields='snapshot_id')['snapshot_id']
+
+def sync_playlist(sp:spotipy.Spotify, source_id:str, target_id:str, snapshot_path:str, band_deg:int=60,
+        **pipeline_args)->SyncStats:
+    '''Bring the rainbow sorted target playlist up to date with the source playlist, doing only the work the
+    changes since the last sync need:
+    - nothing at all if the source playlist's snapshot_id hasn't changed
+    - only the covers of the new tracks get analyzed, the rest come from the snapshot
+    - the new tracks are merged into the existing order rather than everything getting sorted again
+    - the target playlist gets just the removals and insertions, the remaining tracks keep their relative order
+      so none of them need to move
+    Without a snapshot, or when someone else changed the target playlist since, the target gets rewritten in full
+    :param sp: the Spotify client
+    :param source_id: the playlist to sort
+    :param target_id: the rainbow sorted playlist
+    :param snapshot_path: the file with the snapshot of the last sync, created if it doesn't exist
+    :param band_deg: size of the rainbow band partition in degrees
+    :param pipeline_args: passed on to cover_pipeline.analyze_covers, e.g. cache
+    :return: what was done'''
+    stats = SyncStats()
+    snapshot = load_snapshot(snapshot_path)
+    if snapshot and (snapshot['target_id'] != target_id or snapshot['band_deg'] != band_deg):
+        snapshot = None
+    source_snapshot_id = get_snapshot_id(sp, source_id)
+    if snapshot and snapshot['source_snapshot_id'] == source_snapshot_id:
+        stats.kept = len(snapshot['rows'])
+        return stats
+
+    tracks = [item['track'] for item in iter_playlist_items(sp, source_id)]
+    rows = snapshot['rows'] if snapshot else []
+    removed, added = diff_tracks(rows, [track['id'] for track in tracks])
+    # forget the removed tracks, then analyze the new ones
+    removed_set = set(removed)
+    kept_rows = [row for (position, row) in enumerate(rows) if position not in removed_set]
+    new_tracks = [tracks[i] for i in added]
+    new_rows = []
+    urls = (track['album']['images'][-1]['url'] for track in new_tracks)
+    for (track, cover) in zip(new_tracks, analyze_unique_covers(urls, band_deg, DedupStats(), **pipeline_args)):
+        new_rows.append({'track_id': track['id'], 'band': cover.primary_band, 'pb': cover.pb,
+            'track_number': track['track_number'], 'img_url': cover.url})
+    #end for
+    stats.kept = len(kept_rows)
+    with instrumentation.timer('sort'):
+        merged_rows, inserted = merge_rows(kept_rows, new_rows)
+    stats.added = len(new_rows)
+    stats.removed = len(removed)
+
+    with instrumentation.timer('playlist_write'):
+        target_snapshot_id = get_snapshot_id(sp, target_id)
+        if snapshot and snapshot['target_snapshot_id'] == target_snapshot_id:
+            target_snapshot_id = remove_tracks(sp, target_id, rows, removed, target_snapshot_id, stats)
+            # an add spotipy resent after an error could go in twice, so it only gets sent once
+            target_snapshot_id = add_tracks(without_retries(sp), target_id, merged_rows, inserted, target_snapshot_id,
+                stats)
+        else:
+            # the target isn't what we left it as, start it over
+            sp.playlist_replace_items(target_id, [])
+            writer = PlaylistWriter(sp, target_id)
+            writer.write([row['track_id'] for row in merged_rows])
+            stats.requests += 1 + writer.requests
+            stats.rewritten = True
+            target_snapshot_id = get_snapshot_id(sp, target_id)
+        #end if
+    #end with
+    save_snapshot(snapshot_path, {'source_snapshot_id': source_snapshot_id, 'target_id': target_id,
+        'target_snapshot_id': target_snapshot_id, 'band_deg': band_deg, 'rows': merged_rows})
+    return stats
+#end def
@@ -0,0 +1,135 @@
+# %% Incremental re-sort against a stubbed Spotify client, no Spotify account or internet needed
+import json
+import os
+import tempfile
+from urllib.parse import quote
+import pandas as pd
+from playlist_sync import sync_playlist
+from rainbow_util import SORT_KEY
+from test_server import QuietHandler, serve_directory
+
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+
+
+class StubPlaylists:
+    '''Just enough of spotipy.Spotify for the syncing, playlists kept as lists of track ids in memory'''
+    def __init__(self, tracks:dict):
+        self.tracks = tracks
+        self.playlists = {}
+        self.versions = {}
+        self.writes = 0
+
+    def _changed(self, playlist_id):
+        self.versions[playlist_id] = self.versions.get(playlist_id, 0) + 1
+        return {'snapshot_id': f'{playlist_id}-{self.versions[playlist_id]}'}
+
+    def playlist(self, playlist_id, fields=None):
+        return {'snapshot_id': f'{playlist_id}-{self.versions.get(playlist_id, 0)}',
+            'tracks': {'total': len(self.playlists[playlist_id])}}
+
+    def playlist_tracks(self, playlist_id, fields=None, limit=100, offset=0):
+        ids = self.playlists[playlist_id]
+        return {'items': [{'track': self.tracks[i]} for i in ids[offset:offset + limit]], 'total': len(ids)}
+
+    def playlist_add_items(self, playlist_id, items, position=None):
+        self.writes += 1
+        playlist = self.playlists[playlist_id]
+        position = len(playlist) if position is None else position
+        playlist[position:position] = items
+        return self._changed(playlist_id)
+
+    def playlist_remove_specific_occurrences_of_items(self, playlist_id, items, snapshot_id=None):
+        self.writes += 1
+        assert snapshot_id == self.playlist(playlist_id)['snapshot_id']
+        playlist = self.playlists[playlist_id]
+        positions = sorted((p for item in items for p in item['positions']), reverse=True)
+        for p in positions:
+            assert playlist[p] == [item['uri'] for item in items if p in item['positions']][0]
+            del playlist[p]
+        return self._changed(playlist_id)
+
+    def playlist_replace_items(self, playlist_id, items):
+        self.writes += 1
+        self.playlists[playlist_id] = list(items)
+        return self._changed(playlist_id)
+
+
+class CountingHandler(QuietHandler):
+    def do_GET(self):
+        self.server.requests_served += 1
+        super().do_GET()
+
+
+(server, base_url) = serve_directory(image_path, CountingHandler)
+server.requests_served = 0
+
+# 400 tracks over the test covers, so the covers are shared by several tracks each
+tracks = {f'track{i}': {'id': f'track{i}', 'track_number': i % 12 + 1,
+    'album': {'images': [{'url': base_url + quote(image_list[i % len(image_list)]) + f'?album={i % 150}'}]}}
+    for i in range(400)}
+sp = StubPlaylists(tracks)
+sp.playlists['source'] = [f'track{i}' for i in range(300)]
+sp.playlists['target'] = []
+
+def full_sort(source_ids:list, rows:list)->list:
+    '''The rainbow order of the whole playlist sorted from scratch, as the sort keys'''
+    features = {row['track_id']: row for row in rows}
+    df = pd.DataFrame([features[i] for i in source_ids]).sort_values(by=SORT_KEY)
+    return list(df[SORT_KEY].itertuples(index=False, name=None))
+
+def check_target(snapshot_path:str):
+    with open(snapshot_path) as f:
+        rows = json.load(f)['rows']
+    assert [row['track_id'] for row in rows] == sp.playlists['target']
+    assert sorted(sp.playlists['target']) == sorted(sp.playlists['source'])
+    assert [tuple(row[c] for c in SORT_KEY) for row in rows] == full_sort(sp.playlists['source'], rows)
+
+with tempfile.TemporaryDirectory() as snapshot_dir:
+    snapshot_path = os.path.join(snapshot_dir, 'snapshot.json')
+
+    # the first sync has no snapshot to go on, so everything gets analyzed and written
+    stats = sync_playlist(sp, 'source', 'target', snapshot_path, analysis_workers=0)
+    print(stats)
+    assert stats.rewritten and stats.added == 300
+    check_target(snapshot_path)
+
+    # nothing changed, nothing to do
+    served, writes = server.requests_served, sp.writes
+    stats = sync_playlist(sp, 'source', 'target', snapshot_path, analysis_workers=0)
+    assert (stats.kept, stats.added, stats.requests) == (300, 0, 0)
+    assert (server.requests_served, sp.writes) == (served, writes)
+
+    # a few tracks come and go: only the new covers get analyzed, and the target just gets the changes
+    sp.playlists['source'] = [i for i in sp.playlists['source'] if i not in ('track3', 'track150', 'track299')]
+    sp.playlists['source'] += ['track300', 'track301', 'track302', 'track303', 'track3']
+    sp._changed('source')
+    served = server.requests_served
+    stats = sync_playlist(sp, 'source', 'target', snapshot_path, analysis_workers=0)
+    print(stats)
+    assert not stats.rewritten
+    assert (stats.kept, stats.added, stats.removed) == (298, 4, 2), stats
+    # each new track has a cover of its own here
+    assert server.requests_served - served == 4
+    assert stats.requests <= 1 + 4, stats
+    check_target(snapshot_path)
+
+    # a track added twice counts twice
+    sp.playlists['source'].append('track42')
+    sp._changed('source')
+    stats = sync_playlist(sp, 'source', 'target', snapshot_path, analysis_workers=0)
+    assert (stats.added, stats.removed) == (1, 0), stats
+    check_target(snapshot_path)
+
+    # someone else edited the target playlist, so it gets rewritten rather than patched
+    sp.playlist_replace_items('target', sp.playlists['target'][::-1])
+    sp.playlists['source'].append('track304')
+    sp._changed('source')
+    stats = sync_playlist(sp, 'source', 'target', snapshot_path, analysis_workers=0)
+    assert stats.rewritten
+    check_target(snapshot_path)
+#end with
+
+server.shutdown()
+
+# %%
@@ -0,0 +1,117 @@
+import heapq
+from typing import Iterator
+import numpy as np
+import pandas as pd
+from rainbow_util import SORT_KEY, TRACK_COLUMNS
+
+_KEY_POSITIONS = [list(TRACK_COLUMNS).index(column) for column in SORT_KEY]
+
+
+def _first_rows(rows:np.ndarray, pb:np.ndarray, track_number:np.ndarray, count:int)->tuple:
+    # the first count rows of a band in rainbow order, sorted, and the rest of the band as it was.
+    # argpartition on pb picks the candidates in linear time; everything tied with the last one's pb comes along,
+    # so the track numbers decide among the ties just like in the full sort
+    if count >= len(rows):
+        return rows[np.lexsort((track_number[rows], pb[rows]))], rows[:0]
+    band_pb = pb[rows]
+    threshold = band_pb[np.argpartition(band_pb, count - 1)[count - 1]]
+    candidates = np.flatnonzero(band_pb <= threshold)
+    # lexsort is stable and the rows are in their original order, so ties keep it
+    first = candidates[np.lexsort((track_number[rows[candidates]], band_pb[candidates]))[:count]]
+    rest = np.ones(len(rows), dtype=bool)
+    rest[first] = False
+    return rows[first], rows[rest]
+
+def iter_rainbow_pages(band:np.ndarray, pb:np.ndarray, track_number:np.ndarray, page_size:int)->Iterator[np.ndarray]:
+    '''Page through the tracks in rainbow order without sorting all of them up front: the tracks get split by
+    band (bands are small integers, so that's a linear radix sort) and the first page out of a band only
+    partially sorts as much of it as it needs; the rest of that band is sorted once, when the next page is asked
+    for, and sliced. Getting the first page of a big playlist is about linear in its length and paging through
+    all of it costs about the same as one full sort.
+    The pages come out in the same order as df.sort_values(by=SORT_KEY, kind='stable')
+    :param band: the primary band of each track
+    :param pb: the perceived brightness of each track
+    :param track_number: the track number of each track
+    :param page_size: tracks per page, the last page can be shorter
+    :return: an iterator of arrays of row positions, a page at a time'''
+    (band, pb, track_number) = (np.asarray(band), np.asarray(pb), np.asarray(track_number))
+    by_band = np.argsort(band, kind='stable')
+    bands = np.split(by_band, np.flatnonzero(np.diff(band[by_band])) + 1) if len(by_band) else []
+    page = []
+    filled = 0
+    for rows in bands:
+        (first, rows) = _first_rows(rows, pb, track_number, page_size - filled)
+        page.append(first)
+        filled += len(first)
+        if filled < page_size:
+            # the whole band fit
+            continue
+        yield np.concatenate(page)
+        # the rest of the band, sorted once and sliced into pages rather than selected from again for each
+        rows = rows[np.lexsort((track_number[rows], pb[rows]))]
+        full = len(rows) - len(rows) % page_size
+        for start in range(0, full, page_size):
+            yield rows[start:start + page_size]
+        page = [rows[full:]]
+        filled = len(rows) - full
+    #end for
+    if filled:
+        yield np.concatenate(page)
+#end def
+
+def rainbow_top_k(df:pd.DataFrame, k:int)->pd.DataFrame:
+    '''The first k tracks of the dataframe in rainbow order, without sorting the rest, see iter_rainbow_pages'''
+    return next(iter_dataframe_pages(df, k), df.iloc[:0])
+
+def iter_dataframe_pages(df:pd.DataFrame, page_size:int)->Iterator[pd.DataFrame]:
+    '''The tracks of the dataframe in rainbow order a page at a time, each page worked out when it's asked for,
+    see iter_rainbow_pages'''
+    for rows in iter_rainbow_pages(df['band'].to_numpy(), df['pb'].to_numpy(), df['track_number'].to_numpy(),
+            page_size):
+        yield df.iloc[rows]
+#end def
+
+
+class RainbowPreview:
+    '''Keep the first k rows in rainbow order of the rows seen so far, for a preview while a playlist is still
+    streaming in and being analyzed. It's a heap of the k best rows: adding a row is O(log k) and most rows
+    that come late get turned away after a single comparison.
+    Until all the rows are in the preview is provisional: a track analyzed later can still get ahead of the ones
+    shown; once the last row is added it's exactly the first page of the full sort'''
+    def __init__(self, k:int):
+        '''
+        :param k: the size of the preview, e.g. the number of covers on the first screen or the tracks of the
+            first page of the playlist
+        '''
+        self.k = k
+        # a max-heap by negated keys, the worst row of the preview on top; ties go to the earlier row
+        self._heap = []
+        self._seen = 0
+
+    def add(self, row:list)->None:
+        '''Offer a row
+        :param row: the values of the TRACK_COLUMNS, in the same order'''
+        (band, pb, track_number) = (row[i] for i in _KEY_POSITIONS)
+        entry = (-band, -pb, -track_number, -self._seen, row)
+        self._seen += 1
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry > self._heap[0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def __len__(self)->int:
+        return self._seen
+
+    def rows(self)->list:
+        '''The preview rows, in rainbow order'''
+        return [entry[-1] for entry in sorted(self._heap, reverse=True)]
+
+    def to_dataframe(self)->pd.DataFrame:
+        '''The preview rows as a dataframe with the TRACK_COLUMNS, in rainbow order'''
+        rows = self.rows()
+        return pd.DataFrame({name: np.array([row[i] for row in rows], dtype=dtype)
+            for (i, (name, dtype)) in enumerate(TRACK_COLUMNS.items())})
+
+    def __repr__(self)->str:
+        return f'RainbowPreview(first {min(self.k, self._seen)} of {self._seen} tracks)'
+#end class
@@ -0,0 +1,62 @@
+# %% The preview and the pages against the full sort, on a made up playlist with lots of ties
+import time
+import numpy as np
+import pandas as pd
+from rainbow_util import SORT_KEY, TRACK_COLUMNS
+from rainbow_preview import RainbowPreview, iter_dataframe_pages, iter_rainbow_pages, rainbow_top_k
+
+rng = np.random.default_rng(0)
+n = 5000
+# few distinct covers, so plenty of tracks share a band and pb and some the track number too
+covers = rng.integers(0, 300, n)
+cover_pb = rng.random(300).round(2)
+cover_band = rng.integers(0, 6, 300)
+df = pd.DataFrame({'track_id': [f'track{i}' for i in range(n)], 'band': cover_band[covers], 'pb': cover_pb[covers],
+    'track_number': rng.integers(1, 15, n), 'img_url': [f'cover{c}' for c in covers]})
+expected = df.sort_values(by=SORT_KEY, kind='stable')
+
+# %% Paging gives the full sort, for page sizes big and small
+for page_size in [1, 7, 100, 999, n, 2 * n]:
+    pages = list(iter_rainbow_pages(df['band'], df['pb'], df['track_number'], page_size))
+    assert all(len(page) == page_size for page in pages[:-1]) and 0 < len(pages[-1]) <= page_size
+    assert np.concatenate(pages).tolist() == expected.index.tolist(), page_size
+#end for
+assert list(iter_rainbow_pages([], [], [], 10)) == []
+assert rainbow_top_k(df, 50).equals(expected.iloc[:50])
+pages = iter_dataframe_pages(df, 100)
+next(pages)
+assert next(pages).equals(expected.iloc[100:200])
+
+# %% The streaming preview: provisional while the rows come in, the first page of the full sort at the end
+preview = RainbowPreview(100)
+for (i, row) in enumerate(df[list(TRACK_COLUMNS)].itertuples(index=False)):
+    preview.add(list(row))
+    if i == n // 10:
+        # the best of what's been seen so far
+        assert preview.to_dataframe().equals(df.iloc[:i + 1].sort_values(by=SORT_KEY, kind='stable')
+            .iloc[:100].reset_index(drop=True))
+#end for
+assert len(preview) == n
+assert preview.to_dataframe().equals(expected.iloc[:100].reset_index(drop=True))
+print(preview)
+
+# %% The first page costs a fraction of the full sort
+big = pd.DataFrame({'band': rng.integers(0, 6, 1_000_000), 'pb': rng.random(1_000_000),
+    'track_number': rng.integers(1, 15, 1_000_000)})
+start = time.perf_counter()
+full = big.sort_values(by=SORT_KEY)
+sort_time = time.perf_counter() - start
+start = time.perf_counter()
+first = rainbow_top_k(big, 100)
+top_k_time = time.perf_counter() - start
+assert first.index.tolist() == full.index[:100].tolist()
+print(f'1M tracks: full sort {sort_time:.3f}s, first page {top_k_time:.3f}s')
+
+# %% Paging through all of it costs about one full sort, not a selection per page
+start = time.perf_counter()
+pages = list(iter_rainbow_pages(big['band'], big['pb'], big['track_number'], 100))
+paging_time = time.perf_counter() - start
+assert len(pages) == 10_000 and np.concatenate(pages).tolist() == full.index.tolist()
+print(f'1M tracks: all 10,000 pages {paging_time:.3f}s')
+
+# %%
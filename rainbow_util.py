@@ -1,14 +1,50 @@
 from IPython.display import display
-from typing import Tuple
+import math
+from typing import Optional, Tuple
+import numpy as np
 import pandas as pd
 from PIL import Image
 
+# bump this whenever a change to the color analysis changes its results, so cached results (see cover_cache) 
+# get recomputed
+ALGORITHM_VERSION = 2
 
-def append_row(df:pd.DataFrame, row:list)->None:
-    '''Append a row to a dataframe
-    :param df: dataframe to append to
-    :param row: row to append'''
-    df.loc[len(df.index)] = row
+class ColumnAccumulator:
+    '''Collect rows in preallocated typed columns and turn them into a dataframe once at the end.
+    Appending to a dataframe row by row (df.loc[len(df.index)] = row) copies it every time, which makes 
+    building a playlist's worth of rows O(n²); the columns here double in size when full instead'''
+    def __init__(self, columns:dict, capacity:int=1024):
+        '''
+        :param columns: column names mapped to their numpy dtype, use object for strings and tuples
+        :param capacity: number of rows to preallocate, e.g. the playlist length if known
+        '''
+        self._columns = {name: np.empty(max(capacity, 1), dtype=dtype) for (name, dtype) in columns.items()}
+        self._len = 0
+
+    def append(self, row:list)->None:
+        '''Append a row
+        :param row: the values for each column, in the same order as the columns'''
+        if self._len == len(next(iter(self._columns.values()))):
+            # full, double the size of each column
+            for (name, column) in self._columns.items():
+                self._columns[name] = np.resize(column, 2*len(column))
+        for (column, value) in zip(self._columns.values(), row):
+            column[self._len] = value
+        self._len += 1
+
+    def __len__(self)->int:
+        return self._len
+
+    def to_dataframe(self)->pd.DataFrame:
+        '''Get the rows appended so far as a dataframe
+        :return: the dataframe'''
+        return pd.DataFrame({name: column[:self._len] for (name, column) in self._columns.items()})
+#end class
+
+# the columns for sorting the tracks of a playlist
+TRACK_COLUMNS = {'track_id': object, 'band': np.int64, 'pb': np.float64, 'track_number': np.int64, 'img_url': object}
+# the columns the rainbow order is sorted by
+SORT_KEY = ['band', 'pb', 'track_number']
 
 def normalize_color(rgb:tuple) -> tuple:
     """
@@ -80,10 +116,11 @@ def get_rainbow_band(hue:float, band_deg:int)->int:
     # return the band index
     return rb_hue // band_deg
 
-def get_image_rainbow_bands_and_perceived_brightness(image:Image, band_deg:int)->Tuple[dict[int, float], float]:
+def get_image_rainbow_bands_and_perceived_brightness_per_pixel(image:Image, band_deg:int)->Tuple[dict[int, float], float]:
     """
     Get the rainbow bands (aka hue partitions) as a list of relative saturation for vivid colors 
-    as well as the perceived brightness for an image
+    as well as the perceived brightness for an image, one pixel at a time.
+    This is the original (slow) implementation, kept as the reference for the array-backed version
     :param image: PIL Image object
     :return: a tuple with the hue partitions as a list of floats and perceived brightness as a float
     """
@@ -132,6 +169,283 @@ def get_image_rainbow_bands_and_perceived_brightness(image:Image, band_deg:int)-
     return bands, perceived_brightness
 #end def
 
+class PixelBuffer:
+    """
+    A reusable (N, 3) uint8 pixel array for image_to_pixels, grown as needed, so decoding one image after another 
+    doesn't allocate a new array for every image. The pixels it returns are only good until it's used again
+    """
+    def __init__(self, capacity:int=0):
+        self._array = np.empty((capacity, 3), dtype=np.uint8)
+
+    def get(self, n:int)->np.ndarray:
+        """
+        Get room for n pixels
+        :return: an (n, 3) uint8 array
+        """
+        if n > len(self._array):
+            self._array = np.empty((max(n, 2 * len(self._array)), 3), dtype=np.uint8)
+        return self._array[:n]
+#end class
+
+def _cmyk_to_rgb(cmyk:np.ndarray, rgb:np.ndarray)->None:
+    """
+    Same as PIL's CMYK to RGB conversion: (255 - k) - c * (255 - k) / 255, with the same integer rounding
+    """
+    nk = 255 - cmyk[:, 3:4].astype(np.int32)
+    tmp = cmyk[:, :3] * nk + 128
+    rgb[:] = np.clip(nk - (((tmp >> 8) + tmp) >> 8), 0, 255)
+
+def image_to_pixels(image:Image, out:Optional[PixelBuffer]=None)->np.ndarray:
+    """
+    Read the pixels of an image as an (N, 3) array of [0, 255] RGB values.
+    Grayscale, palette and CMYK images get turned into RGB here rather than by PIL converting the whole image 
+    first; other modes do get converted. The result is identical to image.convert('RGB')
+    :param image: PIL Image object
+    :param out: optional buffer to read the pixels into, instead of a new array
+    :return: a uint8 array with one row per pixel
+    """
+    mode = image.mode
+    if mode not in ('RGB', 'L', 'P', 'CMYK'):
+        image = image.convert('RGB')
+        mode = 'RGB'
+    image.load()
+    n = image.width * image.height
+    pixels = out.get(n) if out is not None else np.empty((n, 3), dtype=np.uint8)
+    if n == 0:
+        return pixels
+    if mode == 'RGB':
+        pixels[:] = np.asarray(image).reshape(n, 3)
+    elif mode == 'L':
+        pixels[:] = np.asarray(image).reshape(n, 1)
+    elif mode == 'P':
+        # an index past the end of a short palette is black, same as PIL
+        palette = np.zeros((256, 3), dtype=np.uint8)
+        colors = np.array(image.getpalette('RGB') or [], dtype=np.uint8).reshape(-1, 3)
+        palette[:len(colors)] = colors
+        np.take(palette, np.asarray(image).reshape(n), axis=0, out=pixels)
+    else:
+        _cmyk_to_rgb(np.asarray(image).reshape(n, 4), pixels)
+    return pixels
+#end def
+
+def sample_pixels(image:Image, max_pixels:int, sampling:str='thumbnail', seed:int=0,
+        out:Optional[PixelBuffer]=None)->np.ndarray:
+    """
+    Read at most max_pixels pixels of an image as an (N, 3) array of [0, 255] RGB values, rather than all of them
+    The sampling methods are:
+    - 'thumbnail': shrink the image, averaging the pixels in boxes. JPEGs get decoded at a reduced size to start 
+      with (Image.draft), which only works if the image hasn't been loaded yet, so pass a freshly opened image
+    - 'stride': every n-th pixel of the full image
+    - 'random': a random selection of pixels, the same one every time for the same seed
+    :param image: PIL Image object
+    :param max_pixels: the pixel budget
+    :param sampling: the sampling method, 'thumbnail', 'stride' or 'random'
+    :param seed: seed for the random sampling
+    :param out: optional buffer to read the pixels into, see image_to_pixels
+    :return: a uint8 array with one row per sampled pixel
+    """
+    width, height = image.size
+    if width * height <= max_pixels:
+        return image_to_pixels(image, out)
+    if sampling == 'thumbnail':
+        scale = math.sqrt(max_pixels / (width * height))
+        # the biggest size with the same aspect ratio that fits the budget: round both sides down, then give
+        # each a pixel more if there's still room
+        (thumb_width, thumb_height) = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if (thumb_width + 1) * thumb_height <= max_pixels:
+            thumb_width += 1
+        if thumb_width * (thumb_height + 1) <= max_pixels:
+            thumb_height += 1
+        # let the JPEG decoder do the bulk of the shrinking, it picks a size at least as big as asked for
+        image.draft('RGB', (thumb_width, thumb_height))
+        # ... then finish off by averaging the pixels in boxes down to the thumbnail size;
+        # shrinking before or after turning gray into RGB comes out the same, the other modes need converting first
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        return image_to_pixels(image.resize((thumb_width, thumb_height), Image.Resampling.BOX), out)
+    pixels = image_to_pixels(image, out)
+    if sampling == 'stride':
+        return pixels[::math.ceil(len(pixels) / max_pixels)]
+    if sampling == 'random':
+        # sort the selection to keep the pixels in image order
+        return pixels[np.sort(np.random.default_rng(seed).choice(len(pixels), max_pixels, replace=False))]
+    raise ValueError(f'Unknown sampling method: {sampling}')
+#end def
+
+def rgb_to_hsp_array(rgb:np.ndarray)->Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Array version of rgb_to_hsp: convert (N, 3) RGB colors to Hue, Saturation, and Perceived Brightness.
+    Every step mirrors the scalar function, operation for operation, so the results are bit-for-bit identical 
+    - including the quirk of gray colors returning their lightness as saturation and 0 as perceived brightness
+    :param rgb: RGB colors as an (N, 3) float array of [0, N]-space values
+    :return: a tuple of arrays with the hue in [0, 360]-space (whole degrees), saturation 
+    and perceived brightness in the same [0, N]-space as the input colors"""
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    sumc = (maxc+minc)
+    rangec = (maxc-minc)
+    l = sumc/2.0
+    gray = minc == maxc
+    # the gray pixels divide by zero below, their values get replaced afterwards so silence the warnings
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.where(l <= 0.5, rangec / sumc, rangec / (2.0-sumc))
+        rc = (maxc-r) / rangec
+        gc = (maxc-g) / rangec
+        bc = (maxc-b) / rangec
+    h = np.where(r == maxc, bc-gc, np.where(g == maxc, 2.0+rc-bc, 4.0+gc-rc))
+    # the hue is never negative after the %, so floor does what int() does in the scalar version
+    h = np.floor((h/6.0) % 1.0 * 360.0)
+
+    p = np.sqrt(0.299 * r * r + 0.587 * g * g + 0.114 * b * b)
+
+    h[gray] = 0.0
+    s[gray] = l[gray]
+    p[gray] = 0.0
+    return h, s, p
+#end def
+
+class ColorFeatures:
+    """
+    All the color statistics of an image, as small fixed-size arrays and numbers rather than dicts
+    - all_bands: the perceived brightness of all the pixels summed per band
+    - vivid_bands: the saturation of the vivid pixels summed per band
+    - vivid_pixels: the number of vivid pixels
+    - pixels: the number of pixels
+    - pb: the mean perceived brightness
+    - vividity: the share of vivid pixels
+    - hue_variance: the circular variance of the hues of the vivid pixels, from 0 when they all have the same 
+      hue to 1 when they're spread all around the color wheel; 0 when there are no vivid pixels
+    """
+    __slots__ = ('all_bands', 'vivid_bands', 'vivid_pixels', 'pixels', 'pb', 'vividity', 'hue_variance')
+
+    def __init__(self, all_bands:np.ndarray, vivid_bands:np.ndarray, vivid_pixels:int, pixels:int, pb:float,
+            hue_variance:float):
+        self.all_bands = all_bands
+        self.vivid_bands = vivid_bands
+        self.vivid_pixels = vivid_pixels
+        self.pixels = pixels
+        self.pb = pb
+        self.vividity = vivid_pixels / pixels
+        self.hue_variance = hue_variance
+
+    @property
+    def bands(self)->np.ndarray:
+        """
+        The band weights used for sorting: the vivid bands per vivid pixel, or if there are no vivid pixels 
+        the brightness of all the bands per pixel, to allow accurate comparison of different-sized images
+        """
+        if self.vivid_pixels > 0:
+            return self.vivid_bands / self.vivid_pixels
+        return self.all_bands / self.pixels
+
+    @property
+    def primary_band(self)->int:
+        """
+        The band with the most weight, the first one if there's a tie (same as get_primary_band)
+        """
+        return int(np.argmax(self.bands))
+
+    def bands_dict(self)->dict[int, float]:
+        """
+        The bands as a dictionary of band index to weight, as get_pixels_rainbow_bands_and_perceived_brightness 
+        returns them
+        """
+        return dict(enumerate(self.bands.tolist()))
+
+    def __repr__(self)->str:
+        return f'ColorFeatures(band={self.primary_band}, pb={self.pb:.3f}, vividity={self.vividity:.3f}, ' \
+            + f'hue_variance={self.hue_variance:.3f})'
+#end class
+
+def get_pixels_color_features(pixels:np.ndarray, band_deg:int)->ColorFeatures:
+    """
+    Work out all the color features of an array of pixels in one go: the hue, saturation and perceived brightness
+    and the band of each pixel are calculated once and everything else is summed up from them.
+    The bands and perceived brightness are exactly the same as get_image_rainbow_bands_and_perceived_brightness_per_pixel
+    returns: np.bincount and np.cumsum add the values up in pixel order, just like the original loop did
+    :param pixels: (N, 3) uint8 array of [0, 255] RGB values, see image_to_pixels
+    :param band_deg: size of the rainbow band partition in degrees, it has to divide 360
+    :return: the features
+    """
+    # a partial last band would have no slot of its own and its pixels would get dropped
+    if band_deg <= 0 or 360 % band_deg:
+        raise ValueError(f'band_deg has to divide 360 into whole bands, {band_deg} doesn\'t')
+    pixel_cnt = len(pixels)
+    band_cnt = 360 // band_deg
+
+    h, s, p = rgb_to_hsp_array(pixels / 255)
+    # same as get_rainbow_band, for all the pixels at once
+    band = ((h + 30) % 360 // band_deg).astype(np.intp)
+    # same as is_vivid
+    vivid = (s > 0.15) & (p > 0.18) & (p < 0.95)
+    vivid_pixels = int(np.count_nonzero(vivid))
+
+    all_bands = np.bincount(band, weights=p, minlength=band_cnt)[:band_cnt]
+    if vivid_pixels > 0:
+        vivid_bands = np.bincount(band[vivid], weights=s[vivid], minlength=band_cnt)[:band_cnt]
+        # the mean direction of the hues on the color wheel is shorter the more they're spread out
+        angles = np.radians(h[vivid])
+        hue_variance = 1.0 - float(np.hypot(np.cos(angles).mean(), np.sin(angles).mean()))
+    else:
+        vivid_bands = np.zeros(band_cnt)
+        hue_variance = 0.0
+    perceived_brightness = float(np.cumsum(p)[-1]) / pixel_cnt
+
+    return ColorFeatures(all_bands, vivid_bands, vivid_pixels, pixel_cnt, perceived_brightness, hue_variance)
+#end def
+
+def get_pixels_rainbow_bands_and_perceived_brightness(pixels:np.ndarray, band_deg:int)->Tuple[dict[int, float], float]:
+    """
+    Get the rainbow bands (aka hue partitions) as a list of relative saturation for vivid colors 
+    as well as the perceived brightness for an array of pixels, working on all the pixels at once.
+    Returns exactly the same values as get_image_rainbow_bands_and_perceived_brightness_per_pixel, 
+    see get_pixels_color_features for the rest of the color features
+    :param pixels: (N, 3) uint8 array of [0, 255] RGB values, see image_to_pixels
+    :param band_deg: size of the rainbow band partition in degrees
+    :return: a tuple with the hue partitions as a list of floats and perceived brightness as a float
+    """
+    features = get_pixels_color_features(pixels, band_deg)
+    return features.bands_dict(), features.pb
+#end def
+
+def get_image_rainbow_bands_and_perceived_brightness(image:Image, band_deg:int, max_pixels:Optional[int]=None, 
+        sampling:str='thumbnail', seed:int=0)->Tuple[dict[int, float], float]:
+    """
+    Get the rainbow bands (aka hue partitions) as a list of relative saturation for vivid colors 
+    as well as the perceived brightness for an image
+    :param image: PIL Image object
+    :param band_deg: size of the rainbow band partition in degrees
+    :param max_pixels: optional pixel budget for large images, see sample_pixels; None to use every pixel
+    :param sampling: the sampling method to stay within max_pixels, see sample_pixels
+    :param seed: seed for the 'random' sampling method
+    :return: a tuple with the hue partitions as a list of floats and perceived brightness as a float
+    """
+    if max_pixels is None:
+        pixels = image_to_pixels(image)
+    else:
+        pixels = sample_pixels(image, max_pixels, sampling, seed)
+    return get_pixels_rainbow_bands_and_perceived_brightness(pixels, band_deg)
+#end def
+
+def get_image_color_features(image:Image, band_deg:int, max_pixels:Optional[int]=None, sampling:str='thumbnail',
+        seed:int=0, out:Optional[PixelBuffer]=None)->ColorFeatures:
+    """
+    Get all the color features of an image, see get_pixels_color_features
+    :param image: PIL Image object
+    :param band_deg: size of the rainbow band partition in degrees
+    :param max_pixels: optional pixel budget for large images, see sample_pixels; None to use every pixel
+    :param sampling: the sampling method to stay within max_pixels, see sample_pixels
+    :param seed: seed for the 'random' sampling method
+    :param out: optional buffer to read the pixels into, to reuse from one image to the next
+    :return: the features
+    """
+    if max_pixels is None:
+        pixels = image_to_pixels(image, out)
+    else:
+        pixels = sample_pixels(image, max_pixels, sampling, seed, out)
+    return get_pixels_color_features(pixels, band_deg)
+#end def
+
 #get the primary color band from a bands dictionary to use for the hue partition
 def get_primary_band(bands:dict)->int:
     """
@@ -140,4 +454,8 @@ def get_primary_band(bands:dict)->int:
     :return: the primary band
     """
     return max(bands, key=bands.get) # I THINK I grok this one
- 
\ No newline at end of file
+ 
+if __name__ == '__main__':
+    # python -m rainbow_util analyze <dir>, see batch_analyzer
+    from batch_analyzer import main
+    main()
@@ -0,0 +1,102 @@
+# %% Check the array-backed band extraction against the original per-pixel loop
+import math
+import os
+from PIL import Image
+from rainbow_util import *
+
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+
+# the array version must return exactly the same bands and perceived brightness, not just close enough
+for band_deg in [30, 40, 60]:
+    for image_file in image_list:
+        image = Image.open(image_path + image_file)
+        expected = get_image_rainbow_bands_and_perceived_brightness_per_pixel(image, band_deg)
+        actual = get_image_rainbow_bands_and_perceived_brightness(image, band_deg)
+        assert actual == expected, f'{image_file} @ {band_deg}º: {actual} != {expected}'
+    #end for
+#end for
+print(f'{len(image_list)} covers match')
+
+# %% Also check the corner cases the covers don't hit: black, white, grays only and a single pixel
+for colors in [[(0, 0, 0)], [(255, 255, 255)], [(12, 12, 12), (200, 200, 200)], [(255, 0, 0)], [(255, 0, 1)]]:
+    image = Image.new('RGB', (len(colors), 1))
+    image.putdata(colors)
+    assert get_image_rainbow_bands_and_perceived_brightness(image, 30) \
+        == get_image_rainbow_bands_and_perceived_brightness_per_pixel(image, 30), colors
+#end for
+
+# %% The features object holds the same bands and brightness, plus the primary band, vividity and hue variance
+for image_file in image_list[:10]:
+    image = Image.open(image_path + image_file)
+    bands, pb = get_image_rainbow_bands_and_perceived_brightness_per_pixel(image, 30)
+    features = get_image_color_features(image, 30)
+    assert (features.bands_dict(), features.pb) == (bands, pb)
+    assert features.primary_band == get_primary_band(bands)
+    assert 0 <= features.vividity <= 1 and 0 <= features.hue_variance <= 1
+#end for
+
+# all red: all vivid, no hue variance; red and cyan: opposite sides of the color wheel, all the variance
+red = get_pixels_color_features(np.array([[220, 20, 20]] * 4, dtype=np.uint8), 30)
+assert (red.vividity, red.vivid_pixels, round(red.hue_variance, 9)) == (1.0, 4, 0.0)
+red_cyan = get_pixels_color_features(np.array([[220, 20, 20], [20, 220, 220], [0, 0, 0]], dtype=np.uint8), 30)
+assert red_cyan.vividity == 2 / 3 and round(red_cyan.hue_variance, 9) == 1.0
+# no vivid pixels, the bands fall back to the brightness of all of them
+gray = get_pixels_color_features(np.array([[12, 12, 12], [200, 200, 200]], dtype=np.uint8), 30)
+assert (gray.vividity, gray.hue_variance) == (0.0, 0.0)
+print(red, red_cyan, gray, sep='\n')
+# bands that don't divide the color wheel evenly would leave out the pixels of the last, partial band
+for band_deg in [0, 50, 7]:
+    try:
+        get_pixels_color_features(np.array([[220, 20, 20]], dtype=np.uint8), band_deg)
+        assert False
+    except ValueError:
+        pass
+#end for
+
+# %% Reading the pixels without converting the image gives the same pixels as converting it, whatever its mode
+rng = np.random.default_rng(0)
+rgb = Image.fromarray(rng.integers(0, 256, (40, 30, 3), dtype=np.uint8), 'RGB')
+short_palette = Image.fromarray(rng.integers(0, 256, (40, 30), dtype=np.uint8), 'P')
+short_palette.putpalette([10, 20, 30] * 16)
+buffer = PixelBuffer()
+for image in [rgb, rgb.convert('L'), rgb.quantize(50), short_palette, rgb.convert('CMYK'),
+        Image.fromarray(rng.integers(0, 256, (40, 30, 4), dtype=np.uint8), 'CMYK'), rgb.convert('RGBA'),
+        Image.open(image_path + image_list[0])]:
+    expected = np.asarray(image.convert('RGB')).reshape(-1, 3)
+    assert np.array_equal(image_to_pixels(image), expected), image.mode
+    assert np.array_equal(image_to_pixels(image, buffer), expected), image.mode
+#end for
+# the buffer gets reused rather than reallocated
+assert image_to_pixels(rgb, buffer).base is image_to_pixels(rgb.convert('L'), buffer).base
+
+# %% Sampling stays within the pixel budget, uses nearly all of it, and keeps the colors of the full image
+for (size, mode) in [((225, 225), 'RGB'), ((300, 168), 'RGB'), ((1000, 37), 'RGB'), ((500, 400), 'P')]:
+    image = Image.open(image_path + image_list[3]).convert('RGB').resize(size)
+    image = image.quantize(64) if mode == 'P' else image
+    full = get_pixels_color_features(image_to_pixels(image), 30)
+    for max_pixels in [1024, 4096, 10_000]:
+        for sampling in ['thumbnail', 'stride', 'random']:
+            pixels = sample_pixels(image.copy(), max_pixels, sampling)
+            n = size[0] * size[1]
+            # the thumbnail within a row or column of the budget, the stride within a whole step of it
+            least = {'thumbnail': max_pixels - max(size) * math.sqrt(max_pixels / n) - 1,
+                'stride': n / math.ceil(n / max_pixels), 'random': max_pixels}[sampling]
+            assert least <= len(pixels) <= max_pixels, (size, max_pixels, sampling, len(pixels))
+            # the same brightness and spread over the bands, give or take; averaging blends the colors a bit
+            sampled = get_pixels_color_features(pixels, 30)
+            assert abs(sampled.pb - full.pb) < 0.02, (size, max_pixels, sampling)
+            assert np.abs(sampled.all_bands / sampled.pixels - full.all_bands / full.pixels).sum() < 0.1, \
+                (size, max_pixels, sampling)
+        #end for
+    #end for
+#end for
+# a JPEG that gets decoded at a reduced size first, still the whole budget
+for max_pixels in [1000, 4096, 12_000]:
+    pixels = sample_pixels(Image.open(image_path + image_list[3]), max_pixels)
+    assert max_pixels - math.sqrt(max_pixels) - 1 <= len(pixels) <= max_pixels, (max_pixels, len(pixels))
+#end for
+# small enough images are used whole
+assert len(sample_pixels(Image.open(image_path + image_list[3]), 225 * 225)) == 225 * 225
+
+# %%
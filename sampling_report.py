@@ -0,0 +1,44 @@
+# %% How far do the primary band and perceived brightness move when only a sample of the pixels is analyzed?
+import os
+import time
+import numpy as np
+from PIL import Image
+from rainbow_util import *
+
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+band_deg = 30
+
+# the full resolution results to compare against
+full_results = {}
+start = time.perf_counter()
+for image_file in image_list:
+    bands, pb = get_image_rainbow_bands_and_perceived_brightness(Image.open(image_path + image_file), band_deg)
+    full_results[image_file] = (get_primary_band(bands), pb)
+#end for
+full_s = time.perf_counter() - start
+print(f'full resolution: {full_s*1000:.0f}ms for {len(image_list)} covers')
+
+# %%
+# the perceived brightness is in [0, 1] space, so the deltas are absolute
+print(f'{"sampling":>10} {"pixels":>7} {"band changed":>13} {"mean Δpb":>9} {"max Δpb":>8} {"time":>7}')
+for sampling in ['thumbnail', 'stride', 'random']:
+    for max_pixels in [256, 1024, 4096, 16384]:
+        band_changes = 0
+        pb_deltas = []
+        start = time.perf_counter()
+        for image_file in image_list:
+            # open the image fresh every time, the thumbnail sampling changes how it gets decoded
+            bands, pb = get_image_rainbow_bands_and_perceived_brightness(Image.open(image_path + image_file),
+                band_deg, max_pixels, sampling)
+            full_band, full_pb = full_results[image_file]
+            band_changes += get_primary_band(bands) != full_band
+            pb_deltas.append(abs(pb - full_pb))
+        #end for
+        elapsed_s = time.perf_counter() - start
+        print(f'{sampling:>10} {max_pixels:>7} {band_changes/len(image_list):>12.0%} ' \
+            + f'{np.mean(pb_deltas):>9.4f} {np.max(pb_deltas):>8.4f} {elapsed_s*1000:>5.0f}ms')
+    #end for
+#end for
+
+# %%
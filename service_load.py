@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+from typing import Optional
+from urllib.parse import quote, urlsplit
+from instrumentation import Metrics
+from cover_cache import CoverCache
+from cover_service import ServiceThread
+from test_server import serve_directory
+
+
+class ServiceClient:
+    '''A keep-alive connection to the cover service, one request at a time'''
+    def __init__(self, url:str):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self._reader = None
+        self._writer = None
+
+    async def request(self, method:str, path:str, payload:Optional[dict]=None)->tuple:
+        '''Send a request, with payload as the JSON body
+        :return: a tuple with the status code and the JSON response'''
+        if self._writer is None:
+            (self._reader, self._writer) = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        self._writer.write((f'{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n'
+            + f'Content-Length: {len(body)}\r\n\r\n').encode() + body)
+        await self._writer.drain()
+        status = int((await self._reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            (name, _, value) = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        #end while
+        response = await self._reader.readexactly(int(headers['content-length']))
+        if headers.get('connection') == 'close':
+            self.close()
+        return status, json.loads(response)
+
+    def close(self)->None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+async def generate_load(service_url:str, cover_urls:list, clients:int=32, requests:int=50, batch:int=8,
+        seed:int=0)->Metrics:
+    '''Have a number of clients hit the service at the same time, each sending its requests back to back.
+    The covers of a request are picked at random, the popular ones more often (like albums on playlists),
+    so the clients keep asking for the same covers at around the same time
+    :param service_url: the service's base url
+    :param cover_urls: the cover urls to ask for
+    :param clients: number of concurrent clients
+    :param requests: requests per client
+    :param batch: covers per request
+    :param seed: seed for picking the covers
+    :return: the Metrics with the request latencies (the 'request' stage) and the counts of covers and errors'''
+    metrics = Metrics()
+    rng = random.Random(seed)
+    # Zipf-like popularity
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(cover_urls))))
+
+    async def client()->None:
+        connection = ServiceClient(service_url)
+        try:
+            for i in range(requests):
+                urls = rng.choices(cover_urls, cum_weights=cum_weights, k=batch)
+                start = time.perf_counter()
+                (status, response) = await connection.request('POST', '/analyze', {'urls': urls})
+                metrics.record('request', time.perf_counter() - start)
+                metrics.count('covers', len(urls))
+                if status != 200:
+                    metrics.count('failed_requests')
+                else:
+                    metrics.count('errors', sum('error' in result for result in response['results']))
+            #end for
+        finally:
+            connection.close()
+    #end def
+
+    await asyncio.gather(*[client() for i in range(clients)])
+    metrics.stop()
+    return metrics
+
+def run_load(clients:int=32, requests:int=50, batch:int=8, albums:int=1000, analysis_workers:Optional[int]=None,
+        batch_size:int=16, cache:bool=False, service_url:Optional[str]=None, image_path:str='test_covers/')->Metrics:
+    '''Load test the cover service, all local: a static file server serves the test covers (under albums different
+    urls, so there's more to it than a handful of covers) and the service runs in a background thread,
+    unless service_url points to one that's already running
+    :return: the Metrics of the load generator, see generate_load'''
+    (server, base_url) = serve_directory(image_path)
+    image_list = sorted(os.listdir(image_path))
+    cover_urls = [f'{base_url}{quote(image_list[i % len(image_list)])}?album={i}'
+        for i in range(albums)]
+    service = None
+    if service_url is None:
+        service = ServiceThread(analysis_workers=analysis_workers, batch_size=batch_size,
+            cache=CoverCache(':memory:') if cache else None).start()
+        service_url = service.url
+    try:
+        metrics = asyncio.run(generate_load(service_url, cover_urls, clients, requests, batch))
+        if service is not None:
+            print(service.service.stats)
+    finally:
+        if service is not None:
+            service.stop()
+        server.shutdown()
+    return metrics
+
+def main(argv:Optional[list]=None)->None:
+    parser = argparse.ArgumentParser(description='Load test the cover analysis service, no internet needed')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=50, help='requests per client')
+    parser.add_argument('--batch', type=int, default=8, help='covers per request')
+    parser.add_argument('--albums', type=int, default=1000, help='distinct cover urls')
+    parser.add_argument('--workers', type=int, default=None, help='analysis processes (default: one per CPU)')
+    parser.add_argument('--batch-size', type=int, default=16, help='the most covers per batch of analysis')
+    parser.add_argument('--cache', action='store_true', help='give the service an in-memory cache')
+    parser.add_argument('--url', help='load test the service running at this url instead of starting one')
+    args = parser.parse_args(argv)
+    metrics = run_load(args.clients, args.requests, args.batch, args.albums, args.workers, args.batch_size,
+        args.cache, args.url)
+    print(metrics.report())
+    print(f'{len(metrics.timings["request"]) / metrics.elapsed:.0f} requests/s, '
+        + f'{metrics.counters["covers"] / metrics.elapsed:.0f} covers/s')
+#end def
+
+if __name__ == '__main__':
+    main()
@@ -3,18 +3,16 @@ import os
 from IPython.display import display
 from typing import Tuple
 import webbrowser
+import numpy as np
 import pandas as pd
 from PIL import Image
 import pprint
+from cover_cache import CoverCache
+from rainbow_util import ColumnAccumulator
+from html_render import format_rows, write_html
 
 #%%
 
-def append_row(df:pd.DataFrame, row:list)->None:
-    '''Append a row to a dataframe
-    :param df: dataframe to append to
-    :param row: row to append'''
-    df.loc[len(df.index)] = row
-
 def normalize_color(rgb:tuple) -> tuple:
     """
     Normalize [0,255] color to [0,1] space
@@ -159,8 +157,8 @@ def render_images(df:pd.DataFrame)->str:
     
     #define the html div template
     div_template = '<img title="band: {band}, pb: {pb}" src="{image_fqp}" />'
-    # apply the template to each row, return the results as a series, then concatenate the series to a string
-    divs = df.apply(div_template.format_map, axis=1, result_type='reduce').str.cat(sep='\n')
+    # format the template a column at a time, then concatenate the series to a string
+    divs = format_rows(df, div_template).str.cat(sep='\n')
     return divs
 #end def
 
@@ -172,43 +170,36 @@ def render_images(df:pd.DataFrame)->str:
 image_path = 'test_covers/'
 image_list = os.listdir(image_path)
 
-df = pd.DataFrame(
-    columns=['image_fqp', 'band', 'pb'])
+rows = ColumnAccumulator({'image_fqp': object, 'band': np.int64, 'pb': np.float64}, capacity=len(image_list))
 
 band_deg = 30
 
 # for each image, filter out the vivid pixels and extract the hue band for each
 # then get the hue and perceived lightness of each colors
 # and add to the dataframe
+# covers analyzed in a previous run come straight out of the cache
+cache = CoverCache()
 for image_file in image_list:
     image_fqp = image_path + image_file
-    image = Image.open(image_fqp)
-    bands, pb = get_image_rainbow_bands_and_perceived_brightness(image, band_deg)
-    primary_band = get_primary_band(bands)
+    with open(image_fqp, 'rb') as f:
+        bands, pb, primary_band = cache.get_or_analyze(f.read(), band_deg, image_fqp)
     row = [image_fqp, primary_band, pb]
-    append_row(df, row)
+    rows.append(row)
 # end for
+print(cache)
 
 #sort the dataframe by the hue band and perceived brightness
-df = df.sort_values(by=['band', 'pb'])
+df = rows.to_dataframe().sort_values(by=['band', 'pb'])
 
 # %%
 # generate the HTML
 
 #define the html div template
 div_template = '<img title="band: {band}, pb: {pb}" src="{image_fqp}" />'
-# apply the template to each row, return the results as a series, then concatenate the series to a string
-divs = df.apply(div_template.format_map, axis=1, result_type='reduce').str.cat(sep='\n')
-
-ht = \
-'''<style>img {width: 200px; display:block;}</style>
-<h2>Arrange by Primary Vivid Hue Band, then Sort by Perceived Brightness</h2>
-''' + divs
-
-# output the HTML to a file
-with open('sorted_albums_test.html', 'w') as f:
-    f.write(ht)
-#end with
+
+# write the images straight to the file, a chunk at a time
+write_html('sorted_albums_test.html', df, div_template, head='<style>img {width: 200px; display:block;}</style>',
+    header='<h2>Arrange by Primary Vivid Hue Band, then Sort by Perceived Brightness</h2>', lazy=True)
 # open the file in the browser
 webbrowser.open('file://' + os.path.realpath('sorted_albums_test.html'))
 
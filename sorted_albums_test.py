@@ -2,39 +2,15 @@
 import os
 from typing import Tuple
 import webbrowser
-from colorthief import ColorThief
-from color_utility import vividity
+import numpy as np
 import pandas as pd
+from PIL import Image
+from rainbow_util import ColumnAccumulator, image_to_pixels
+from palette import get_prime_and_vivid_colors
+from html_render import format_rows
 
 #%%
 
-def append_row(df:pd.DataFrame, row:list)->None:
-    '''Append a row to a dataframe
-    :param df: dataframe to append to
-    :param row: row to append'''
-    df.loc[len(df.index)] = row
-
-
-def get_dominant_colors(image:str)->Tuple[Tuple[int, int, int], Tuple[int, int, int]]:
-    '''Get the dominant colors from an image using the ColorThief library
-    :param image: full path to the image or the image file itself
-    :return: a tuple of the dominant and dominant "vivid" colors as RGB tuples'''
-    color_thief = ColorThief(image)
-    # get the dominant colors
-    palette = color_thief.get_palette(quality=5, color_count=5) 
-    prime_color = palette[0]
-    # Find the first "vivid" color: saturation and relative luminance product between 0.1 and 0.9
-    vivid_color = None
-    for v in palette:
-        (_,_,p) = vividity(v)
-        if p > 0.1 and p < 0.9:
-            vivid_color = v
-            break
-    #end for
-    # if we didn't find a "vivid" color, use prime_color for both
-    return prime_color, vivid_color or prime_color
-#end def
-
 def rgb_to_hue_luminance_brightness(rgb:tuple)->Tuple[float, float, float]:
     '''Convert an RGB color to a hue, luminance and perceived brightness as per 
     standard HSV/HSL theory (https://en.wikipedia.org/wiki/HSL_and_HSV#From_RGB), 
@@ -84,8 +60,8 @@ def sort_and_render_images(df:pd.DataFrame, hue_column: str, lightness_column:st
 
     #define the html div template
     div_template = '<img title="prime:{prime_color}, vivid:{vivid_color}, part:{vivid_hue_part}, lum:{prime_lum}, pb:{prime_pb}" src="{image_fqp}" />'
-    # apply the template to each row, return the results as a series, then concatenate the series to a string
-    divs = ldf.apply(div_template.format_map, axis=1, result_type='reduce').str.cat(sep='\n')
+    # format the template a column at a time, then concatenate the series to a string
+    divs = format_rows(ldf, div_template).str.cat(sep='\n')
     return divs
 #end def
 
@@ -97,24 +73,27 @@ def sort_and_render_images(df:pd.DataFrame, hue_column: str, lightness_column:st
 image_path = 'test_covers/'
 image_list = os.listdir(image_path)
 
-df = pd.DataFrame(
-    columns=['image_fqp', 
-        'prime_color', 'prime_hue', 'prime_lum', 'prime_pb', 
-        'vivid_color', 'vivid_hue', 'vivid_lum', 'vivid_pb'])
+rows = ColumnAccumulator({'image_fqp': object, 
+        'prime_color': object, 'prime_hue': np.float64, 'prime_lum': np.float64, 'prime_pb': np.float64, 
+        'vivid_color': object, 'vivid_hue': np.float64, 'vivid_lum': np.float64, 'vivid_pb': np.float64}, 
+    capacity=len(image_list))
+
+# extract the top color as well as the top "vivid" color of each image, the same colors ColorThief's
+# get_palette(quality=5, color_count=5) gives, for all the images in one go
+pixels = [image_to_pixels(Image.open(image_path + image)) for image in image_list]
+dominant_colors = get_prime_and_vivid_colors(pixels, color_count=5, quality=5)
 
-# for each image, extract the top color as well as the top "vivid" color 
 # then get the hue and perceived lightness of each colors
 # and add to the dataframe
-for image in image_list:
-    #get the image file object
+for (image, (prime_color, vivid_color)) in zip(image_list, dominant_colors):
     image_fqp = image_path + image
-    prime_color, vivid_color = get_dominant_colors(image_fqp)
     prime_hue, prime_lum, prime_pb = rgb_to_hue_luminance_brightness(prime_color)
     vivid_hue, vivid_lum, vivid_pb = rgb_to_hue_luminance_brightness(vivid_color)
     row = [image_fqp, 
         prime_color, prime_hue, prime_lum, prime_pb, 
         vivid_color, vivid_hue, vivid_lum, vivid_pb]
-    append_row(df, row)
+    rows.append(row)
+df = rows.to_dataframe()
 
 # The color wheel is centered on red at 0 degrees, but some of the colors near 360 
 # are also closer to red than violet, so shift the hue to capture these as 'red'
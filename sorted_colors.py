@@ -149,6 +149,9 @@ import math
 import colorsys 
 import pandas as pd
 import numpy as np
+from color_utility import enrich_colors
+from color_sort import ColorSorter
+from html_render import format_rows
 
 # Define various lightness formulae
 
@@ -186,24 +189,25 @@ def hsp(rgb:tuple) -> float:
     return math.sqrt(0.299 * r * r + 0.587 * g * g + 0.114 * b * b)
 
 
-def generate_random_colors(n:int)-> list:
+def generate_random_colors(n:int)-> np.ndarray:
     """
-    Generate a list of n random colors in the range [0, 1] as a r, g, b, tuple
+    Generate n random colors in the range [0, 1] as an (n, 3) array of r, g, b rows
     """
-    return [tuple(np.random.rand(3)) for i in range(n)]
+    return np.random.rand(n, 3)
 
 def enrich_color(rgb:tuple) -> tuple:
     """
     Enrich a color tuple with the hsl, y_luma, luminance, and hsp values returning a tuple with a layout of 
     (r, g, b, h, s, l, y, lum, p)
-    Each of these could probably be vectorized and done individually in generate_color_df 🤷🏻‍♂️
+    See color_utility.enrich_colors for the vectorized version that does a whole array of colors at once
     """
     return rgb + hsl(rgb) + (y_luma(rgb),) + (luminance(rgb),) + (hsp(rgb),)
 
-def generate_color_df(colors:list, partition_degrees: int)-> pd.DataFrame:
+def generate_color_df(colors, partition_degrees: int)-> pd.DataFrame:
     """
-    Convert a list of [0, 1] enriched color tuples with a (r, g, b, h, s, l, y, lum, p) layout to a fleshed out 
-    dataframe with [0, 255] rgb values, hsl, "corrected" hue, hue partition index, and various lightness values
+    Convert a list of [0, 1] enriched color tuples with a (r, g, b, h, s, l, y, lum, p) layout, or the same as 
+    an (N, 9) array, to a fleshed out dataframe with [0, 255] rgb values, hsl, "corrected" hue, hue partition 
+    index, and various lightness values
     """
     df = pd.DataFrame(colors, columns=['r', 'g', 'b', 'h', 's', 'l', 'y', 'lum', 'p'])
     # convert rgb to [0, 255] space and hue to degrees
@@ -221,17 +225,25 @@ def generate_color_df(colors:list, partition_degrees: int)-> pd.DataFrame:
 
     return df
 
-def sort_and_render_colors(df:pd.DataFrame, lightness_column:str)-> pd.DataFrame:
+def sort_and_render_colors(df:pd.DataFrame, lightness_column:str, sorter:ColorSorter=None, 
+        partition_degrees:int=40)-> pd.DataFrame:
     """
-    Sort the the dataframe by the hue partition and the chosen lightness column then render the colors as html divs
+    Sort the the dataframe by the hue partition and the chosen lightness column then render the colors as html divs.
+    With a ColorSorter of the same colors the order comes from its packed sort keys, one argsort on the arrays
+    it already has, instead of sorting a copy of the dataframe. The partitions shown are then the sorter's,
+    worked out from the unrounded hue, so they match the order
     """
-    ldf = df.copy().sort_values(by=['h_part', lightness_column])
+    if sorter is not None:
+        order = sorter.order(lightness_column, partition_degrees)
+        ldf = df.iloc[order].assign(h_part=sorter.bands(partition_degrees)[order].astype(int))
+    else:
+        ldf = df.copy().sort_values(by=['h_part', lightness_column])
 
     #define the html div template
     div_template = '<div style="background-color:rgb({r},{g},{b});" title="hsl({h},{s},{l}) =&gt; {h_part}.{' \
         + lightness_column + '}">&nbsp;</div>'
-    # apply the template to each row, return the results as a series, then concatenate the series to a string
-    divs = ldf.apply(div_template.format_map, axis=1, result_type='reduce').str.cat(sep='\n')
+    # format the template a column at a time, then concatenate the series to a string
+    divs = format_rows(ldf, div_template).str.cat(sep='\n')
     return divs
 
 # %% [markdown]
@@ -244,21 +256,26 @@ def sort_and_render_colors(df:pd.DataFrame, lightness_column:str)-> pd.DataFrame
 
 # %%
 rgbs = generate_random_colors(400)
-# enrich the tuples THEN generate the dataframe - this would likely be faster to do as vectorized functions in 
-# the dataframe conversion process but favoring simplicity over performance here
-enriched_colors = [enrich_color(rgb) for rgb in rgbs]
+# enrich the colors THEN generate the dataframe. enrich_colors does the same as enrich_color above, but for 
+# all the colors at once as array operations, so this scales to a million colors in about a second
+enriched_colors = enrich_colors(rgbs)
 cdf = generate_color_df(enriched_colors, partition_degrees=40)
+# or work out everything about the colors once, OKLab and CIELAB included, and sort each column with a single 
+# argsort of packed (band, lightness) keys off the same arrays
+sorter = ColorSorter(rgbs)
+cdf['ok_l'] = sorter.columns['ok_l'].round(3)
 
 # generate the HTML table
 ht = \
 '''<style>td {width: 150px;} td>div {height: 5px;}</style>
 <table>
-    <tr><th>YIQ Luma</th><th>HSL Lightness</th><th>Luminance</th><th>HSP Lightness</th></tr>
+    <tr><th>YIQ Luma</th><th>HSL Lightness</th><th>Luminance</th><th>HSP Lightness</th><th>OKLab Lightness</th></tr>
     <tr>''' \
-    + f'<td>{sort_and_render_colors(cdf, "y")}</td>' \
-    + f'<td>{sort_and_render_colors(cdf, "l")}</td>' \
-    + f'<td>{sort_and_render_colors(cdf, "lum")}</td>' \
-    + f'<td>{sort_and_render_colors(cdf, "p")}</td>' \
+    + f'<td>{sort_and_render_colors(cdf, "y", sorter)}</td>' \
+    + f'<td>{sort_and_render_colors(cdf, "l", sorter)}</td>' \
+    + f'<td>{sort_and_render_colors(cdf, "lum", sorter)}</td>' \
+    + f'<td>{sort_and_render_colors(cdf, "p", sorter)}</td>' \
+    + f'<td>{sort_and_render_colors(cdf, "ok_l", sorter)}</td>' \
     + '''
     </tr>
 </table>'''
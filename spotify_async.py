@@ -0,0 +1,312 @@
+import asyncio
+import json
+import ssl
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Optional
+from urllib.parse import urlencode, urlsplit
+import spotipy
+import spotipy.util as util
+from playlist_io import PAGE_SIZE, TRACK_FIELDS
+
+API_URL = 'https://api.spotify.com/v1'
+# the methods that are safe to send again when a connection drops before the response: sending them twice
+# does the same as once, unlike a POST that adds tracks
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+
+class HTTPError(Exception):
+    '''A non-2xx response to a plain (non API) request, e.g. an image fetch'''
+    def __init__(self, status:int, url:str):
+        super().__init__(f'{status} for {url}')
+        self.status = status
+        self.url = url
+
+
+class _NotSent(ConnectionError):
+    '''The connection failed while sending the request, so the server can't have answered it'''
+
+
+class ConnectionPool:
+    '''HTTP/1.1 keep-alive connections, kept open per host and reused from one request to the next, with a
+    cap on the number of requests going to a host at the same time. Just enough HTTP for JSON APIs and
+    images: requests with a body of known length, responses with a Content-Length, chunked or with no body.
+    When a connection that sat idle turns out to be closed, the request goes again on a new one, but only if
+    it's idempotent or never got sent'''
+    def __init__(self, max_per_host:int=8, timeout:float=10.0, ssl_context:Optional[ssl.SSLContext]=None):
+        '''
+        :param max_per_host: the most requests (and so connections) to a host at the same time
+        :param timeout: seconds to wait for a connection or a response
+        :param ssl_context: for https, the default context if None
+        '''
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self._idle = {}
+        self._limits = {}
+        self.requests = 0
+        self.connections = 0
+
+    async def _open(self, host:tuple)->tuple:
+        (scheme, hostname, port) = host
+        context = (self.ssl_context or ssl.create_default_context()) if scheme == 'https' else None
+        self.connections += 1
+        return await asyncio.wait_for(asyncio.open_connection(hostname, port, ssl=context), self.timeout)
+
+    async def _exchange(self, connection:tuple, request:bytes, method:str)->tuple:
+        (reader, writer) = connection
+        try:
+            writer.write(request)
+            await writer.drain()
+        except ConnectionError as e:
+            raise _NotSent(str(e)) from e
+        status = 100
+        # skip any interim (1xx) responses, the real one comes after them
+        while 100 <= status < 200:
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError('connection closed before a response')
+            status = int(status_line.split()[1])
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                (name, _, value) = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            #end while
+        #end while
+        if method == 'HEAD' or status in (204, 304):
+            # never a body, whatever the headers say
+            body = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # the (empty) trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            #end while
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            # no length, the body goes on until the connection closes
+            body = await reader.read()
+            headers['connection'] = 'close'
+        return status, headers, body
+
+    async def request(self, method:str, url:str, headers:Optional[dict]=None, body:bytes=b'')->tuple:
+        '''Send a request over a pooled connection
+        :param method: the HTTP method
+        :param url: the full url
+        :param headers: extra request headers
+        :param body: the request body
+        :return: a tuple with the status code, the response headers (lower case names) and the body'''
+        parts = urlsplit(url)
+        host = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        lines = [f'{method} {target} HTTP/1.1', f'Host: {parts.netloc}', f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for (name, value) in (headers or {}).items()]
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode() + body
+        limit = self._limits.setdefault(host, asyncio.Semaphore(self.max_per_host))
+        async with limit:
+            idle = self._idle.setdefault(host, [])
+            self.requests += 1
+            while True:
+                reused = bool(idle)
+                connection = idle.pop() if reused else await self._open(host)
+                try:
+                    (status, response_headers, response_body) = \
+                        await asyncio.wait_for(self._exchange(connection, request, method), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    connection[1].close()
+                    # the server may have closed a connection that sat idle, try again on a new one; unless the
+                    # server could have got the request already and it isn't safe to send twice
+                    if reused and (isinstance(e, _NotSent) or method in IDEMPOTENT_METHODS):
+                        continue
+                    raise
+                except BaseException:
+                    connection[1].close()
+                    raise
+                break
+            #end while
+            if response_headers.get('connection', '').lower() == 'close':
+                connection[1].close()
+            else:
+                idle.append(connection)
+        #end with
+        return status, response_headers, response_body
+
+    async def close(self)->None:
+        '''Close the idle connections'''
+        writers = [writer for idle in self._idle.values() for (_, writer) in idle]
+        self._idle.clear()
+        for writer in writers:
+            writer.close()
+        for writer in writers:
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, ssl.SSLError):
+                pass
+        #end for
+
+    def __repr__(self)->str:
+        return f'{self.requests} requests over {self.connections} connections'
+
+
+def _get_id(kind:str, id:str)->str:
+    # like spotipy: an id, a spotify:...:kind:id uri or an open.spotify.com/kind/id url
+    if id.startswith('spotify:'):
+        return id.split(':')[-1]
+    if '://' in id:
+        return urlsplit(id).path.rstrip('/').split('/')[-1]
+    return id
+
+def _get_uri(kind:str, id:str)->str:
+    return id if id.startswith('spotify:') else f'spotify:{kind}:{_get_id(kind, id)}'
+
+
+class AsyncSpotify:
+    '''An asyncio client for the few Spotify endpoints the rainbow sort uses, named and called like spotipy's,
+    plus fetching the cover images. All requests go over a shared ConnectionPool, so the API and the image CDN
+    each get a handful of keep-alive connections rather than a new one per request, and no more than
+    max_per_host requests at once. Rate limited (429) API requests wait as long as Retry-After says and try again.
+    Errors from the API raise spotipy.SpotifyException, same as with spotipy.
+    It's a library for code that runs on an event loop already; spotify_test.py sticks to spotipy.
+    Point api_url at a local server to test without Spotify'''
+    def __init__(self, token:str, api_url:str=API_URL, max_per_host:int=8, timeout:float=10.0,
+            max_retries:int=5, pool:Optional[ConnectionPool]=None):
+        '''
+        :param token: the OAuth access token, e.g. from util.prompt_for_user_token
+        :param api_url: the base url of the Web API
+        :param max_per_host: the most requests to a host at the same time
+        :param timeout: seconds to wait for a connection or a response
+        :param max_retries: how many times to retry a rate limited request
+        :param pool: the connection pool to use, by default one of its own
+        '''
+        self.token = token
+        self.api_url = api_url.rstrip('/')
+        self.max_retries = max_retries
+        self.pool = pool or ConnectionPool(max_per_host, timeout)
+
+    @classmethod
+    def from_prompt(cls, username:str, scope:str, client_id:str, client_secret:str, redirect_uri:str,
+            **client_args)->'AsyncSpotify':
+        '''Get the token once with util.prompt_for_user_token (cached by spotipy, so only the first time asks)
+        and make a client with it'''
+        token = util.prompt_for_user_token(username, scope, client_id=client_id, client_secret=client_secret,
+            redirect_uri=redirect_uri)
+        return cls(token, **client_args)
+
+    async def _api(self, method:str, path:str, params:Optional[dict]=None, payload:Optional[dict]=None)->dict:
+        url = f'{self.api_url}/{path}'
+        params = {name: value for (name, value) in (params or {}).items() if value is not None}
+        if params:
+            url += '?' + urlencode(params)
+        headers = {'Authorization': f'Bearer {self.token}'}
+        body = b''
+        if payload is not None:
+            headers['Content-Type'] = 'application/json'
+            body = json.dumps(payload).encode()
+        for attempt in range(self.max_retries + 1):
+            (status, response_headers, response_body) = await self.pool.request(method, url, headers, body)
+            if status != 429 or attempt == self.max_retries:
+                break
+            await asyncio.sleep(float(response_headers.get('retry-after', 1) or 1))
+        #end for
+        if status >= 400:
+            try:
+                message = json.loads(response_body)['error']['message']
+            except (ValueError, KeyError, TypeError):
+                message = response_body.decode(errors='replace')
+            raise spotipy.SpotifyException(status, -1, f'{url}:\n {message}', headers=response_headers)
+        return json.loads(response_body) if response_body else None
+
+    async def playlist(self, playlist_id:str, fields:Optional[str]=None, market:Optional[str]=None)->dict:
+        '''Same as spotipy.Spotify.playlist'''
+        return await self._api('GET', f'playlists/{_get_id("playlist", playlist_id)}',
+            {'fields': fields, 'market': market, 'additional_types': 'track'})
+
+    async def playlist_tracks(self, playlist_id:str, fields:Optional[str]=None, limit:int=100, offset:int=0,
+            market:Optional[str]=None)->dict:
+        '''Same as spotipy.Spotify.playlist_tracks'''
+        return await self._api('GET', f'playlists/{_get_id("playlist", playlist_id)}/tracks',
+            {'fields': fields, 'limit': limit, 'offset': offset, 'market': market, 'additional_types': 'track'})
+
+    async def user_playlist_create(self, user:str, name:str, public:bool=True, collaborative:bool=False,
+            description:str='')->dict:
+        '''Same as spotipy.Spotify.user_playlist_create'''
+        return await self._api('POST', f'users/{user}/playlists', payload={'name': name, 'public': public,
+            'collaborative': collaborative, 'description': description})
+
+    async def user_playlist_add_tracks(self, user:str, playlist_id:str, tracks:list,
+            position:Optional[int]=None)->dict:
+        '''Same as spotipy.Spotify.user_playlist_add_tracks: add up to 100 tracks to a playlist'''
+        payload = {'uris': [_get_uri('track', track) for track in tracks]}
+        if position is not None:
+            payload['position'] = position
+        return await self._api('POST', f'playlists/{_get_id("playlist", playlist_id)}/tracks', payload=payload)
+
+    async def playlist_items(self, playlist_id:str, fields:str=TRACK_FIELDS, page_size:int=PAGE_SIZE,
+            total:Optional[int]=None, workers:int=4)->AsyncIterator[dict]:
+        '''The items of a playlist in order, like playlist_io.iter_playlist_items: the first page tells the
+        total (unless it's given) and then the rest of the pages get requested concurrently, as many at a time
+        as the pool allows per host, and never more than 2 * workers pages ahead of the consumer'''
+        start = 0
+        if total is None:
+            first_page = await self.playlist_tracks(playlist_id, f'{fields},total', page_size, 0)
+            total = first_page['total']
+            start = len(first_page['items'])
+            for item in first_page['items']:
+                yield item
+        #end if
+        pending = deque()
+        try:
+            for offset in range(start, total, page_size):
+                pending.append(asyncio.ensure_future(self.playlist_tracks(playlist_id, fields, page_size, offset)))
+                # only fetch a few pages ahead of the consumer
+                if len(pending) >= 2 * workers:
+                    for item in (await pending.popleft())['items']:
+                        yield item
+            #end for
+            while pending:
+                for item in (await pending.popleft())['items']:
+                    yield item
+        finally:
+            for page in pending:
+                page.cancel()
+    #end def
+
+    async def fetch_image(self, url:str)->bytes:
+        '''Download a cover image from the CDN
+        :return: the image file's bytes'''
+        (status, _, body) = await self.pool.request('GET', url)
+        if status >= 400:
+            raise HTTPError(status, url)
+        return body
+
+    async def close(self)->None:
+        await self.pool.close()
+
+    async def __aenter__(self)->'AsyncSpotify':
+        return self
+
+    async def __aexit__(self, *exc_info)->None:
+        await self.close()
+#end class
+
+def run(coroutine):
+    '''Run a coroutine to the end and return its result, also from a notebook cell, where an event loop is
+    already running (and asyncio.run refuses to): there it runs on a loop of its own in another thread'''
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coroutine).result()
+#end def
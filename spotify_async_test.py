@@ -0,0 +1,266 @@
+# %% The asyncio Spotify client against a local mock of the Web API and the image CDN, no internet needed
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+import spotipy
+import spotipy.util as util
+from spotify_async import AsyncSpotify, HTTPError, run
+
+image_path = 'test_covers/'
+image_list = sorted(os.listdir(image_path))
+TRACKS = [{'track': {'id': f'track{i:04d}', 'track_number': i % 12 + 1,
+    'album': {'images': [{'url': f'/images/{quote(image_list[i % len(image_list)])}'}]}}} for i in range(950)]
+
+
+class MockSpotify(BaseHTTPRequestHandler):
+    '''The endpoints the client uses, over keep-alive connections; counts the connections and the most
+    requests in flight at once'''
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    connections = 0
+    in_flight = 0
+    max_in_flight = 0
+    rate_limited = 0
+    playlists = {}
+    dropped = []
+
+    def setup(self):
+        super().setup()
+        with MockSpotify.lock:
+            MockSpotify.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status:int, payload=None, data:bytes=None, chunked:bool=False, headers:dict={}):
+        body = data if data is not None else json.dumps(payload).encode()
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(body), 1000):
+                chunk = body[start:start + 1000]
+                self.wfile.write(f'{len(chunk):x}\r\n'.encode() + chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def handle_request(self, method:str):
+        with MockSpotify.lock:
+            MockSpotify.in_flight += 1
+            MockSpotify.max_in_flight = max(MockSpotify.max_in_flight, MockSpotify.in_flight)
+        try:
+            time.sleep(0.01)
+            url = urlsplit(self.path)
+            query = {name: values[0] for (name, values) in parse_qs(url.query).items()}
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            parts = url.path.strip('/').split('/')
+            if parts[0] == 'images':
+                file_path = image_path + unquote(parts[1])
+                if not os.path.exists(file_path):
+                    return self.reply(404, data=b'')
+                with open(file_path, 'rb') as f:
+                    return self.reply(200, data=f.read())
+            if self.headers['Authorization'] != 'Bearer the-token':
+                return self.reply(401, {'error': {'status': 401, 'message': 'Invalid access token'}})
+            if parts == ['v1', 'playlists', 'busy']:
+                with MockSpotify.lock:
+                    MockSpotify.rate_limited += 1
+                    if MockSpotify.rate_limited % 2:
+                        return self.reply(429, {'error': {'status': 429, 'message': 'slow down'}},
+                            headers={'Retry-After': '0'})
+                return self.reply(200, {'name': 'busy'})
+            if parts == ['v1', 'playlists', 'hang-up']:
+                self.close_connection = True
+            if parts == ['v1', 'playlists', 'unchanged']:
+                # no body and no Content-Length, on a connection that stays open
+                self.send_response(204 if method == 'GET' else 304)
+                self.end_headers()
+                return
+            if method == 'POST' and parts == ['v1', 'playlists', 'dropped', 'tracks']:
+                # the tracks get added, then the connection drops before the response
+                MockSpotify.dropped += json.loads(body)['uris']
+                self.close_connection = True
+                return
+            if method == 'GET' and parts[:2] == ['v1', 'playlists'] and len(parts) == 3:
+                return self.reply(200, {'name': 'source', 'id': parts[2], 'tracks': {'total': len(TRACKS)}})
+            if method == 'GET' and parts[:2] == ['v1', 'playlists'] and parts[3:] == ['tracks']:
+                (offset, limit) = (int(query['offset']), int(query['limit']))
+                page = {'items': TRACKS[offset:offset + limit]}
+                if 'total' in query.get('fields', ''):
+                    page['total'] = len(TRACKS)
+                # the bigger pages come chunked, like the real thing does
+                return self.reply(200, page, chunked=offset % 200 == 0)
+            if method == 'POST' and parts[:2] == ['v1', 'users']:
+                playlist_id = f'new{len(MockSpotify.playlists)}'
+                MockSpotify.playlists[playlist_id] = []
+                return self.reply(201, dict(json.loads(body), id=playlist_id))
+            if method == 'POST' and parts[:2] == ['v1', 'playlists'] and parts[3:] == ['tracks']:
+                payload = json.loads(body)
+                tracks = MockSpotify.playlists[parts[2]]
+                position = payload.get('position', len(tracks))
+                tracks[position:position] = payload['uris']
+                return self.reply(201, {'snapshot_id': f'snapshot{len(tracks)}'})
+            return self.reply(404, {'error': {'status': 404, 'message': 'Not found.'}})
+        finally:
+            with MockSpotify.lock:
+                MockSpotify.in_flight -= 1
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '1000')
+        self.end_headers()
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), MockSpotify)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+base_url = f'http://127.0.0.1:{server.server_port}'
+
+# %% The token comes from prompt_for_user_token, once
+prompts = []
+prompt_for_user_token = util.prompt_for_user_token
+util.prompt_for_user_token = lambda *args, **kwargs: prompts.append(args) or 'the-token'
+try:
+    client = AsyncSpotify.from_prompt('user', 'playlist-modify-private', 'id', 'secret', 'http://localhost/',
+        api_url=base_url + '/v1', max_per_host=4)
+finally:
+    util.prompt_for_user_token = prompt_for_user_token
+assert client.token == 'the-token' and len(prompts) == 1
+
+# %% Read the playlist, create a new one, add the tracks and fetch the covers, all over a few connections
+async def sort_run(client:AsyncSpotify)->tuple:
+    async with client:
+        playlist = await client.playlist('spotify:user:someone:playlist:source', fields='name,tracks.total')
+        items = [item async for item in client.playlist_items('https://open.spotify.com/playlist/source?si=x')]
+        new_playlist = await client.user_playlist_create('user', 'rainbow', public=False, description='🌈')
+        track_ids = [item['track']['id'] for item in items]
+        for start in range(0, len(track_ids), 100):
+            await client.user_playlist_add_tracks('user', new_playlist['id'], track_ids[start:start + 100])
+        await client.user_playlist_add_tracks('user', new_playlist['id'], ['spotify:track:first'], position=0)
+        urls = sorted({base_url + item['track']['album']['images'][-1]['url'] for item in items})
+        covers = await asyncio.gather(*[client.fetch_image(url) for url in urls])
+    return playlist, items, new_playlist, urls, covers
+
+start = time.perf_counter()
+(playlist, items, new_playlist, urls, covers) = run(sort_run(client))
+print(f'{client.pool} in {time.perf_counter() - start:.2f}s, at most {MockSpotify.max_in_flight} at once')
+assert playlist == {'name': 'source', 'id': 'source', 'tracks': {'total': len(TRACKS)}}
+assert items == TRACKS
+assert new_playlist['name'] == 'rainbow' and new_playlist['public'] is False
+assert MockSpotify.playlists[new_playlist['id']] == ['spotify:track:first'] \
+    + [f'spotify:track:{item["track"]["id"]}' for item in TRACKS]
+for (url, data) in zip(urls, covers):
+    with open(image_path + unquote(url.split('/')[-1]), 'rb') as f:
+        assert data == f.read()
+#end for
+# the pages went out concurrently, but never more than 4 at a time, over the same 4 connections
+assert MockSpotify.max_in_flight == 4
+assert MockSpotify.connections == client.pool.connections == 4
+assert client.pool.requests == 2 + 10 + 1 + 10 + len(urls)
+
+# %% A big playlist gets fetched a few pages ahead of whoever reads it, not all at once
+async def ahead()->None:
+    async with AsyncSpotify('the-token', api_url=base_url + '/v1', max_per_host=8) as client:
+        items = client.playlist_items('source', page_size=50, workers=1)
+        for i in range(51):
+            await items.__anext__()
+        # the first page and the next two, of 19
+        await asyncio.sleep(0.2)
+        assert client.pool.requests == 3, client.pool
+        await items.aclose()
+    #end with
+#end def
+
+run(ahead())
+
+# %% Errors: the API's as SpotifyException, the CDN's as HTTPError; rate limits get retried
+async def errors()->None:
+    async with AsyncSpotify('the-token', api_url=base_url + '/v1') as client:
+        assert (await client.playlist('busy')) == {'name': 'busy'}
+        try:
+            await client._api('GET', 'nope')
+            assert False
+        except spotipy.SpotifyException as e:
+            assert e.http_status == 404 and 'Not found.' in e.msg
+        try:
+            await client.fetch_image(base_url + '/images/nope.jpg')
+            assert False
+        except HTTPError as e:
+            assert e.status == 404
+    #end with
+    async with AsyncSpotify('wrong-token', api_url=base_url + '/v1') as client:
+        try:
+            await client.playlist('source')
+            assert False
+        except spotipy.SpotifyException as e:
+            assert e.http_status == 401
+    #end with
+#end def
+
+run(errors())
+assert MockSpotify.rate_limited == 2
+
+# %% An idle connection the server closed in the meantime gets replaced
+async def stale()->None:
+    async with AsyncSpotify('the-token', api_url=base_url + '/v1', max_per_host=1) as client:
+        # the server hangs up after this one, without saying so in the response
+        await client.playlist('hang-up')
+        assert (await client.playlist('source'))['name'] == 'source'
+        assert client.pool.connections == 2 and client.pool.requests == 2
+    #end with
+#end def
+
+run(stale())
+
+# %% A POST isn't sent again when the connection drops after the server may have got it
+async def not_twice()->None:
+    async with AsyncSpotify('the-token', api_url=base_url + '/v1', max_per_host=1) as client:
+        await client.playlist('source')
+        try:
+            await client.user_playlist_add_tracks('user', 'dropped', ['track0001'])
+            assert False
+        except ConnectionError:
+            pass
+        assert client.pool.connections == 1
+    #end with
+#end def
+
+run(not_twice())
+assert MockSpotify.dropped == ['spotify:track:track0001']
+
+# %% Responses with no body: 204, 304 and to HEAD, over the same connection and without waiting for a timeout
+async def no_body()->None:
+    async with AsyncSpotify('the-token', api_url=base_url + '/v1', max_per_host=1, timeout=2) as client:
+        assert (await client.playlist('unchanged')) is None
+        (status, _, body) = await client.pool.request('PUT', base_url + '/v1/playlists/unchanged',
+            {'Authorization': 'Bearer the-token'})
+        assert status == 304 and body == b''
+        (status, headers, body) = await client.pool.request('HEAD', urls[0])
+        assert status == 200 and headers['content-length'] == '1000' and body == b''
+        assert (await client.playlist('source'))['name'] == 'source'
+        assert client.pool.connections == 1
+    #end with
+#end def
+
+start = time.perf_counter()
+run(no_body())
+assert time.perf_counter() - start < 1
+
+# %%
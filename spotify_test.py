@@ -1,13 +1,25 @@
 # %% Connect to Spotify and get the album covers for a given playlist
 
 import os
+from collections import deque
+import numpy as np
 import requests
 import spotipy
 import spotipy.util as util
 import pprint
-from PIL import Image
 from IPython.display import display
 from rainbow_util import *
+from cover_pipeline import DedupStats, analyze_unique_covers
+from cover_cache import CoverCache
+from playlist_io import PAGE_SIZE, PlaylistWriter, iter_playlist_items
+from html_render import write_html
+from feature_store import FeatureStore
+from rainbow_preview import RainbowPreview
+from color_sort import rainbow_sort_order
+from gradient_order import gradient_order
+from cover_index import CoverIndex, cover_signatures
+from playlist_sync import get_snapshot_id, save_snapshot, sync_playlist
+from instrumentation import recording, timer
 import webbrowser
 import creds
 
@@ -33,53 +45,79 @@ fields = 'name,tracks.total'
 #TODO: make user input
 source_playlist_id = 'spotify:user:spotifycharts:playlist:6h0WIgq1l6s9MJMbXvmJaJ'
 
-pl_results = sp.playlist(source_playlist_id, fields='name,tracks.total')
+pl_results = sp.playlist(source_playlist_id, fields='name,tracks.total,snapshot_id')
 pp.pprint(pl_results)
 
 playlist_name = pl_results['name']
 playlist_length = pl_results['tracks']['total']
-# %% Get the tracks from the playlist
-offset = 0
-playlist_items = []
-# loop through the playlist until we get all the tracks
-while offset < playlist_length:
-    # get the tracks from the playlist
-    batch = sp.playlist_tracks(source_playlist_id, offset=offset, 
-                fields='items(track(id,track_number,album(images)))')
-    batch_items = batch['items']
-    pp.pprint(batch_items)
-    offset += len(batch_items)
-    playlist_items.extend(batch_items)
-#end while
-
-# %% Get the album covers for the tracks, extract color info and sort the tracks
-df = pd.DataFrame(columns=['track_id', 'band', 'pb', 'track_number', 'img_url'])
-# loop through the tracks in the playlist and get the smallest album cover for each track
-#TODO: make this parallel to speed up the process?
-for item in playlist_items:
-    track = item['track']
-    track_id = track['id']
-    track_number = track['track_number']
-
-    # conveniently the album cover images are always sorted by size, so we can just get 
-    # the last one's url
-    cover_image_url = track['album']['images'][-1]['url']
-    # load the it as a PIL image
-    track_image = Image.open(requests.get(cover_image_url, stream=True).raw)
-
-    # get the bands and perceived brightness
-    bands, pb = get_image_rainbow_bands_and_perceived_brightness(track_image, band_deg=60)
-    primary_band = get_primary_band(bands)
-    # add the track to the dataframe
-    append_row(df, [track_id, primary_band, pb, track_number, cover_image_url])
-#end for
-
-# sort the dataframe by the hue band and perceived brightness and finally track number 
-# for multiple tracks from the same album
-df = df.sort_values(by=['band', 'pb', 'track_number'])
-
-#extract the resorted track_ids
-sorted_track_ids = df['track_id'].tolist()
+# %% Get the tracks from the playlist, get the album covers for the tracks, extract color info and sort the tracks
+# the tracks stream in a page at a time and the covers of the first page are being downloaded and analyzed 
+# while the later pages are still being fetched
+rows = ColumnAccumulator(TRACK_COLUMNS, capacity=playlist_length)
+# the tracks whose covers are on their way through the pipeline
+tracks = deque()
+
+def cover_image_urls():
+    for item in iter_playlist_items(sp, source_playlist_id, total=playlist_length):
+        tracks.append(item['track'])
+        # conveniently the album cover images are always sorted by size, so we can just get 
+        # the last one's url to get the smallest album cover for each track
+        yield item['track']['album']['images'][-1]['url']
+    #end for
+#end def
+
+# download the covers and get the bands and perceived brightness in parallel, only once per album cover,
+# and skip the covers we've seen in earlier runs altogether. The results come back in playlist order.
+# Every stage gets timed, for where the time goes see the report at the end;
+# wrap it in instrumentation.profiling('sort.prof') for a cProfile of the run
+dedup_stats = DedupStats()
+cover_cache = CoverCache()
+# A preview of the first screen of the rainbow gets rendered as soon as the first page of tracks is in, long
+# before the rest has been analyzed; it's the rainbow of what's in so far, rendered again after every page,
+# and settles as the rest comes in. The last one, after all the tracks, is the first screen of the final order
+safe_name = ''.join(filter(str.isalnum, playlist_name))
+preview = RainbowPreview(PAGE_SIZE)
+
+def write_preview():
+    write_html(f'{safe_name}_rainbow_preview.html', preview.to_dataframe(),
+        '<img title="band: {band}, pb: {pb}" src="{img_url}" />', title=f'🌈  {playlist_name} 🌈 ')
+#end def
+
+# every track's features also go into a memory-mapped FeatureStore as they come in, see the whole libraries cell.
+# The store only ever gets added to and this adds all of the playlist, so it starts over on every run rather
+# than getting the playlist again on top of the last run's; the covers come from the cache anyway
+library_path = f'{safe_name}_features.rbfs'
+for path in [library_path, library_path + '.urls']:
+    if os.path.exists(path):
+        os.remove(path)
+library = FeatureStore(library_path, band_deg=60)
+with recording() as run_metrics:
+    for cover in analyze_unique_covers(cover_image_urls(), band_deg=60, stats=dedup_stats, cache=cover_cache):
+        track = tracks.popleft()
+        # add the track to the rows for the dataframe
+        row = [track['id'], cover.primary_band, cover.pb, track['track_number'], cover.url]
+        rows.append(row)
+        preview.add(row)
+        library.add(track['id'], track['track_number'], cover.url, cover.bands, cover.pb, cover.vividity)
+        if len(rows) % PAGE_SIZE == 0:
+            write_preview()
+    #end for
+    write_preview()
+
+    # sort the dataframe by the hue band and perceived brightness and finally track number 
+    # for multiple tracks from the same album
+    with timer('dataframe'):
+        df = rows.to_dataframe()
+    # (a single argsort of packed band, pb and track number keys, same order as df.sort_values(by=SORT_KEY))
+    with timer('sort'):
+        df = df.iloc[rainbow_sort_order(df['band'].to_numpy(), df['pb'].to_numpy(), df['track_number'].to_numpy())]
+
+    #extract the resorted track_ids
+    sorted_track_ids = df['track_id'].tolist()
+#end with
+print(dedup_stats)
+print(cover_cache)
+print(run_metrics.report())
 
 # %%
 # create a Spotify Playlist
@@ -93,42 +131,70 @@ playlist_external_url = playlist['external_urls']['spotify']
 pp.pprint(playlist)
 
 # %% add the tracks to the playlist
-offset = 0
-while offset < playlist_length:
-    # Add the next batch of track ids - conveniently Python doesn't mind you asking for more than is available
-    batch = sp.user_playlist_add_tracks(user=user_id, playlist_id=playlist['id'], tracks=sorted_track_ids[offset:offset+100])
-    offset += 100
-#end while
+# a batch of 100 at a time, backing off when Spotify rate limits us; if this gets interrupted, running
+# the cell again adds the rest of the tracks rather than starting over
+playlist_writer = PlaylistWriter(sp, playlist['id'], checkpoint_path=f'.playlist_write_{playlist["id"]}.json')
+with recording(run_metrics):
+    playlist_writer.write(sorted_track_ids)
+print(playlist_writer)
+print(run_metrics.report())
+# remember what went into the playlist, so later runs only have to deal with the tracks added or removed since
+snapshot_path = f'.rainbow_snapshot_{playlist["id"]}.json'
+save_snapshot(snapshot_path, {'source_snapshot_id': pl_results['snapshot_id'], 'target_id': playlist['id'],
+    'target_snapshot_id': get_snapshot_id(sp, playlist['id']), 'band_deg': 60,
+    'rows': df[list(TRACK_COLUMNS)].to_dict('records')})
+# %% Later runs: bring the rainbow playlist up to date with the source playlist instead of creating a new one.
+# Only the covers of new tracks get analyzed, and the playlist just gets the new tracks inserted and 
+# the removed ones taken out
+# It changes the playlist on Spotify, so it only runs when asked to: set SYNC_PLAYLIST to True first
+SYNC_PLAYLIST = False
+if SYNC_PLAYLIST:
+    sync_stats = sync_playlist(sp, source_playlist_id, playlist['id'], snapshot_path, band_deg=60, cache=cover_cache)
+    print(sync_stats)
+else:
+    print('not syncing, set SYNC_PLAYLIST = True to bring the rainbow playlist up to date')
 # %% open the playlist in a browser
 webbrowser.open(playlist_external_url)
 # %% Local copy of the playlist - album-deduplified
 img_df = df.drop_duplicates(subset=['img_url'])
 
 img_template = '<img title="band: {band}, pb: {pb}" src="{img_url}" />'
-# apply the template to each row, return the results as a series, then concatenate the series to a string (phew)
-imgs = img_df.apply(img_template.format_map, axis=1, result_type='reduce').str.cat(sep='\n')
-
-ht = \
-f'''<html><head><title>{new_playlist_name}</title>
-<style>
-  body {{font-family:Arial; color:#fff; background-color:#000;text-align:center}}
-  div {{margin:0 auto; width:384px; max-width:384px}} 
-  img {{width: 64px; height:64px;}}
-</style>
-</head>
-<body><h1>{new_playlist_name}</h1>
-<div>
-{imgs}
-</div>
-</body></html>
-''' 
-
-# output the HTML to a file
-safe_name = ''.join(filter(str.isalnum, playlist_name))
+style = '''<style>
+  body {font-family:Arial; color:#fff; background-color:#000;text-align:center}
+  div {margin:0 auto; width:384px; max-width:384px} 
+  img {width: 64px; height:64px;}
+</style>'''
+
+# stream the images to the file a chunk at a time, the covers only load as they're scrolled into view
 file_name = f'{safe_name}_rainbow.html'
-with open(file_name, 'w') as f:
-    f.write(ht)
-#end with
+write_html(file_name, img_df, img_template, title=new_playlist_name, head=style, 
+    header=f'<h1>{new_playlist_name}</h1>\n<div>', footer='</div>', lazy=True)
 # open the file in the browser
 webbrowser.open('file://' + os.path.realpath(file_name))
-# %%
\ No newline at end of file
+# %% Whole libraries: keep the features in a memory-mapped FeatureStore, tens of bytes per track, and sort
+# and render straight off it. Other processes can open the same file and read it while it gets added to;
+# the tracks went in along with the rows of the dataframe, so nothing gets analyzed again
+with recording(run_metrics):
+    library.flush()
+    with timer('sort'):
+        library_order = library.sort_order()
+#end with
+print(run_metrics.report())
+# only the rows that get rendered, one per album, are turned into a dataframe
+write_html(f'{safe_name}_library_rainbow.html', library.to_dataframe(library.first_per_cover(library_order)),
+    img_template, title=new_playlist_name, head=style, header=f'<h1>{new_playlist_name}</h1>\n<div>',
+    footer='</div>', lazy=True)
+# %% Or as a smooth gradient rather than in bands: a nearest neighbor path through the covers' colors, with no
+# jumps at the band edges
+covers = library.first_per_cover(np.arange(len(library)))
+with recording(run_metrics), timer('gradient_order'):
+    gradient = covers[gradient_order(library.records['bands'][covers], library.records['pb'][covers], band_deg=60)]
+write_html(f'{safe_name}_gradient.html', library.to_dataframe(gradient), img_template, title=new_playlist_name,
+    head=style, header=f'<h1>{new_playlist_name}</h1>\n<div>', footer='</div>', lazy=True)
+# %% Covers that look like a given one, and the ones to go on to from it, across the whole library:
+# 7 byte signatures that keep all of a cover's colors in an in-process index, queries well under a millisecond
+cover_index = CoverIndex(cover_signatures(library.records['bands'][covers], library.records['pb'][covers]))
+cover_urls = library.to_dataframe(covers)['img_url']
+print(cover_urls.iloc[0], '->', cover_urls.iloc[cover_index.similar(0, 5)].tolist())
+print(cover_urls.iloc[0], '=>', cover_urls.iloc[cover_index.transitions(0, 5)].tolist())
+# %%
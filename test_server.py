@@ -0,0 +1,20 @@
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    '''Serve the files of a directory without logging every request, subclass it to count or slow down requests'''
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(directory:str, handler:type=QuietHandler)->tuple:
+    '''Serve a directory, e.g. the test covers, on a free local port from a background thread, so the tests and
+    the load generator don't need the internet
+    :param directory: the directory to serve
+    :param handler: the request handler, QuietHandler or a subclass of it
+    :return: a tuple with the server, to shut down when done, and its base url, ending in /'''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(handler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/'